@@ -183,12 +183,70 @@ CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
 TASK_PERIOD = env.str('TASK_PERIOD', '60')
 
+SNMP_POLLING_WORKERS = env.int('SNMP_POLLING_WORKERS', 1)
+
+NETCONF_POLLING_WORKERS = env.int('NETCONF_POLLING_WORKERS', 1)
+
+SNMP_ENGINE = env.str('SNMP_ENGINE', 'easysnmp')
+
+SNMP_TIMEOUT = env.int('SNMP_TIMEOUT', 1)
+
+SNMP_RETRIES = env.int('SNMP_RETRIES', 3)
+
+SNMP_INTERFACE_MODE = env.str('SNMP_INTERFACE_MODE', 'get')
+
+SNMP_CONDITIONAL_POLLING = env.bool('SNMP_CONDITIONAL_POLLING', False)
+
+NETCONF_INTERFACE_MODE = env.str('NETCONF_INTERFACE_MODE', 'get')
+
+POLLING_MODE = env.str('POLLING_MODE', 'local')
+
+POLLING_CHUNK_SIZE = env.int('POLLING_CHUNK_SIZE', 10)
+
+POLLING_SHARDS = env.int('POLLING_SHARDS', 16)
+
+SHARD_LEASE_TIMEOUT = env.int('SHARD_LEASE_TIMEOUT', 120)
+
+POLL_SCHEDULING = env.str('POLL_SCHEDULING', 'fixed')
+
+POLL_MAX_INTERVAL = env.int('POLL_MAX_INTERVAL', 1440)
+
 REDIS_HOST = env.str('REDIS_HOST')
 
 NETCONF_USER = env.str('NETCONF_USER', '')
 
 NETCONF_PASSWORD = env.str('NETCONF_PASSWORD', '')
 
+NETCONF_SESSION_IDLE_TIMEOUT = env.int('NETCONF_SESSION_IDLE_TIMEOUT', 0)
+
+SNMP_POLL_BUDGET = env.int('SNMP_POLL_BUDGET', 0)
+
+NETCONF_POLL_BUDGET = env.int('NETCONF_POLL_BUDGET', 0)
+
+CIRCUIT_BREAKER_CYCLES = env.int('CIRCUIT_BREAKER_CYCLES', 3)
+
+CYCLE_LOCK_MODE = env.str('CYCLE_LOCK_MODE', 'skip')
+
+CYCLE_LOCK_TIMEOUT = env.int('CYCLE_LOCK_TIMEOUT', 300)
+
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', 3600)
+
+TOPOLOGY_HISTORY_SIZE = env.int('TOPOLOGY_HISTORY_SIZE', 100)
+
+# CACHES
+# ------------------------------------------------------------------------------
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:6379/1',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # cache is only an optimization, so it is skipped when redis is not available
+            'IGNORE_EXCEPTIONS': True,
+        }
+    }
+}
+
 # ------------------------------------------------------------------------------
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
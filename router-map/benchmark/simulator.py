@@ -0,0 +1,346 @@
+import asyncio
+import ipaddress
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from unittest import mock
+
+from django.db import transaction
+from django.test import override_settings
+from easysnmp import exceptions
+from jnpr import junos
+from lxml.builder import E
+from pysnmp.proto.rfc1902 import ObjectName
+
+from data import redis_client
+from data.async_snmp import AsyncSnmpSession, AsyncSnmpTimeoutError
+from data.models import Device, Link
+from data.tasks import SnmpSession, NetconfSession, CHANGE_MARKER_OIDS, get_empty_poll_stats, check_links, \
+    measure_phase
+
+# addresses of simulated devices are taken from the network reserved for benchmarks (RFC 2544)
+SIMULATED_NETWORK = ipaddress.ip_network('198.18.0.0/15')
+
+PHYSICAL_INTERFACE_OFFSET = 500
+AGGREGATE_INTERFACE_OFFSET = 1000
+LOGICAL_INTERFACE_OFFSET = 2000
+
+SimulatedVariable = namedtuple('SimulatedVariable', ['oid', 'value'])
+
+
+def generate_topology(device_count, links_per_device=2, lag_size=2, netconf_ratio=0.0):
+    devices = [{
+        'name': f'sim-{i}',
+        'connection_type': 'netconf' if i < device_count * netconf_ratio else 'snmp'
+    }
+        for i in range(device_count)]
+    links = []
+    for step in range(1, max(links_per_device // 2, 1) + 1):
+        for i in range(device_count):
+            j = (i + step) % device_count
+            if i == j or (step * 2 == device_count and i >= j):
+                continue
+            links.append({
+                'devices': [f'sim-{i}', f'sim-{j}'],
+                # every fourth link is an aggregation of several physical links
+                'members': lag_size if len(links) % 4 == 0 else 1
+            })
+    return {'devices': devices, 'links': links}
+
+
+def load_topology(path):
+    with open(path) as topology_file:
+        return json.load(topology_file)
+
+
+def get_oid_key(oid):
+    return tuple(int(i) for i in oid.split('.'))
+
+
+class SimulatedDevice:
+    def __init__(self, number, name, connection_type):
+        self.name = name
+        self.connection_type = connection_type
+        self.ip_address = str(SIMULATED_NETWORK[number + 1])
+        self.chassis_id = bytes([2, 0]) + number.to_bytes(4, 'big')
+        self.interfaces = {}
+        self.interface_stack = []
+        self.aggregations = {}
+        self.neighbours = []
+        self.values = None
+        self.mib = None
+
+    @property
+    def chassis_id_string(self):
+        return self.chassis_id.decode('latin-1')
+
+    @property
+    def chassis_id_hex(self):
+        return ':'.join('%02x' % i for i in self.chassis_id)
+
+    def add_port(self):
+        port_number = len([i for i in self.interfaces if i < AGGREGATE_INTERFACE_OFFSET]) + 1
+        interface_number = PHYSICAL_INTERFACE_OFFSET + port_number
+        self.interfaces[interface_number] = (f'xe-0/0/{port_number}', 10000)
+        return interface_number
+
+    def add_aggregation(self, physical_interface_numbers):
+        aggregation_number = len([i for i in self.interfaces if AGGREGATE_INTERFACE_OFFSET <= i <
+                                  LOGICAL_INTERFACE_OFFSET]) + 1
+        aggregate_interface_number = AGGREGATE_INTERFACE_OFFSET + aggregation_number
+        self.interfaces[aggregate_interface_number] = (f'ae{aggregation_number}',
+                                                       10000 * len(physical_interface_numbers))
+        for physical_interface_number in physical_interface_numbers:
+            logical_interface_number = physical_interface_number - PHYSICAL_INTERFACE_OFFSET + \
+                LOGICAL_INTERFACE_OFFSET
+            self.interfaces[logical_interface_number] = (f'{self.interfaces[physical_interface_number][0]}.0', 0)
+            self.interface_stack.append((logical_interface_number, physical_interface_number))
+            self.aggregations[logical_interface_number] = aggregate_interface_number
+        return aggregate_interface_number
+
+    def add_neighbour(self, local_interface, parent_interface, remote_device, remote_interface):
+        self.neighbours.append({
+            'local_interface': local_interface,
+            'parent_interface': parent_interface,
+            'remote_device': remote_device,
+            'remote_interface': remote_interface
+        })
+
+    def build_mib(self):
+        mib = {
+            '1.0.8802.1.1.2.1.3.2.0': self.chassis_id_string,
+            '1.3.6.1.2.1.1.5.0': self.name,
+            # the simulated network never changes, so change markers are constant
+            CHANGE_MARKER_OIDS['sys_uptime']: '100000',
+            CHANGE_MARKER_OIDS['lldp_last_change']: '0',
+            CHANGE_MARKER_OIDS['if_table_last_change']: '0',
+            CHANGE_MARKER_OIDS['if_stack_last_change']: '0'
+        }
+        for interface_number, (interface_name, interface_speed) in self.interfaces.items():
+            mib[f'1.3.6.1.2.1.2.2.1.2.{interface_number}'] = interface_name
+            mib[f'1.3.6.1.2.1.31.1.1.1.15.{interface_number}'] = str(interface_speed)
+        for higher_interface_number, lower_interface_number in self.interface_stack:
+            mib[f'1.3.6.1.2.1.31.1.2.1.3.{higher_interface_number}.{lower_interface_number}'] = '1'
+        for logical_interface_number, aggregate_interface_number in self.aggregations.items():
+            mib[f'1.2.840.10006.300.43.1.2.1.1.12.{logical_interface_number}'] = str(aggregate_interface_number)
+        for index, neighbour in enumerate(self.neighbours, 1):
+            lldp_index = f"0.{neighbour['local_interface']}.{index}"
+            mib[f'1.0.8802.1.1.2.1.4.1.1.5.{lldp_index}'] = neighbour['remote_device'].chassis_id_string
+            # port id subtype 7 means that the remote port id is an interface number
+            mib[f'1.0.8802.1.1.2.1.4.1.1.6.{lldp_index}'] = '7'
+            mib[f'1.0.8802.1.1.2.1.4.1.1.7.{lldp_index}'] = str(neighbour['remote_interface'])
+        self.values = mib
+        self.mib = sorted((get_oid_key(oid), oid, value) for oid, value in mib.items())
+
+    def get(self, oid):
+        return self.values.get(oid, 'NOSUCHINSTANCE')
+
+    def walk(self, oid):
+        prefix = get_oid_key(oid)
+        return [(name, value) for oid_key, name, value in self.mib if oid_key[:len(prefix)] == prefix]
+
+
+class SimulatedNetwork:
+    def __init__(self, topology, latency=0):
+        self.latency = latency
+        self.devices = {}
+        devices_by_name = {}
+        for number, device in enumerate(topology['devices']):
+            simulated_device = SimulatedDevice(number, device['name'], device.get('connection_type', 'snmp'))
+            devices_by_name[simulated_device.name] = simulated_device
+            self.devices[simulated_device.ip_address] = simulated_device
+        for link in topology['links']:
+            local_device, remote_device = (devices_by_name[name] for name in link['devices'])
+            ports = [(local_device.add_port(), remote_device.add_port()) for _ in range(link.get('members', 1))]
+            local_parent, remote_parent = None, None
+            if len(ports) > 1:
+                local_parent = local_device.interfaces[local_device.add_aggregation([i for i, _ in ports])][0]
+                remote_parent = remote_device.interfaces[remote_device.add_aggregation([j for _, j in ports])][0]
+            for local_interface, remote_interface in ports:
+                local_device.add_neighbour(local_interface, local_parent, remote_device, remote_interface)
+                remote_device.add_neighbour(remote_interface, remote_parent, local_device, local_interface)
+        # tables are built up front, so they are not counted in memory used by polling
+        for simulated_device in self.devices.values():
+            simulated_device.build_mib()
+
+    def get_device(self, device):
+        return self.devices.get(device.ip_address)
+
+    def create_devices(self):
+        return Device.objects.bulk_create([Device(name=simulated_device.name, ip_address=simulated_device.ip_address,
+                                                  connection_type=simulated_device.connection_type)
+                                           for simulated_device in self.devices.values()])
+
+    @contextmanager
+    def patch(self):
+        simulated_redis_client = mock.MagicMock()
+        simulated_redis_client.get_snmp_poll_cache.return_value = None
+        simulated_redis_client.pop_cycle_pending.return_value = False
+        with mock.patch('data.tasks.SnmpSession', partial(SimulatedSnmpSession, network=self)), \
+                mock.patch('data.async_snmp.AsyncSnmpSession', partial(SimulatedAsyncSnmpSession, network=self)), \
+                mock.patch('data.tasks.NetconfSession', partial(SimulatedNetconfSession, network=self)), \
+                mock.patch.object(redis_client, 'redis_client', simulated_redis_client):
+            yield simulated_redis_client
+
+
+class SimulatedSnmpSession(SnmpSession):
+    def __init__(self, device, network):
+        self.device = device
+        self.interface_table = None
+        self.poll_deadline = None
+        self.poll_stats = get_empty_poll_stats()
+        self.network = network
+
+    def connect(self):
+        time.sleep(self.network.latency)
+        simulated_device = self.network.get_device(self.device)
+        if simulated_device is None:
+            raise exceptions.EasySNMPTimeoutError("timed out while connecting to remote host")
+        return simulated_device
+
+    def get(self, oids):
+        simulated_device = self.connect()
+        if isinstance(oids, list):
+            return [SimulatedVariable(oid, simulated_device.get(self._to_numeric_oid(oid))) for oid in oids]
+        return SimulatedVariable(oids, simulated_device.get(self._to_numeric_oid(oids)))
+
+    def bulkwalk(self, oids):
+        return [SimulatedVariable(f'iso.{name[2:]}', value)
+                for name, value in self.connect().walk(self._to_numeric_oid(oids))]
+
+    @staticmethod
+    def _to_numeric_oid(oid):
+        return f'1.{oid[4:]}' if oid.startswith('iso.') else oid
+
+
+class SimulatedAsyncSnmpSession(AsyncSnmpSession):
+    def __init__(self, device, network):
+        self.device = device
+        self.interface_table = None
+        self.poll_stats = get_empty_poll_stats()
+        self.network = network
+
+    async def connect(self):
+        await asyncio.sleep(self.network.latency)
+        simulated_device = self.network.get_device(self.device)
+        if simulated_device is None:
+            raise AsyncSnmpTimeoutError("No SNMP response received before timeout")
+        return simulated_device
+
+    async def get(self, *oids):
+        simulated_device = await self.connect()
+        return [simulated_device.get(oid) for oid in oids]
+
+    async def bulkwalk(self, oid):
+        simulated_device = await self.connect()
+        return [(ObjectName(name), value) for name, value in simulated_device.walk(oid)]
+
+
+class SimulatedRpc:
+    def __init__(self, simulated_device, latency):
+        self.simulated_device = simulated_device
+        self.latency = latency
+
+    def get_system_uptime_information(self, dev_timeout=None):
+        time.sleep(self.latency)
+        return E('system-uptime-information')
+
+    def get_software_information(self):
+        time.sleep(self.latency)
+        return E('software-information', E('host-name', self.simulated_device.name))
+
+    def get_lldp_local_info(self):
+        time.sleep(self.latency)
+        return E('lldp-local-info', E('lldp-local-chassis-id', self.simulated_device.chassis_id_hex))
+
+    def get_interface_information(self, interface_name=None):
+        time.sleep(self.latency)
+        return E('interface-information', *[
+            E('physical-interface', E('name', name), E('speed', f'{speed // 1000}Gbps'), E('snmp-index', str(number)))
+            for number, (name, speed) in self.simulated_device.interfaces.items()
+            if number < LOGICAL_INTERFACE_OFFSET and interface_name in (None, name)])
+
+    def get_lldp_neighbors_information(self, interface_device=None):
+        time.sleep(self.latency)
+        interfaces = self.simulated_device.interfaces
+        return E('lldp-neighbors-information', *[
+            E('lldp-neighbor-information',
+              E('lldp-local-port-id', interfaces[neighbour['local_interface']][0]),
+              E('lldp-local-interface', interfaces[neighbour['local_interface']][0]),
+              E('lldp-local-parent-interface-name', neighbour['parent_interface'] or '-'),
+              E('lldp-remote-chassis-id', neighbour['remote_device'].chassis_id_hex),
+              E('lldp-remote-port-id', str(neighbour['remote_interface'])))
+            for neighbour in self.simulated_device.neighbours
+            if interface_device in (None, interfaces[neighbour['local_interface']][0])])
+
+    def get_lldp_interface_neighbors(self, interface_device):
+        return self.get_lldp_neighbors_information(interface_device)
+
+
+class SimulatedNetconfSession:
+    is_alive = NetconfSession.is_alive
+    get_name = NetconfSession.get_name
+    get_chassis_id = NetconfSession.get_chassis_id
+    get_interface = NetconfSession.get_interface
+    get_interface_table = NetconfSession.get_interface_table
+    get_lldp_neighbours = NetconfSession.get_lldp_neighbours
+    get_lldp_neighbour_details = NetconfSession.get_lldp_neighbour_details
+    get_lldp_neighbour_table = NetconfSession.get_lldp_neighbour_table
+    _normalize_speed = staticmethod(NetconfSession._normalize_speed)
+
+    def __init__(self, device, network):
+        self.device = device
+        self.interface_table = None
+        self.poll_deadline = None
+        self.poll_stats = get_empty_poll_stats()
+        self.network = network
+        self.hostname = device.ip_address
+        self.connected = False
+        self.rpc = None
+
+    def open(self):
+        time.sleep(self.network.latency)
+        simulated_device = self.network.get_device(self.device)
+        if simulated_device is None:
+            raise junos.exception.ConnectTimeoutError(self)
+        self.rpc = SimulatedRpc(simulated_device, self.network.latency)
+        self.connected = True
+        return self
+
+    def close(self):
+        self.connected = False
+
+
+def run_benchmark(topology, cycles=2, latency=0):
+    if Device.objects.exists():
+        # polling cycle polls every device in the database, so only simulated devices may be there
+        raise RuntimeError("Benchmark has to run against an empty database")
+    network = SimulatedNetwork(topology, latency)
+    results = []
+    # simulated devices and everything polled from them are rolled back at the end
+    with transaction.atomic(), override_settings(POLLING_MODE='local'), network.patch() as simulated_redis_client:
+        network.create_devices()
+        for _ in range(cycles):
+            phases = {}
+            tracemalloc.start()
+            try:
+                with measure_phase(phases, 'cycle'):
+                    check_links()
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            cycle_stats = simulated_redis_client.set_cycle_stats.call_args[0][0]
+            results.append({
+                'devices': len(network.devices),
+                'duration': phases['cycle']['duration'],
+                'queries': phases['cycle']['queries'],
+                'peak_memory': peak_memory,
+                'changed_interfaces': cycle_stats['changed_interfaces'],
+                'changed_links': cycle_stats['changed_links'],
+                'active_links': Link.objects.filter(active=True).count()
+            })
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,26 @@
+from django.test import TestCase
+
+from benchmark.simulator import generate_topology, run_benchmark
+from data.models import Device
+
+
+class TestSimulator(TestCase):
+    def test_generate_topology(self):
+        topology = generate_topology(4, lag_size=3)
+
+        self.assertEqual([link['devices'] for link in topology['links']],
+                         [['sim-0', 'sim-1'], ['sim-1', 'sim-2'], ['sim-2', 'sim-3'], ['sim-3', 'sim-0']])
+        self.assertEqual([link['members'] for link in topology['links']], [3, 1, 1, 1])
+
+    def test_run_benchmark(self):
+        results = run_benchmark(generate_topology(4, netconf_ratio=0.5))
+
+        self.assertEqual([result['active_links'] for result in results], [5, 5])
+        self.assertEqual(results[1]['changed_links'], 0)
+        self.assertFalse(Device.objects.exists())
+
+    def test_run_benchmark_not_empty_database(self):
+        Device.objects.create(name='a', ip_address="1.1.1.1")
+
+        with self.assertRaises(RuntimeError):
+            run_benchmark(generate_topology(4))
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from pysnmp.hlapi.asyncio import SnmpEngine, CommunityData, UdpTransportTarget, ContextData, ObjectType, \
+    ObjectIdentity, getCmd, bulkCmd
+from pysnmp.proto import errind
+from pysnmp.proto.rfc1902 import ObjectName, OctetString
+from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchInstance, NoSuchObject
+
+from data.tasks import SnmpSession, PollBudgetExceeded, CHANGE_MARKER_OIDS, get_empty_poll_stats, measure_request, \
+    poll_device_via_snmp_requests
+
+logger = logging.getLogger('maps')
+
+BULKWALK_MAX_REPETITIONS = 10
+
+_thread_local = threading.local()
+
+
+class AsyncSnmpError(Exception):
+    pass
+
+
+class AsyncSnmpTimeoutError(AsyncSnmpError):
+    pass
+
+
+def get_snmp_engine():
+    # SNMP engine is bound to the event loop of the thread which uses it first
+    if not hasattr(_thread_local, 'snmp_engine'):
+        _thread_local.snmp_engine = SnmpEngine()
+    return _thread_local.snmp_engine
+
+
+def close_snmp_engine():
+    snmp_engine = getattr(_thread_local, 'snmp_engine', None)
+    if snmp_engine is not None:
+        if snmp_engine.transportDispatcher is not None:
+            snmp_engine.transportDispatcher.closeDispatcher()
+        del _thread_local.snmp_engine
+
+
+def async_snmp_exception_handler(default=None):
+    def decorator(func):
+        async def inner_function(*args, **kwargs):
+            device = args[0].device
+            try:
+                return await func(*args, **kwargs)
+            except AsyncSnmpError as e:
+                logger.warning(f"{e} (host: {device.ip_address}, pk: {device.pk})")
+                device.connection_is_active = False
+                return default
+
+        return inner_function
+
+    return decorator
+
+
+class AsyncSnmpSession:
+    _is_interface_number = staticmethod(SnmpSession._is_interface_number)
+    _parse_chassis_id = staticmethod(SnmpSession._parse_chassis_id)
+    _parse_change_markers = staticmethod(SnmpSession._parse_change_markers)
+
+    def __init__(self, device):
+        self.device = device
+        self.interface_table = None
+        self.poll_stats = get_empty_poll_stats()
+        self.snmp_engine = get_snmp_engine()
+        self.auth_data = CommunityData(device.snmp_community, mpModel=1)
+        self.transport_target = UdpTransportTarget((device.ip_address, 161), timeout=settings.SNMP_TIMEOUT,
+                                                   retries=settings.SNMP_RETRIES)
+
+    async def get(self, *oids):
+        with measure_request(self, AsyncSnmpTimeoutError):
+            error_indication, error_status, error_index, var_binds = await getCmd(
+                self.snmp_engine, self.auth_data, self.transport_target, ContextData(),
+                *[ObjectType(ObjectIdentity(oid)) for oid in oids], lookupMib=False)
+            self._check_response(error_indication, error_status, error_index)
+        return [self._to_string(value) for _, value in var_binds]
+
+    async def bulkwalk(self, oid):
+        with measure_request(self, AsyncSnmpTimeoutError):
+            return await self._bulkwalk(oid)
+
+    async def _bulkwalk(self, oid):
+        root = ObjectName(oid)
+        name = root
+        var_binds = []
+        while True:
+            error_indication, error_status, error_index, var_bind_table = await bulkCmd(
+                self.snmp_engine, self.auth_data, self.transport_target, ContextData(), 0, BULKWALK_MAX_REPETITIONS,
+                ObjectType(ObjectIdentity(name)), lookupMib=False)
+            self._check_response(error_indication, error_status, error_index)
+            if not var_bind_table:
+                return var_binds
+            for var_bind_row in var_bind_table:
+                name, value = var_bind_row[0]
+                if isinstance(value, EndOfMibView) or not root.isPrefixOf(name):
+                    return var_binds
+                var_binds.append((name, self._to_string(value)))
+
+    @async_snmp_exception_handler()
+    async def get_chassis_id(self):
+        chassis_id, = await self.get('1.0.8802.1.1.2.1.3.2.0')
+        return self._parse_chassis_id(chassis_id)
+
+    @async_snmp_exception_handler()
+    async def get_name(self):
+        name, = await self.get('1.3.6.1.2.1.1.5.0')
+        return name
+
+    @async_snmp_exception_handler()
+    async def get_change_markers(self):
+        return self._parse_change_markers(await self.get(*CHANGE_MARKER_OIDS.values()))
+
+    @async_snmp_exception_handler()
+    async def get_interface(self, interface_number):
+        if settings.SNMP_INTERFACE_MODE == 'table':
+            interface_table = await self.get_interface_table()
+            if interface_number in interface_table:
+                interface_name, interface_speed = interface_table[interface_number]
+                return {
+                    'name': interface_name,
+                    'number': interface_number,
+                    'speed': int(interface_speed) / 1000
+                }
+        else:
+            interface_name, interface_speed = await self.get(f'1.3.6.1.2.1.2.2.1.2.{interface_number}',
+                                                             f'1.3.6.1.2.1.31.1.1.1.15.{interface_number}')
+            if interface_name != 'NOSUCHINSTANCE':
+                return {
+                    'name': interface_name,
+                    'number': interface_number,
+                    'speed': int(interface_speed) / 1000
+                }
+        logger.warning(f"Interface number {interface_number} does not exist "
+                       f"(host: {self.device.ip_address}, pk: {self.device.pk})")
+
+    async def get_interface_table(self):
+        if self.interface_table is None:
+            # failed walk is not repeated for every interface of the device
+            self.interface_table = {}
+            interface_names, interface_speeds = await asyncio.gather(
+                self.bulkwalk('1.3.6.1.2.1.2.2.1.2'),
+                self.bulkwalk('1.3.6.1.2.1.31.1.1.1.15'))
+            interface_speeds = {int(name[-1]): value for name, value in interface_speeds}
+            self.interface_table = {int(name[-1]): (value, interface_speeds.get(int(name[-1]), 0))
+                                    for name, value in interface_names}
+        return self.interface_table
+
+    @async_snmp_exception_handler()
+    async def get_physical_interface_number(self, logical_interface_number):
+        connections = await self.bulkwalk(f'1.3.6.1.2.1.31.1.2.1.3.{logical_interface_number}')
+        return [str(name[-1]) for name, _ in connections]
+
+    @async_snmp_exception_handler()
+    async def get_interface_stack(self):
+        interface_stack = {}
+        for name, _ in await self.bulkwalk('1.3.6.1.2.1.31.1.2.1.3'):
+            interface_stack.setdefault(str(name[-2]), []).append(str(name[-1]))
+        return interface_stack
+
+    @async_snmp_exception_handler(default=[])
+    async def get_aggregations(self):
+        aggregate_interfaces = await self.bulkwalk('1.2.840.10006.300.43.1.2.1.1.12')
+        return [{
+            'aggregate_interface': value,
+            'logical_interface': str(name[-1])
+        }
+            for name, value in aggregate_interfaces]
+
+    @async_snmp_exception_handler(default=[])
+    async def get_lldp_neighbours(self):
+        neighbour_chassis_ids, neighbour_interface_type, neighbour_interfaces = await asyncio.gather(
+            self.bulkwalk('1.0.8802.1.1.2.1.4.1.1.5'),
+            self.bulkwalk('1.0.8802.1.1.2.1.4.1.1.6'),
+            self.bulkwalk('1.0.8802.1.1.2.1.4.1.1.7'))
+        return [{
+            'remote_chassis_id': self._parse_chassis_id(i[1]),
+            'local_interface': str(i[0][-2]),
+            'remote_interface': j[1],
+            'is_remote_interface_is_number': self._is_interface_number(k[1])
+        }
+            for i, j, k in
+            zip(neighbour_chassis_ids, neighbour_interfaces, neighbour_interface_type)]
+
+    @staticmethod
+    def _check_response(error_indication, error_status, error_index):
+        if isinstance(error_indication, errind.RequestTimedOut):
+            raise AsyncSnmpTimeoutError(str(error_indication))
+        if error_indication:
+            raise AsyncSnmpError(str(error_indication))
+        if error_status:
+            raise AsyncSnmpError(f"{error_status.prettyPrint()} at index {error_index}")
+
+    @staticmethod
+    def _to_string(value):
+        # values are converted the same way as easysnmp does it, so both engines give the same results
+        if isinstance(value, NoSuchInstance):
+            return 'NOSUCHINSTANCE'
+        if isinstance(value, NoSuchObject):
+            return 'NOSUCHOBJECT'
+        if isinstance(value, OctetString):
+            return value.asOctets().decode('latin-1')
+        return str(value)
+
+
+class AsyncSnmpExecutor:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.semaphore = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            close_snmp_engine()
+            self.loop.close()
+
+    async def _run(self, coroutine):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_workers)
+        async with self.semaphore:
+            return await coroutine
+
+    def submit(self, fn, *args):
+        return asyncio.run_coroutine_threadsafe(self._run(fn(*args)), self.loop)
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+async def poll_device_via_snmp(device, chassis_id_index):
+    if settings.SNMP_POLL_BUDGET > 0:
+        try:
+            return await asyncio.wait_for(poll_device(device, chassis_id_index), settings.SNMP_POLL_BUDGET)
+        except asyncio.TimeoutError:
+            raise PollBudgetExceeded(f"Poll time budget exceeded (host: {device.ip_address}, pk: {device.pk})")
+    return await poll_device(device, chassis_id_index)
+
+
+async def poll_device(device, chassis_id_index):
+    poll_stats = get_empty_poll_stats()
+    snmp_session = AsyncSnmpSession(device)
+    snmp_session.poll_stats = poll_stats
+    return await run_snmp_requests(snmp_session, poll_device_via_snmp_requests(device, chassis_id_index, poll_stats))
+
+
+async def run_snmp_requests(snmp_session, requests):
+    try:
+        method, args = next(requests)
+        while True:
+            method, args = requests.send(await getattr(snmp_session, method)(*args))
+    except StopIteration as e:
+        return e.value
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+
+import redis
+from django.views.decorators.http import condition
+
+logger = logging.getLogger('maps')
+
+
+def get_request_version(request, get_version):
+    if not hasattr(request, 'redis_version'):
+        try:
+            version = get_version()
+            # a version without any value stays the same however the data changes
+            request.redis_version = version if version is not None and any(version) else None
+        except redis.RedisError as e:
+            logger.warning(f"Version is not available, response is not cached: {e}")
+            request.redis_version = None
+    return request.redis_version
+
+
+def get_version_key(version):
+    return ':'.join(value.decode() if value is not None else '' for value in version)
+
+
+def get_request_variant(request, name, vary_on):
+    if not vary_on:
+        return name
+    parameters = json.dumps([request.GET.get(parameter) for parameter in vary_on])
+    return f'{name}:{hashlib.sha1(parameters.encode()).hexdigest()}'
+
+
+def get_version_etag(name, version):
+    return hashlib.sha1(f'{name}:{get_version_key(version)}'.encode()).hexdigest()
+
+
+def get_version_last_modified(version):
+    times = [float(value) for value in version if value is not None]
+    return datetime.fromtimestamp(max(times), tz=timezone.utc) if times else None
+
+
+def version_condition(name, get_version, vary_on=()):
+    def etag(request, *args, **kwargs):
+        version = get_request_version(request, lambda: get_version(*args, **kwargs))
+        return get_version_etag(get_request_variant(request, name, vary_on), version) if version is not None else None
+
+    def last_modified(request, *args, **kwargs):
+        version = get_request_version(request, lambda: get_version(*args, **kwargs))
+        return get_version_last_modified(version) if version is not None else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
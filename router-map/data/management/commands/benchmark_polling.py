@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from benchmark.simulator import generate_topology, load_topology, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Runs polling cycles against simulated devices and reports cycle time, DB queries and peak memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, nargs='+', default=[100, 1000, 10000],
+                            help='numbers of devices in generated topologies')
+        parser.add_argument('--topology', help='JSON file with topology description used instead of generated ones')
+        parser.add_argument('--links-per-device', type=int, default=2)
+        parser.add_argument('--lag-size', type=int, default=2, help='number of physical links in aggregated links')
+        parser.add_argument('--netconf-ratio', type=float, default=0.0,
+                            help='part of devices polled via NETCONF protocol')
+        parser.add_argument('--latency', type=float, default=0.0, help='seconds of every simulated request')
+        parser.add_argument('--cycles', type=int, default=2)
+
+    def handle(self, *args, **kwargs):
+        if kwargs['topology']:
+            topologies = [load_topology(kwargs['topology'])]
+        else:
+            topologies = [generate_topology(device_count, kwargs['links_per_device'], kwargs['lag_size'],
+                                            kwargs['netconf_ratio'])
+                          for device_count in kwargs['devices']]
+        # benchmark runs against a separate test database, so configured devices and their data are not touched
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            for topology in topologies:
+                for cycle, result in enumerate(run_benchmark(topology, kwargs['cycles'], kwargs['latency']), 1):
+                    self.stdout.write(f"{result['devices']} devices, cycle {cycle}: {result['duration']:.3f} s, "
+                                      f"{result['queries']} queries, "
+                                      f"peak memory {result['peak_memory'] / 2 ** 20:.1f} MiB, "
+                                      f"{result['changed_interfaces']} interfaces and {result['changed_links']} "
+                                      f"links changed, {result['active_links']} active links")
+        finally:
+            teardown_databases(old_config, verbosity=0)
@@ -0,0 +1,37 @@
+# Generated by Django 2.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('data', '0003_auto_20201005_1530'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='next_poll_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='poll_interval',
+            field=models.IntegerField(default=0, help_text='number of minutes between polls of device'),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='poll_reason',
+            field=models.CharField(blank=True, default='', max_length=15),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='consecutive_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='poll_result_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
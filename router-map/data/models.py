@@ -17,6 +17,11 @@ class Device(models.Model):
                                       help_text='string used to authenticate SNMP queries')
     connection_is_active = models.BooleanField(default=False)
     connection_type = models.CharField(max_length=15, choices=CONNECTION_TYPES, default='snmp')
+    next_poll_time = models.DateTimeField(null=True, blank=True)
+    poll_interval = models.IntegerField(default=0, help_text='number of minutes between polls of device')
+    poll_reason = models.CharField(default='', max_length=15, blank=True)
+    consecutive_failures = models.IntegerField(default=0)
+    poll_result_hash = models.CharField(default='', max_length=32, blank=True)
 
     def __str__(self):
         return f"{self.name} (id: {self.id})"
@@ -1,11 +1,33 @@
+import json
+
 import redis
 import time
 from django.conf import settings
 
+SHARDED_CYCLE_EXPIRE = 24 * 60 * 60
+
+SNMP_POLL_CACHE_EXPIRE = 7 * 24 * 60 * 60
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
 
 class RedisClient:
     def __init__(self):
         self.__redis = redis.Redis(host=settings.REDIS_HOST)
+        self.__release_lock = self.__redis.register_script(RELEASE_LOCK_SCRIPT)
+        self.__renew_lock = self.__redis.register_script(RENEW_LOCK_SCRIPT)
 
     def set_last_update_time(self):
         self.__redis.set('last_update_time', time.time())
@@ -13,5 +35,129 @@ class RedisClient:
     def get_last_update_time(self):
         return self.__redis.get('last_update_time')
 
+    def bump_topology_revision(self):
+        self.__redis.set('topology_revision', time.time())
+
+    def get_topology_version(self):
+        return tuple(self.__redis.mget('last_update_time', 'topology_revision'))
+
+    def bump_visualisation_revision(self, visualisation_pk):
+        self.__redis.set(f'visualisation_revision:{visualisation_pk}', time.time())
+
+    def get_visualisation_version(self, visualisation_pk):
+        return tuple(self.__redis.mget('last_update_time', 'topology_revision',
+                                       f'visualisation_revision:{visualisation_pk}'))
+
+    def acquire_topology_history_lock(self, token, timeout):
+        return bool(self.__redis.set('topology_history_lock', token, nx=True, px=int(timeout * 1000)))
+
+    def release_topology_history_lock(self, token):
+        return bool(self.__release_lock(keys=['topology_history_lock'], args=[token]))
+
+    def get_topology_history_state(self):
+        epoch, sequence, version = self.__redis.mget('topology_history:epoch', 'topology_history:sequence',
+                                                     'topology_history:version')
+        if epoch is None:
+            return None, 0, None
+        return epoch.decode(), int(sequence or 0), version.decode() if version is not None else None
+
+    def get_topology_snapshot(self):
+        snapshot = self.__redis.get('topology_history:snapshot')
+        return json.loads(snapshot) if snapshot is not None else None
+
+    def set_topology_history(self, epoch, sequence, version, snapshot, diff, history_size):
+        pipeline = self.__redis.pipeline()
+        pipeline.mset({
+            'topology_history:epoch': epoch,
+            'topology_history:sequence': sequence,
+            'topology_history:version': version,
+            'topology_history:snapshot': json.dumps(snapshot)
+        })
+        if diff is not None:
+            pipeline.rpush('topology_history:diffs', json.dumps(dict(diff, epoch=epoch, sequence=sequence)))
+            pipeline.ltrim('topology_history:diffs', -history_size, -1)
+        pipeline.execute()
+
+    def get_topology_diffs(self, epoch):
+        diffs = [json.loads(diff) for diff in self.__redis.lrange('topology_history:diffs', 0, -1)]
+        return [diff for diff in diffs if diff['epoch'] == epoch]
+
+    def set_cycle_stats(self, cycle_stats):
+        self.__redis.set('cycle_stats', json.dumps(cycle_stats))
+
+    def get_cycle_stats(self):
+        cycle_stats = self.__redis.get('cycle_stats')
+        return json.loads(cycle_stats) if cycle_stats is not None else None
+
+    def acquire_cycle_lock(self, token, timeout):
+        return bool(self.__redis.set('cycle_lock', token, nx=True, px=int(timeout * 1000)))
+
+    def renew_cycle_lock(self, token, timeout):
+        return bool(self.__renew_lock(keys=['cycle_lock'], args=[token, int(timeout * 1000)]))
+
+    def release_cycle_lock(self, token):
+        return bool(self.__release_lock(keys=['cycle_lock'], args=[token]))
+
+    def is_cycle_lock_held(self, token):
+        return self.__redis.get('cycle_lock') == token.encode()
+
+    def add_skipped_cycle(self):
+        return self.__redis.incr('skipped_cycles')
+
+    def get_skipped_cycles(self):
+        return int(self.__redis.get('skipped_cycles') or 0)
+
+    def set_cycle_pending(self):
+        self.__redis.set('cycle_pending', 1)
+
+    def pop_cycle_pending(self):
+        return self.__redis.delete('cycle_pending') == 1
+
+    def set_snmp_poll_cache(self, device_pk, poll_cache):
+        self.__redis.set(f'snmp_poll_cache:{device_pk}', json.dumps(poll_cache), ex=SNMP_POLL_CACHE_EXPIRE)
+
+    def get_snmp_poll_cache(self, device_pk):
+        poll_cache = self.__redis.get(f'snmp_poll_cache:{device_pk}')
+        return json.loads(poll_cache) if poll_cache is not None else None
+
+    def create_sharded_cycle(self, cycle_id, cycle):
+        self.__redis.set(f'sharded_cycle:{cycle_id}', json.dumps(cycle), ex=SHARDED_CYCLE_EXPIRE)
+
+    def get_sharded_cycle(self, cycle_id):
+        cycle = self.__redis.get(f'sharded_cycle:{cycle_id}')
+        return json.loads(cycle) if cycle is not None else None
+
+    def acquire_shard_lease(self, cycle_id, shard, token, timeout):
+        return bool(self.__redis.set(f'sharded_cycle:{cycle_id}:lease:{shard}', token, nx=True,
+                                     px=int(timeout * 1000)))
+
+    def renew_shard_lease(self, cycle_id, shard, token, timeout):
+        return bool(self.__renew_lock(keys=[f'sharded_cycle:{cycle_id}:lease:{shard}'],
+                                      args=[token, int(timeout * 1000)]))
+
+    def release_shard_lease(self, cycle_id, shard, token):
+        return bool(self.__release_lock(keys=[f'sharded_cycle:{cycle_id}:lease:{shard}'], args=[token]))
+
+    def is_shard_done(self, cycle_id, shard):
+        return self.__redis.sismember(f'sharded_cycle:{cycle_id}:done', shard)
+
+    def set_shard_result(self, cycle_id, shard, poll_results):
+        pipeline = self.__redis.pipeline()
+        pipeline.set(f'sharded_cycle:{cycle_id}:result:{shard}', json.dumps(poll_results), ex=SHARDED_CYCLE_EXPIRE)
+        pipeline.sadd(f'sharded_cycle:{cycle_id}:done', shard)
+        pipeline.expire(f'sharded_cycle:{cycle_id}:done', SHARDED_CYCLE_EXPIRE)
+        pipeline.scard(f'sharded_cycle:{cycle_id}:done')
+        _, added, _, done_shards = pipeline.execute()
+        # number of done shards is returned only once for every shard, so only one worker merges the results
+        return done_shards if added else None
+
+    def get_shard_results(self, cycle_id, shards):
+        poll_results = self.__redis.mget([f'sharded_cycle:{cycle_id}:result:{shard}' for shard in range(shards)])
+        return [json.loads(shard_poll_results) for shard_poll_results in poll_results if shard_poll_results]
+
+    def delete_sharded_cycle(self, cycle_id, shards):
+        self.__redis.delete(f'sharded_cycle:{cycle_id}', f'sharded_cycle:{cycle_id}:done',
+                            *[f'sharded_cycle:{cycle_id}:result:{shard}' for shard in range(shards)])
+
 
 redis_client = RedisClient()
@@ -1,10 +1,22 @@
+import bisect
+import datetime
+import hashlib
+import json
 import logging
 import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+from celery import chord, shared_task
 from celery.schedules import crontab
 from celery.task import periodic_task
 from django.conf import settings
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
 from easysnmp import exceptions, Session
 from jnpr import junos
 
@@ -13,11 +25,92 @@ from data.models import Device, Link, Interface
 
 logger = logging.getLogger('maps')
 
+BULK_BATCH_SIZE = 1000
+
+SHARD_VIRTUAL_NODES = 64
+
+SHARD_MAX_RETRIES = 10
+
+NETCONF_PROBE_TIMEOUT = 5
+
+CHANGE_MARKER_OIDS = {
+    'sys_uptime': '1.3.6.1.2.1.1.3.0',
+    'lldp_last_change': '1.0.8802.1.1.2.1.2.1.0',
+    'if_table_last_change': '1.3.6.1.2.1.31.1.5.0',
+    'if_stack_last_change': '1.3.6.1.2.1.31.1.6.0'
+}
+
+
+class PollBudgetExceeded(Exception):
+    pass
+
+
+def get_poll_deadline(poll_budget):
+    return time.monotonic() + poll_budget if poll_budget > 0 else None
+
+
+def check_poll_budget(session):
+    if session.poll_deadline is not None and time.monotonic() > session.poll_deadline:
+        raise PollBudgetExceeded(f"Poll time budget exceeded "
+                                 f"(host: {session.device.ip_address}, pk: {session.device.pk})")
+
+
+def get_empty_poll_stats():
+    return {
+        'poll_time': 0,
+        'requests': 0,
+        'request_time': 0,
+        'errors': 0,
+        'timeouts': 0
+    }
+
+
+def record_request(session, request_start_time, error=False, timeout=False):
+    poll_stats = session.poll_stats
+    poll_stats['requests'] += 1
+    poll_stats['request_time'] += time.monotonic() - request_start_time
+    poll_stats['errors'] += error
+    poll_stats['timeouts'] += timeout
+
+
+@contextmanager
+def measure_request(session, timeout_error):
+    request_start_time = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        record_request(session, request_start_time, error=True, timeout=isinstance(e, timeout_error))
+        raise
+    record_request(session, request_start_time)
+
+
+def add_poll_stats(poll_result, poll_stats, poll_start_time):
+    poll_stats['poll_time'] = time.monotonic() - poll_start_time
+    return dict(poll_result, stats=poll_stats)
+
+
+@contextmanager
+def measure_phase(phases, phase):
+    queries = [0]
+
+    def count_query(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    phase_start_time = time.monotonic()
+    with connection.execute_wrapper(count_query):
+        yield
+    phases[phase] = {
+        'duration': time.monotonic() - phase_start_time,
+        'queries': queries[0]
+    }
+
 
 def netconf_exception_handler(default=None):
     def decorator(func):
         def inner_function(*args, **kwargs):
             device = args[0].device
+            check_poll_budget(args[0])
             try:
                 return func(*args, **kwargs)
             except junos.exception.RpcError as e:
@@ -32,12 +125,39 @@ def netconf_exception_handler(default=None):
 class NetconfSession(junos.Device):
     def __init__(self, device):
         self.device = device
+        self.interface_table = None
+        self.poll_deadline = None
+        self.poll_stats = get_empty_poll_stats()
         super().__init__(host=device.ip_address, user=settings.NETCONF_USER, passwd=settings.NETCONF_PASSWORD,
-                         normalize=True)
+                         normalize=True, gather_facts=False)
+
+    def execute(self, rpc_cmd, **kwargs):
+        check_poll_budget(self)
+        if self.poll_deadline is not None:
+            # rpc in flight is cut short when the poll budget of the device runs out
+            kwargs['dev_timeout'] = min(self.poll_deadline - time.monotonic(), kwargs.get('dev_timeout', self.timeout))
+        try:
+            with measure_request(self, junos.exception.RpcTimeoutError):
+                return super().execute(rpc_cmd, **kwargs)
+        except junos.exception.RpcTimeoutError:
+            check_poll_budget(self)
+            raise
+
+    def is_alive(self):
+        if not self.connected:
+            return False
+        try:
+            self.rpc.get_system_uptime_information(dev_timeout=NETCONF_PROBE_TIMEOUT)
+        except Exception as e:
+            logger.info(f"Pooled NETCONF session is not alive: {e} "
+                        f"(host: {self.device.ip_address}, pk: {self.device.pk})")
+            return False
+        return True
 
     @netconf_exception_handler()
     def get_name(self):
-        return self.facts["hostname"]
+        software_information = self.rpc.get_software_information()
+        return software_information.findtext('.//host-name')
 
     @netconf_exception_handler()
     def get_chassis_id(self):
@@ -46,6 +166,13 @@ class NetconfSession(junos.Device):
 
     @netconf_exception_handler()
     def get_interface(self, interface_name):
+        if settings.NETCONF_INTERFACE_MODE == 'table':
+            interface_table = self.get_interface_table()
+            if interface_name in interface_table:
+                return interface_table[interface_name]
+            logger.warning(f"Interface {interface_name} does not exist "
+                           f"(host: {self.device.ip_address}, pk: {self.device.pk})")
+            return None
         interface_info = self.rpc.get_interface_information(interface_name=interface_name)
         interface_speed = interface_info.findtext('./physical-interface/speed')
         interface_number = interface_info.findtext('./physical-interface/snmp-index')
@@ -59,6 +186,24 @@ class NetconfSession(junos.Device):
             logger.warning(f"unexpected format of rpc response "
                            f"(host: {self.device.ip_address}, pk: {self.device.pk})")
 
+    def get_interface_table(self):
+        if self.interface_table is None:
+            # failed rpc is not repeated for every interface of the device
+            self.interface_table = {}
+            interface_info = self.rpc.get_interface_information()
+            interface_table = {}
+            for physical_interface in interface_info.findall('physical-interface'):
+                interface_name = physical_interface.findtext('name')
+                interface_number = physical_interface.findtext('snmp-index')
+                if interface_name and interface_number:
+                    interface_table[interface_name] = {
+                        'name': interface_name,
+                        'number': int(interface_number),
+                        'speed': self._normalize_speed(physical_interface.findtext('speed'))
+                    }
+            self.interface_table = interface_table
+        return self.interface_table
+
     @netconf_exception_handler(default=set())
     def get_lldp_neighbours(self):
         lldp_neighbours = self.rpc.get_lldp_neighbors_information()
@@ -89,6 +234,28 @@ class NetconfSession(junos.Device):
             })
         return neighbour_details
 
+    @netconf_exception_handler(default=[])
+    def get_lldp_neighbour_table(self):
+        lldp_neighbours = self.rpc.get_lldp_neighbors_information()
+        neighbour_details = []
+        for neighbour in lldp_neighbours.findall('lldp-neighbor-information'):
+            local_interface = neighbour.findtext('lldp-local-interface')
+            if not local_interface:
+                local_interface = neighbour.findtext('lldp-local-port-id')
+            parent_interface = neighbour.findtext('lldp-local-parent-interface-name')
+            remote_chassis_id = neighbour.findtext('lldp-remote-chassis-id')
+            remote_interface_number = neighbour.findtext('lldp-remote-port-id')
+            if local_interface and remote_chassis_id:
+                neighbour_details.append({
+                    'local_interface': local_interface,
+                    'parent_interface': None if parent_interface in (None, '-') else parent_interface,
+                    'remote_chassis_id': remote_chassis_id,
+                    # remote port id is an interface name when the remote device does not use snmp index
+                    'remote_interface_number': remote_interface_number
+                    if remote_interface_number and remote_interface_number.isdigit() else None
+                })
+        return neighbour_details
+
     @staticmethod
     def _normalize_speed(speed):
         if not speed or speed == "Unspecified" or speed == "Unlimited":
@@ -103,16 +270,76 @@ class NetconfSession(junos.Device):
             return speed_value
 
 
+class NetconfSessionPool:
+    def __init__(self):
+        self.idle_sessions = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def session(self, device):
+        netconf_session = self.acquire(device)
+        try:
+            yield netconf_session
+        except Exception:
+            self.close(netconf_session)
+            raise
+        self.release(netconf_session)
+
+    def acquire(self, device):
+        self.evict_idle_sessions()
+        with self.lock:
+            netconf_session, _ = self.idle_sessions.pop((device.pk, device.ip_address), (None, None))
+        if netconf_session is not None:
+            # probe is not counted in the stats of the previous poll
+            netconf_session.poll_stats = get_empty_poll_stats()
+            # budget of the previous poll does not limit the probe
+            netconf_session.poll_deadline = None
+            if netconf_session.is_alive():
+                netconf_session.device = device
+                netconf_session.interface_table = None
+                return netconf_session
+            self.close(netconf_session)
+        return NetconfSession(device).open()
+
+    def release(self, netconf_session):
+        if settings.NETCONF_SESSION_IDLE_TIMEOUT > 0 and netconf_session.connected:
+            with self.lock:
+                key = (netconf_session.device.pk, netconf_session.device.ip_address)
+                self.idle_sessions[key] = (netconf_session, time.monotonic())
+        else:
+            self.close(netconf_session)
+
+    def evict_idle_sessions(self):
+        now = time.monotonic()
+        with self.lock:
+            expired_keys = [key for key, (_, last_used) in self.idle_sessions.items()
+                            if now - last_used > settings.NETCONF_SESSION_IDLE_TIMEOUT]
+            expired_sessions = [self.idle_sessions.pop(key)[0] for key in expired_keys]
+        for netconf_session in expired_sessions:
+            self.close(netconf_session)
+
+    @staticmethod
+    def close(netconf_session):
+        try:
+            netconf_session.close()
+        except Exception as e:
+            logger.warning(f"Closing of NETCONF session failed: {e} "
+                           f"(host: {netconf_session.device.ip_address}, pk: {netconf_session.device.pk})")
+
+
+netconf_session_pool = NetconfSessionPool()
+
+
 def snmp_exception_handler(default=None):
     def decorator(func):
         def inner_function(*args, **kwargs):
             device = args[0].device
+            check_poll_budget(args[0])
             try:
                 return func(*args, **kwargs)
             except exceptions.EasySNMPError as e:
                 logger.warning(f"{e} (host: {device.ip_address}, pk: {device.pk})")
                 device.connection_is_active = False
-                device.save()
                 return default
 
         return inner_function
@@ -123,7 +350,22 @@ def snmp_exception_handler(default=None):
 class SnmpSession(Session):
     def __init__(self, device):
         self.device = device
-        super().__init__(hostname=device.ip_address, community=device.snmp_community, version=2)
+        self.interface_table = None
+        self.poll_deadline = None
+        self.poll_stats = get_empty_poll_stats()
+        super().__init__(hostname=device.ip_address, community=device.snmp_community, version=2,
+                         timeout=settings.SNMP_TIMEOUT, retries=settings.SNMP_RETRIES)
+
+    # easysnmp request in flight can not be interrupted, so the poll budget is checked before every request
+    def get(self, oids):
+        check_poll_budget(self)
+        with measure_request(self, exceptions.EasySNMPTimeoutError):
+            return super().get(oids)
+
+    def bulkwalk(self, oids, non_repeaters=0, max_repetitions=10):
+        check_poll_budget(self)
+        with measure_request(self, exceptions.EasySNMPTimeoutError):
+            return super().bulkwalk(oids, non_repeaters, max_repetitions)
 
     @snmp_exception_handler()
     def get_chassis_id(self):
@@ -136,27 +378,61 @@ class SnmpSession(Session):
         except exceptions.EasySNMPError as e:
             logger.warning(f"{e} (host: {self.device.ip_address}, pk: {self.device.pk})")
             self.device.connection_is_active = False
-            self.device.save()
+
+    @snmp_exception_handler()
+    def get_change_markers(self):
+        values = self.get([f'iso.{oid[2:]}' for oid in CHANGE_MARKER_OIDS.values()])
+        return self._parse_change_markers([value.value for value in values])
 
     @snmp_exception_handler()
     def get_interface(self, interface_number):
-        interface_name = self.get('iso.3.6.1.2.1.2.2.1.2.' + interface_number)
-        interface_speed = self.get('iso.3.6.1.2.1.31.1.1.1.15.' + interface_number)
-        if interface_name.value != 'NOSUCHINSTANCE':
-            return {
-                'name': interface_name.value,
-                'number': interface_number,
-                'speed': int(interface_speed.value) / 1000
-            }
+        if settings.SNMP_INTERFACE_MODE == 'table':
+            interface_table = self.get_interface_table()
+            if interface_number in interface_table:
+                interface_name, interface_speed = interface_table[interface_number]
+                return {
+                    'name': interface_name,
+                    'number': interface_number,
+                    'speed': int(interface_speed) / 1000
+                }
         else:
-            logger.warning(f"Interface number {interface_number} does not exist "
-                           f"(host: {self.device.ip_address}, pk: {self.device.pk})")
+            interface_name = self.get(f'iso.3.6.1.2.1.2.2.1.2.{interface_number}')
+            interface_speed = self.get(f'iso.3.6.1.2.1.31.1.1.1.15.{interface_number}')
+            if interface_name.value != 'NOSUCHINSTANCE':
+                return {
+                    'name': interface_name.value,
+                    'number': interface_number,
+                    'speed': int(interface_speed.value) / 1000
+                }
+        logger.warning(f"Interface number {interface_number} does not exist "
+                       f"(host: {self.device.ip_address}, pk: {self.device.pk})")
+
+    def get_interface_table(self):
+        if self.interface_table is None:
+            # failed walk is not repeated for every interface of the device
+            self.interface_table = {}
+            interface_names = self.bulkwalk('iso.3.6.1.2.1.2.2.1.2')
+            interface_speeds = {i.oid.split('.')[-1]: i.value for i in self.bulkwalk('iso.3.6.1.2.1.31.1.1.1.15')}
+            interface_table = {}
+            for i in interface_names:
+                interface_number = i.oid.split('.')[-1]
+                interface_table[int(interface_number)] = (i.value, interface_speeds.get(interface_number, 0))
+            self.interface_table = interface_table
+        return self.interface_table
 
     @snmp_exception_handler()
     def get_physical_interface_number(self, logical_interface_number):
-        connections = self.bulkwalk('iso.3.6.1.2.1.31.1.2.1.3.' + logical_interface_number)
+        connections = self.bulkwalk(f'iso.3.6.1.2.1.31.1.2.1.3.{logical_interface_number}')
         return [i.oid.split('.')[-1] for i in connections]
 
+    @snmp_exception_handler()
+    def get_interface_stack(self):
+        interface_stack = {}
+        for i in self.bulkwalk('iso.3.6.1.2.1.31.1.2.1.3'):
+            higher_interface_number, lower_interface_number = i.oid.split('.')[-2:]
+            interface_stack.setdefault(higher_interface_number, []).append(lower_interface_number)
+        return interface_stack
+
     @snmp_exception_handler(default=[])
     def get_aggregations(self):
         aggregate_interfaces = self.bulkwalk('iso.2.840.10006.300.43.1.2.1.1.12')
@@ -188,226 +464,861 @@ class SnmpSession(Session):
     def _parse_chassis_id(value):
         return ':'.join('%02x' % ord(b) for b in value)
 
+    @staticmethod
+    def _parse_change_markers(values):
+        if any(value in ('NOSUCHOBJECT', 'NOSUCHINSTANCE') for value in values):
+            return None
+        return {name: int(value) for name, value in zip(CHANGE_MARKER_OIDS, values)}
+
 
 def update_empty_chassis_id():
-    devices_with_empty_chassis_id = Device.objects.filter(chassis_id="")
+    devices_with_empty_chassis_id = list(Device.objects.filter(chassis_id=""))
+    # devices are asked in parallel like in poll_devices, only saving stays in this thread
+    with ThreadPoolExecutor(max_workers=settings.SNMP_POLLING_WORKERS) as snmp_executor, \
+            ThreadPoolExecutor(max_workers=settings.NETCONF_POLLING_WORKERS) as netconf_executor:
+        futures = []
+        for device in devices_with_empty_chassis_id:
+            if device.connection_type == 'snmp':
+                futures.append(snmp_executor.submit(update_chassis_id_via_snmp, device))
+            elif device.connection_type == 'netconf':
+                futures.append(netconf_executor.submit(update_chassis_id_via_netconf, device))
+        for future in futures:
+            future.result()
     for device in devices_with_empty_chassis_id:
-        if device.connection_type == 'snmp':
-            snmp_session = SnmpSession(device)
-            update_chassis_id(snmp_session, device)
-        elif device.connection_type == 'netconf':
-            try:
-                with NetconfSession(device) as netconf_session:
-                    update_chassis_id(netconf_session, device)
-            except junos.exception.ConnectAuthError:
-                logger.warning(f"Authentication error (host: {device.ip_address}, pk: {device.pk})")
-            except junos.exception.ConnectError:
-                logger.warning(f"Connection error (host: {device.ip_address}, pk: {device.pk})")
+        if device.chassis_id:
+            device.save(update_fields=['chassis_id', 'connection_is_active'])
+
+
+def update_chassis_id_via_snmp(device):
+    update_chassis_id(SnmpSession(device), device)
+
+
+def update_chassis_id_via_netconf(device):
+    try:
+        with netconf_session_pool.session(device) as netconf_session:
+            update_chassis_id(netconf_session, device)
+    except junos.exception.ConnectAuthError:
+        logger.warning(f"Authentication error (host: {device.ip_address}, pk: {device.pk})")
+    except junos.exception.ConnectError:
+        logger.warning(f"Connection error (host: {device.ip_address}, pk: {device.pk})")
 
 
 @periodic_task(run_every=(crontab(minute=f"*/{settings.TASK_PERIOD}")))
 def check_links():
+    lock_token = acquire_cycle_lock()
+    if lock_token is None:
+        return
+    if settings.POLLING_MODE in ('celery', 'sharded'):
+        try:
+            # chassis ids are resolved before the tasks are sent, which may take longer than the lock timeout
+            with cycle_lock_renewal(lock_token):
+                if settings.POLLING_MODE == 'sharded':
+                    start_sharded_polling_cycle(lock_token)
+                else:
+                    start_polling_cycle(lock_token)
+        except Exception:
+            release_cycle_lock(lock_token)
+            raise
+    else:
+        try:
+            with cycle_lock_renewal(lock_token):
+                cycle_start_time = time.time()
+                update_empty_chassis_id()
+                chassis_id_index = get_chassis_id_index()
+                devices = list(get_devices_to_poll())
+                device_poll_results = poll_devices(devices, chassis_id_index)
+                apply_poll_results(device_poll_results, chassis_id_index, cycle_start_time,
+                                   [device.pk for device in devices])
+        finally:
+            release_cycle_lock(lock_token)
+
+
+def acquire_cycle_lock():
+    lock_token = uuid.uuid4().hex
+    if redis_client.redis_client.acquire_cycle_lock(lock_token, settings.CYCLE_LOCK_TIMEOUT):
+        return lock_token
+    skipped_cycles = redis_client.redis_client.add_skipped_cycle()
+    if settings.CYCLE_LOCK_MODE == 'coalesce':
+        redis_client.redis_client.set_cycle_pending()
+        logger.warning(f"Previous polling cycle is still running, this cycle will run after it "
+                       f"(skipped cycles: {skipped_cycles})")
+    else:
+        logger.warning(f"Previous polling cycle is still running, this cycle is skipped "
+                       f"(skipped cycles: {skipped_cycles})")
+    return None
+
+
+def release_cycle_lock(lock_token):
+    if lock_token is None:
+        return
+    if not redis_client.redis_client.release_cycle_lock(lock_token):
+        logger.warning("Polling cycle lock expired before the end of the cycle")
+    if settings.CYCLE_LOCK_MODE == 'coalesce' and redis_client.redis_client.pop_cycle_pending():
+        check_links.delay()
+
+
+def cycle_lock_renewal(lock_token):
+    return lease_renewal(lock_token, settings.CYCLE_LOCK_TIMEOUT,
+                         lambda: redis_client.redis_client.renew_cycle_lock(lock_token, settings.CYCLE_LOCK_TIMEOUT),
+                         "Polling cycle lock expired before the end of the cycle")
+
+
+def shard_lease_renewal(cycle_id, shard, lease_token):
+    def renew_shard_lease():
+        return redis_client.redis_client.renew_shard_lease(cycle_id, shard, lease_token, settings.SHARD_LEASE_TIMEOUT)
+
+    return lease_renewal(lease_token, settings.SHARD_LEASE_TIMEOUT, renew_shard_lease,
+                         f"Lease of shard {shard} expired before the shard was polled")
+
+
+@contextmanager
+def lease_renewal(lease_token, lease_timeout, renew_lease, expired_message):
+    if lease_token is None:
+        yield
+        return
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(lease_timeout / 3):
+            if not renew_lease():
+                logger.warning(expired_message)
+                return
+
+    renewal_thread = threading.Thread(target=renew, daemon=True)
+    renewal_thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        renewal_thread.join()
+
+
+def start_polling_cycle(lock_token=None):
+    cycle_start_time = time.time()
+    update_empty_chassis_id()
+    chassis_id_index = get_chassis_id_index()
+    device_pks = list(get_devices_to_poll().order_by('pk').values_list('pk', flat=True))
+    chunk_size = settings.POLLING_CHUNK_SIZE
+    header = [poll_devices_task.s(device_pks[i:i + chunk_size], chassis_id_index, lock_token)
+              for i in range(0, len(device_pks), chunk_size)]
+    if header:
+        chord(header)(save_poll_results_task.s(chassis_id_index, cycle_start_time, device_pks, lock_token))
+    else:
+        save_poll_results_task.delay([], chassis_id_index, cycle_start_time, device_pks, lock_token)
+
+
+def start_sharded_polling_cycle(lock_token):
+    cycle_start_time = time.time()
+    update_empty_chassis_id()
+    chassis_id_index = get_chassis_id_index()
+    device_pks = list(get_devices_to_poll().order_by('pk').values_list('pk', flat=True))
+    shards = get_shards(device_pks, settings.POLLING_SHARDS)
+    if not shards:
+        save_poll_results_task.delay([], chassis_id_index, cycle_start_time, device_pks, lock_token)
+        return
+    cycle_id = uuid.uuid4().hex
+    redis_client.redis_client.create_sharded_cycle(cycle_id, {
+        'lock_token': lock_token,
+        'chassis_id_index': chassis_id_index,
+        'cycle_start_time': cycle_start_time,
+        'device_pks': device_pks,
+        'shards': shards
+    })
+    for shard in range(len(shards)):
+        poll_shard_task.delay(cycle_id, shard)
+
+
+def get_shards(device_pks, number_of_shards):
+    # consistent hashing keeps most devices in the same shard when the number of shards changes
+    shard_ring = sorted((get_hash(f"shard-{shard}-{i}"), shard)
+                        for shard in range(number_of_shards) for i in range(SHARD_VIRTUAL_NODES))
+    shard_ring_hashes = [shard_hash for shard_hash, _ in shard_ring]
+    shards = {}
+    for device_pk in device_pks:
+        position = bisect.bisect(shard_ring_hashes, get_hash(f"device-{device_pk}")) % len(shard_ring)
+        shards.setdefault(shard_ring[position][1], []).append(device_pk)
+    return [shards[shard] for shard in sorted(shards)]
+
+
+def get_hash(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=SHARD_MAX_RETRIES)
+def poll_shard_task(self, cycle_id, shard):
+    cycle = redis_client.redis_client.get_sharded_cycle(cycle_id)
+    if cycle is None:
+        logger.warning(f"Polling cycle {cycle_id} expired before shard {shard} was polled")
+        return
+    if redis_client.redis_client.is_shard_done(cycle_id, shard):
+        return
+    lease_token = uuid.uuid4().hex
+    if not redis_client.redis_client.acquire_shard_lease(cycle_id, shard, lease_token, settings.SHARD_LEASE_TIMEOUT):
+        if not redis_client.redis_client.is_cycle_lock_held(cycle['lock_token']):
+            logger.warning(f"Polling cycle {cycle_id} ended before shard {shard} was polled")
+            return
+        if self.request.retries >= SHARD_MAX_RETRIES:
+            logger.warning(f"Shard {shard} of polling cycle {cycle_id} is still leased by another worker, "
+                           f"it is not polled")
+            return
+        # shard is polled by another worker, it is taken over if that worker dies and its lease expires
+        raise self.retry(countdown=settings.SHARD_LEASE_TIMEOUT)
+    try:
+        with shard_lease_renewal(cycle_id, shard, lease_token), cycle_lock_renewal(cycle['lock_token']):
+            poll_results = poll_devices_task(cycle['shards'][shard], cycle['chassis_id_index'])
+        done_shards = redis_client.redis_client.set_shard_result(cycle_id, shard, poll_results)
+    finally:
+        redis_client.redis_client.release_shard_lease(cycle_id, shard, lease_token)
+    if done_shards == len(cycle['shards']):
+        # the last finished shard merges results of all shards
+        chunks = redis_client.redis_client.get_shard_results(cycle_id, len(cycle['shards']))
+        redis_client.redis_client.delete_sharded_cycle(cycle_id, len(cycle['shards']))
+        save_poll_results_task(chunks, cycle['chassis_id_index'], cycle['cycle_start_time'], cycle['device_pks'],
+                               cycle['lock_token'])
+
+
+def get_devices_to_poll():
+    # devices due a moment after this cycle are polled now, otherwise they would wait for the whole next period
+    due_time = timezone.now() + datetime.timedelta(minutes=int(settings.TASK_PERIOD) / 2)
+    is_due = Q(next_poll_time__isnull=True) | Q(next_poll_time__lte=due_time)
+    if settings.POLL_SCHEDULING != 'adaptive':
+        # in fixed mode only devices with open circuit breaker are skipped
+        is_due |= ~Q(poll_reason='over budget')
+    return Device.objects.filter(is_due)
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def poll_devices_task(device_pks, chassis_id_index, lock_token=None):
+    try:
+        devices = Device.objects.filter(pk__in=device_pks)
+        poll_results = []
+        with cycle_lock_renewal(lock_token):
+            device_poll_results = poll_devices(devices, chassis_id_index)
+        for device, poll_result in device_poll_results:
+            if poll_result is None:
+                poll_results.append({'device_id': device.pk, 'over_budget': True})
+                continue
+            if poll_result.get('failed'):
+                poll_results.append({'device_id': device.pk, 'failed': True})
+                continue
+            poll_result['device_id'] = device.pk
+            poll_result['device'] = {
+                'chassis_id': device.chassis_id,
+                'name': device.name,
+                'connection_is_active': device.connection_is_active
+            }
+            poll_results.append(poll_result)
+        return poll_results
+    except Exception:
+        logger.exception(f"Polling of devices {device_pks} failed")
+        # devices of the failed chunk keep their previous state
+        return [{'device_id': device_pk, 'failed': True} for device_pk in device_pks]
+
+
+@shared_task
+def save_poll_results_task(chunks, chassis_id_index, cycle_start_time=None, polled_device_pks=None,
+                           lock_token=None):
+    try:
+        with cycle_lock_renewal(lock_token):
+            save_poll_results_chunks(chunks, chassis_id_index, cycle_start_time, polled_device_pks)
+    finally:
+        release_cycle_lock(lock_token)
+
+
+def save_poll_results_chunks(chunks, chassis_id_index, cycle_start_time, polled_device_pks):
+    poll_results = [poll_result for chunk in chunks for poll_result in chunk]
+    devices = Device.objects.in_bulk([poll_result['device_id'] for poll_result in poll_results])
+    device_poll_results = []
+    for poll_result in poll_results:
+        device = devices.get(poll_result['device_id'])
+        if device is None:
+            continue
+        if poll_result.get('over_budget'):
+            device_poll_results.append((device, None))
+        elif poll_result.get('failed'):
+            device_poll_results.append((device, poll_result))
+        else:
+            for field, value in poll_result['device'].items():
+                setattr(device, field, value)
+            device_poll_results.append((device, poll_result))
+    if polled_device_pks is not None:
+        # devices whose results were not received keep their previous state
+        received_device_pks = {poll_result['device_id'] for poll_result in poll_results}
+        polled_device_pks = [device_pk for device_pk in polled_device_pks if device_pk in received_device_pks]
+    apply_poll_results(device_poll_results, chassis_id_index, cycle_start_time, polled_device_pks)
+
+
+def get_chassis_id_index():
+    chassis_id_index = {}
+    duplicated_chassis_ids = set()
+    for device_pk, chassis_id in Device.objects.exclude(chassis_id="").values_list('pk', 'chassis_id'):
+        if chassis_id in chassis_id_index:
+            duplicated_chassis_ids.add(chassis_id)
+        chassis_id_index[chassis_id] = device_pk
+    for chassis_id in duplicated_chassis_ids:
+        logger.warning(f"Multiple devices with chassis id {chassis_id}, links to these devices are ignored")
+        del chassis_id_index[chassis_id]
+    return chassis_id_index
+
+
+def apply_poll_results(device_poll_results, chassis_id_index, cycle_start_time=None, polled_device_pks=None):
+    write_start_time = time.time()
+    over_budget_devices = [device for device, poll_result in device_poll_results if poll_result is None]
+    failed_device_pks = [device.pk for device, poll_result in device_poll_results
+                         if poll_result is not None and poll_result.get('failed')]
+    device_poll_results = [(device, poll_result) for device, poll_result in device_poll_results
+                           if poll_result is not None and not poll_result.get('failed')]
+    if polled_device_pks is not None:
+        # interfaces and links of devices without poll result keep their state
+        kept_device_pks = {device.pk for device in over_budget_devices} | set(failed_device_pks)
+        polled_device_pks = [device_pk for device_pk in polled_device_pks if device_pk not in kept_device_pks]
     with transaction.atomic():
-        update_empty_chassis_id()
-        all_devices = Device.objects.only('id', 'ip_address', 'snmp_community', 'connection_type')
-        Interface.objects.update(active=False)
+        open_circuit_breaker(over_budget_devices, cycle_start_time or write_start_time)
+        # devices are locked, so none of them can be deleted before their interfaces are written
+        existing_device_pks = set(Device.objects.select_for_update().filter(
+            pk__in=[device.pk for device, _ in device_poll_results]).values_list('pk', flat=True))
+        device_poll_results = [(device, poll_result) for device, poll_result in device_poll_results
+                               if device.pk in existing_device_pks]
+        unchanged_device_pks = get_unchanged_device_pks(device_poll_results, chassis_id_index)
+        if settings.POLL_SCHEDULING == 'adaptive':
+            update_poll_schedule(device_poll_results, cycle_start_time or write_start_time)
+        else:
+            for device, poll_result in device_poll_results:
+                device.next_poll_time = None
+                device.poll_reason = ''
+                device.poll_result_hash = get_poll_result_hash(poll_result)
+        changed_rows = save_poll_results(device_poll_results, chassis_id_index, polled_device_pks,
+                                         unchanged_device_pks)
+    write_end_time = time.time()
+    cycle_stats = {
+        **changed_rows,
+        'start_time': cycle_start_time,
+        'end_time': write_end_time,
+        'polled_devices': len(device_poll_results),
+        'skipped_devices': len(unchanged_device_pks),
+        'skip_rate': len(unchanged_device_pks) / len(device_poll_results) if device_poll_results else 0,
+        'over_budget_devices': [device.pk for device in over_budget_devices],
+        'failed_devices': failed_device_pks,
+        'poll_duration': write_start_time - cycle_start_time if cycle_start_time is not None else None,
+        'write_duration': write_end_time - write_start_time,
+        **get_device_poll_stats(device_poll_results)
+    }
+    logger.info(f"Poll results of {cycle_stats['polled_devices']} devices ({cycle_stats['skipped_devices']} unchanged) "
+                f"written in {cycle_stats['write_duration']:.3f} s ({cycle_stats['changed_interfaces']} interfaces "
+                f"and {cycle_stats['changed_links']} links changed)")
+    redis_client.redis_client.set_cycle_stats(cycle_stats)
+
+
+def get_device_poll_stats(device_poll_results):
+    devices = sorted(({'device_id': device.pk, **poll_result['stats']}
+                      for device, poll_result in device_poll_results if 'stats' in poll_result),
+                     key=lambda poll_stats: poll_stats['poll_time'], reverse=True)
+    return {
+        'requests': sum(poll_stats['requests'] for poll_stats in devices),
+        'request_errors': sum(poll_stats['errors'] for poll_stats in devices),
+        'request_timeouts': sum(poll_stats['timeouts'] for poll_stats in devices),
+        'devices': devices
+    }
+
+
+def open_circuit_breaker(devices, cycle_start_time):
+    cycle_start = datetime.datetime.fromtimestamp(cycle_start_time, tz=datetime.timezone.utc)
+    for device in devices:
+        device.poll_interval = int(settings.TASK_PERIOD) * (settings.CIRCUIT_BREAKER_CYCLES + 1)
+        device.poll_reason = 'over budget'
+        device.next_poll_time = cycle_start + datetime.timedelta(minutes=device.poll_interval)
+    Device.objects.bulk_update(devices, ['next_poll_time', 'poll_interval', 'poll_reason'],
+                               batch_size=BULK_BATCH_SIZE)
+
+
+def update_poll_schedule(device_poll_results, cycle_start_time):
+    cycle_start = datetime.datetime.fromtimestamp(cycle_start_time, tz=datetime.timezone.utc)
+    min_poll_interval = int(settings.TASK_PERIOD)
+    max_poll_interval = max(settings.POLL_MAX_INTERVAL, min_poll_interval)
+    for device, poll_result in device_poll_results:
+        poll_result_hash = get_poll_result_hash(poll_result)
+        if not device.connection_is_active:
+            device.consecutive_failures += 1
+            device.poll_interval = min_poll_interval * 2 ** min(device.consecutive_failures, 16)
+            device.poll_reason = 'unreachable'
+        elif device.consecutive_failures > 0:
+            device.consecutive_failures = 0
+            device.poll_interval = min_poll_interval
+            device.poll_reason = 'recovered'
+        elif device.poll_result_hash != poll_result_hash:
+            device.poll_interval = min_poll_interval
+            device.poll_reason = 'changed'
+        else:
+            device.poll_interval = max(device.poll_interval * 2, min_poll_interval)
+            device.poll_reason = 'stable'
+        device.poll_result_hash = poll_result_hash
+        device.poll_interval = min(device.poll_interval, max_poll_interval)
+        device.next_poll_time = cycle_start + datetime.timedelta(minutes=device.poll_interval)
+
+
+def get_unchanged_device_pks(device_poll_results, chassis_id_index):
+    changed_device_pks = {device.pk for device, poll_result in device_poll_results
+                          if device.poll_result_hash != get_poll_result_hash(poll_result)}
+    unchanged_device_pks = set()
+    for device, poll_result in device_poll_results:
+        # links of device are resolved to interfaces of its neighbours, so they may change with the neighbours
+        remote_device_pks = {chassis_id_index.get(neighbour['remote_chassis_id'])
+                             for neighbour in poll_result['neighbours']}
+        if device.pk not in changed_device_pks and not remote_device_pks & changed_device_pks:
+            unchanged_device_pks.add(device.pk)
+    return unchanged_device_pks
+
+
+def get_poll_result_hash(poll_result):
+    topology = {
+        'interfaces': sorted(poll_result['interfaces'], key=lambda interface: interface['number']),
+        'neighbours': sorted(poll_result['neighbours'], key=lambda neighbour: json.dumps(neighbour, sort_keys=True))
+    }
+    return hashlib.md5(json.dumps(topology, sort_keys=True).encode()).hexdigest()
+
+
+def save_poll_results(device_poll_results, chassis_id_index, polled_device_pks=None, unchanged_device_pks=()):
+    phases = {}
+    with measure_phase(phases, 'devices'):
+        Device.objects.bulk_update([device for device, _ in device_poll_results],
+                                   ['chassis_id', 'name', 'connection_is_active', 'next_poll_time', 'poll_interval',
+                                    'poll_reason', 'consecutive_failures', 'poll_result_hash'],
+                                   batch_size=BULK_BATCH_SIZE)
+    # interfaces and links of unchanged devices are already up to date
+    device_poll_results = [(device, poll_result) for device, poll_result in device_poll_results
+                           if device.pk not in unchanged_device_pks]
+    interfaces = Interface.objects.exclude(device__in=unchanged_device_pks)
+    links = Link.objects.exclude(local_interface__device__in=unchanged_device_pks)
+    if polled_device_pks is not None:
+        # interfaces and links of devices which were not polled in this cycle keep their state
+        interfaces = interfaces.filter(device__in=polled_device_pks)
+        links = links.filter(local_interface__device__in=polled_device_pks)
+    with measure_phase(phases, 'interfaces'):
+        interface_ids, changed_interfaces = update_interfaces([(device.pk, poll_result['interfaces'])
+                                                               for device, poll_result in device_poll_results])
+        changed_interfaces += deactivate(interfaces, interface_ids.values())
+    with measure_phase(phases, 'links'):
         neighbours = []
-        for device in all_devices:
+        for device, poll_result in device_poll_results:
+            neighbours.extend(get_neighbours(device, poll_result['neighbours'], interface_ids, chassis_id_index))
+        link_ids, changed_links = update_links(neighbours)
+        changed_links += deactivate(links, link_ids)
+    # new topology version is published only when it can be read from the database
+    transaction.on_commit(redis_client.redis_client.set_last_update_time)
+    return {
+        'changed_interfaces': changed_interfaces,
+        'changed_links': changed_links,
+        'phases': phases
+    }
+
+
+def get_snmp_poller():
+    if settings.SNMP_ENGINE == 'asyncio':
+        # pysnmp is required only by the asyncio engine
+        from data import async_snmp
+        return async_snmp.AsyncSnmpExecutor(max_workers=settings.SNMP_POLLING_WORKERS), \
+            async_snmp.poll_device_via_snmp
+    return ThreadPoolExecutor(max_workers=settings.SNMP_POLLING_WORKERS), poll_device_via_snmp
+
+
+def poll_devices(devices, chassis_id_index):
+    snmp_executor, poll_snmp_device = get_snmp_poller()
+    with snmp_executor, ThreadPoolExecutor(max_workers=settings.NETCONF_POLLING_WORKERS) as netconf_executor:
+        futures = []
+        for device in devices:
             if device.connection_type == 'snmp':
-                neighbours_list = update_device_via_snmp(device)
+                futures.append((device, snmp_executor.submit(poll_snmp_device, device, chassis_id_index)))
             elif device.connection_type == 'netconf':
-                neighbours_list = update_device_via_netconf(device)
-            neighbours.extend(neighbours_list)
-        Link.objects.update(active=False)
-        update_links(neighbours)
-        redis_client.redis_client.set_last_update_time()
+                futures.append((device, netconf_executor.submit(poll_device_via_netconf, device, chassis_id_index)))
+        device_poll_results = []
+        for device, future in futures:
+            try:
+                device_poll_results.append((device, future.result()))
+            except PollBudgetExceeded as e:
+                logger.warning(e)
+                # poll result of device over its budget is None, so its previous state is kept
+                device_poll_results.append((device, None))
+            except Exception:
+                logger.exception(f"Polling failed (host: {device.ip_address}, pk: {device.pk})")
+                # failed device keeps its previous state, like a device over its budget
+                device_poll_results.append((device, {'failed': True}))
+        return device_poll_results
 
 
-def update_device_via_snmp(device):
+def poll_device_via_snmp(device, chassis_id_index):
+    poll_stats = get_empty_poll_stats()
     snmp_session = SnmpSession(device)
-    update_chassis_id(snmp_session, device)
-    update_name(snmp_session, device)
-    return get_links_via_snmp(snmp_session, device)
+    snmp_session.poll_deadline = get_poll_deadline(settings.SNMP_POLL_BUDGET)
+    snmp_session.poll_stats = poll_stats
+    return run_snmp_requests(snmp_session, poll_device_via_snmp_requests(device, chassis_id_index, poll_stats))
+
+
+# SNMP polling logic is written once as generators, which yield session method calls and receive their results,
+# so the threaded and the asyncio engine differ only in the way they run these calls
+def run_snmp_requests(snmp_session, requests):
+    try:
+        method, args = next(requests)
+        while True:
+            method, args = requests.send(getattr(snmp_session, method)(*args))
+    except StopIteration as e:
+        return e.value
+
+
+def poll_device_via_snmp_requests(device, chassis_id_index, poll_stats):
+    poll_start_time = time.monotonic()
+    set_chassis_id(device, (yield 'get_chassis_id', ()))
+    set_name(device, (yield 'get_name', ()))
+    if settings.SNMP_CONDITIONAL_POLLING:
+        change_markers = yield 'get_change_markers', ()
+        poll_result = get_cached_poll_result(device, change_markers, chassis_id_index)
+        if poll_result is None:
+            poll_result = yield from get_links_via_snmp_requests(chassis_id_index)
+            cache_poll_result(device, change_markers, chassis_id_index, poll_result)
+    else:
+        poll_result = yield from get_links_via_snmp_requests(chassis_id_index)
+    return add_poll_stats(poll_result, poll_stats, poll_start_time)
+
+
+def get_cached_poll_result(device, change_markers, chassis_id_index):
+    if change_markers is None:
+        return None
+    poll_cache = redis_client.redis_client.get_snmp_poll_cache(device.pk)
+    if poll_cache is None or poll_cache['chassis_ids_hash'] != get_chassis_ids_hash(chassis_id_index):
+        return None
+    previous_change_markers = poll_cache['change_markers']
+    # sysUpTime lower than before means that device was rebooted, so its last change times can not be compared
+    if change_markers['sys_uptime'] < previous_change_markers['sys_uptime']:
+        return None
+    if any(change_markers[name] != previous_change_markers[name] for name in change_markers if name != 'sys_uptime'):
+        return None
+    return poll_cache['poll_result']
+
+
+def cache_poll_result(device, change_markers, chassis_id_index, poll_result):
+    if change_markers is not None and device.connection_is_active:
+        redis_client.redis_client.set_snmp_poll_cache(device.pk, {
+            'change_markers': change_markers,
+            'chassis_ids_hash': get_chassis_ids_hash(chassis_id_index),
+            'poll_result': poll_result
+        })
+
+
+def get_chassis_ids_hash(chassis_id_index):
+    # neighbours in poll result are limited to known chassis ids
+    return hashlib.md5(json.dumps(sorted(chassis_id_index)).encode()).hexdigest()
 
 
 def update_chassis_id(session, device):
-    chassis_id = session.get_chassis_id()
+    set_chassis_id(device, session.get_chassis_id())
+
+
+def set_chassis_id(device, chassis_id):
     if chassis_id is not None:
         device.chassis_id = chassis_id
         device.connection_is_active = True
-        device.save()
 
 
 def update_name(session, device):
-    name = session.get_name()
+    set_name(device, session.get_name())
+
+
+def set_name(device, name):
     if name is None:
         device.name = str(device.ip_address)
     else:
         device.name = name
-    device.save()
 
 
-def get_active_or_update_interface_via_snmp(snmp_session, interface_number, device):
-    interface = Interface.objects.get_or_none(device=device, number=interface_number, active=True)
-    if interface is not None:
-        return interface.id
-    else:
-        interface_details = snmp_session.get_interface(interface_number)
-        if interface_details:
-            interface, _ = Interface.objects.get_or_create(device=device, number=interface_number)
-            interface.active = True
-            interface.speed = interface_details['speed']
-            interface.name = interface_details['name']
-            interface.aggregate_interface = None
-            interface.save()
-            return interface.id
-
-
-def update_aggregations_via_snmp(snmp_session, device):
-    aggregations = snmp_session.get_aggregations()
+def get_interface_via_snmp(snmp_session, interface_number, interfaces):
+    return run_snmp_requests(snmp_session, get_interface_via_snmp_requests(interface_number, interfaces))
+
+
+def get_interface_via_snmp_requests(interface_number, interfaces):
+    interface_number = int(interface_number)
+    if interface_number not in interfaces:
+        interface_details = yield 'get_interface', (interface_number,)
+        if not interface_details:
+            return None
+        interfaces[interface_number] = {
+            'number': interface_number,
+            'name': interface_details['name'],
+            'speed': interface_details['speed'],
+            'aggregate_interface': None
+        }
+    return interface_number
+
+
+def get_aggregations_via_snmp(snmp_session, interfaces):
+    return run_snmp_requests(snmp_session, get_aggregations_via_snmp_requests(interfaces))
+
+
+def get_aggregations_via_snmp_requests(interfaces):
+    aggregations = yield 'get_aggregations', ()
+    interface_stack = None
+    if aggregations and settings.SNMP_INTERFACE_MODE == 'table':
+        interface_stack = (yield 'get_interface_stack', ()) or {}
     for aggregation in aggregations:
-        aggregate_interface_number = aggregation['aggregate_interface']
+        aggregate_interface_number = int(aggregation['aggregate_interface'])
         logical_interface_number = aggregation['logical_interface']
-        physical_interface_numbers = snmp_session.get_physical_interface_number(logical_interface_number)
+        if interface_stack is not None:
+            physical_interface_numbers = interface_stack.get(logical_interface_number, [])
+        else:
+            physical_interface_numbers = (yield 'get_physical_interface_number', (logical_interface_number,)) or []
         for physical_interface_number in physical_interface_numbers:
-            physical_interface = Interface.objects.get_or_none(device=device, number=physical_interface_number,
-                                                               active=True)
+            physical_interface = interfaces.get(int(physical_interface_number))
             if physical_interface is not None:
-                aggregate_interface = Interface.objects.get_or_none(device=device, number=aggregate_interface_number,
-                                                                    active=True)
-                if aggregate_interface is None:
-                    aggregate_interface_detail = snmp_session.get_interface(aggregate_interface_number)
-                    aggregate_interface, _ = Interface.objects.get_or_create(device=device,
-                                                                             number=aggregate_interface_number)
-                    aggregate_interface.active = True
-                    aggregate_interface.name = aggregate_interface_detail['name']
-                    aggregate_interface.speed = aggregate_interface_detail['speed']
-                    aggregate_interface.save()
-                physical_interface.aggregate_interface = aggregate_interface
-                physical_interface.save()
-
-
-def get_links_via_snmp(snmp_session, device):
-    neighbours = snmp_session.get_lldp_neighbours()
+                if aggregate_interface_number not in interfaces:
+                    aggregate_interface_detail = yield 'get_interface', (aggregate_interface_number,)
+                    if not aggregate_interface_detail:
+                        continue
+                    interfaces[aggregate_interface_number] = {
+                        'number': aggregate_interface_number,
+                        'name': aggregate_interface_detail['name'],
+                        'speed': aggregate_interface_detail['speed'],
+                        'aggregate_interface': None
+                    }
+                physical_interface['aggregate_interface'] = aggregate_interface_number
+
+
+def get_links_via_snmp(snmp_session, chassis_id_index):
+    return run_snmp_requests(snmp_session, get_links_via_snmp_requests(chassis_id_index))
+
+
+def get_links_via_snmp_requests(chassis_id_index):
+    neighbours = yield 'get_lldp_neighbours', ()
+    interfaces = {}
     neighbours_list = []
     for neighbour in neighbours:
-        if Device.objects.filter(chassis_id=neighbour['remote_chassis_id']).exists():
-            interface_id = get_active_or_update_interface_via_snmp(snmp_session, neighbour['local_interface'], device)
-            if interface_id:
-                remote_device = Device.objects.get(chassis_id=neighbour['remote_chassis_id'])
-                if device.id > remote_device.id:
-                    neighbours_list.append({
-                        'local_interface_id': interface_id,
-                        'remote_device_id': remote_device.id,
-                        'remote_interface': neighbour['remote_interface'],
-                        'is_remote_interface_is_number': neighbour['is_remote_interface_is_number']
-                    })
-    update_aggregations_via_snmp(snmp_session, device)
-    return neighbours_list
+        if neighbour['remote_chassis_id'] in chassis_id_index:
+            interface_number = yield from get_interface_via_snmp_requests(neighbour['local_interface'], interfaces)
+            if interface_number is not None:
+                neighbours_list.append({
+                    'local_interface': interface_number,
+                    'remote_chassis_id': neighbour['remote_chassis_id'],
+                    'remote_interface': neighbour['remote_interface'],
+                    'is_remote_interface_is_number': neighbour['is_remote_interface_is_number']
+                })
+    yield from get_aggregations_via_snmp_requests(interfaces)
+    return {
+        'interfaces': list(interfaces.values()),
+        'neighbours': neighbours_list
+    }
 
 
-def update_device_via_netconf(device):
+def poll_device_via_netconf(device, chassis_id_index):
+    poll_start_time = time.monotonic()
+    poll_stats = get_empty_poll_stats()
     try:
-        with NetconfSession(device) as netconf_session:
+        with netconf_session_pool.session(device) as netconf_session:
+            netconf_session.poll_deadline = get_poll_deadline(settings.NETCONF_POLL_BUDGET)
+            netconf_session.poll_stats = poll_stats
             update_chassis_id(netconf_session, device)
             update_name(netconf_session, device)
-            return get_links_via_netconf(netconf_session, device)
+            return add_poll_stats(get_links_via_netconf(netconf_session, chassis_id_index), poll_stats,
+                                  poll_start_time)
     except junos.exception.ConnectAuthError:
         logger.warning(f"Authentication error (host: {device.ip_address}, pk: {device.pk})")
-        return []
-    except junos.exception.ConnectError:
+        poll_stats['errors'] += 1
+    except junos.exception.ConnectError as e:
         logger.warning(f"Connection error (host: {device.ip_address}, pk: {device.pk})")
         device.connection_is_active = False
-        device.save()
-        return []
+        poll_stats['errors'] += 1
+        poll_stats['timeouts'] += isinstance(e, junos.exception.ConnectTimeoutError)
+    return add_poll_stats({
+        'interfaces': [],
+        'neighbours': []
+    }, poll_stats, poll_start_time)
 
 
-def get_active_or_update_interface_via_netconf(netconf_session, interface_name, interface_aggregation_name, device):
-    interface = Interface.objects.get_or_none(device=device, name=interface_name, active=True)
-    if interface is not None:
-        return interface.id
-    else:
+def get_interface_via_netconf(netconf_session, interface_name, interface_aggregation_name, interfaces):
+    interface = interfaces.get(interface_name)
+    if interface is None:
         interface_details = netconf_session.get_interface(interface_name)
-        if interface_details:
-            interface, _ = Interface.objects.get_or_create(device=device, number=interface_details['number'])
-            interface.speed = interface_details['speed']
-            interface.name = interface_details['name']
-            interface.active = True
-            if interface_aggregation_name:
-                aggregate_interface = Interface.objects.get_or_none(device=device, name=interface_aggregation_name,
-                                                                    active=True)
-
-                if aggregate_interface is None:
-                    aggregate_interface_detail = netconf_session.get_interface(interface_aggregation_name)
-                    aggregate_interface, _ = Interface.objects.get_or_create(
-                        device=device, number=aggregate_interface_detail['number'])
-                    aggregate_interface.active = True
-                    aggregate_interface.name = aggregate_interface_detail['name']
-                    aggregate_interface.speed = aggregate_interface_detail['speed']
-                    aggregate_interface.save()
-                interface.aggregate_interface = aggregate_interface
-            else:
-                interface.aggregate_interface = None
-            interface.save()
-            return interface.id
+        if not interface_details:
+            return None
+        interface = {
+            'number': interface_details['number'],
+            'name': interface_details['name'],
+            'speed': interface_details['speed'],
+            'aggregate_interface': None
+        }
+        if interface_aggregation_name:
+            aggregate_interface = interfaces.get(interface_aggregation_name)
+            if aggregate_interface is None:
+                aggregate_interface_detail = netconf_session.get_interface(interface_aggregation_name)
+                if aggregate_interface_detail:
+                    aggregate_interface = {
+                        'number': aggregate_interface_detail['number'],
+                        'name': aggregate_interface_detail['name'],
+                        'speed': aggregate_interface_detail['speed'],
+                        'aggregate_interface': None
+                    }
+                    interfaces[interface_aggregation_name] = aggregate_interface
+            if aggregate_interface is not None:
+                interface['aggregate_interface'] = aggregate_interface['number']
+        interfaces[interface_name] = interface
+    return interface['number']
+
+
+def get_lldp_neighbour_details_via_netconf(netconf_session, chassis_id_index):
+    lldp_neighbour_details = []
+    if settings.NETCONF_INTERFACE_MODE == 'table':
+        for neighbour in netconf_session.get_lldp_neighbour_table():
+            if neighbour['remote_chassis_id'] in chassis_id_index:
+                if neighbour['remote_interface_number'] is None:
+                    lldp_neighbour_details.extend(
+                        netconf_session.get_lldp_neighbour_details(neighbour['local_interface']))
+                else:
+                    lldp_neighbour_details.append(neighbour)
+    else:
+        for (local_interface_name, remote_chassis_id) in netconf_session.get_lldp_neighbours():
+            if remote_chassis_id in chassis_id_index:
+                lldp_neighbour_details.extend(netconf_session.get_lldp_neighbour_details(local_interface_name))
+    return lldp_neighbour_details
+
+
+def get_links_via_netconf(netconf_session, chassis_id_index):
+    interfaces = {}
+    neighbours_list = []
+    for neighbour in get_lldp_neighbour_details_via_netconf(netconf_session, chassis_id_index):
+        if neighbour['remote_chassis_id'] in chassis_id_index:
+            interface_number = get_interface_via_netconf(netconf_session, neighbour['local_interface'],
+                                                         neighbour['parent_interface'], interfaces)
+            if interface_number is not None:
+                neighbours_list.append({
+                    'local_interface': interface_number,
+                    'remote_chassis_id': neighbour['remote_chassis_id'],
+                    'remote_interface': neighbour['remote_interface_number'],
+                    'is_remote_interface_is_number': True
+                })
+    return {
+        'interfaces': list(interfaces.values()),
+        'neighbours': neighbours_list
+    }
 
 
-def get_links_via_netconf(netconf_session, device):
-    neighbours = netconf_session.get_lldp_neighbours()
+def get_neighbours(device, neighbours, interface_ids, chassis_id_index):
     neighbours_list = []
-    for (local_interface_name, remote_chassis_id) in neighbours:
-        if Device.objects.filter(chassis_id=remote_chassis_id).exists():
-            lldp_neighbour_details = netconf_session.get_lldp_neighbour_details(local_interface_name)
-            for neighbour in lldp_neighbour_details:
-                if Device.objects.filter(chassis_id=neighbour['remote_chassis_id']).exists():
-                    interface_id = get_active_or_update_interface_via_netconf(netconf_session,
-                                                                              neighbour['local_interface'],
-                                                                              neighbour['parent_interface'], device)
-                    if interface_id:
-                        remote_device = Device.objects.get(chassis_id=neighbour['remote_chassis_id'])
-                        if device.id > remote_device.id:
-                            neighbours_list.append({
-                                'local_interface_id': interface_id,
-                                'remote_device_id': remote_device.id,
-                                'remote_interface': neighbour['remote_interface_number'],
-                                'is_remote_interface_is_number': True
-                            })
+    for neighbour in neighbours:
+        remote_device_id = chassis_id_index.get(neighbour['remote_chassis_id'])
+        if remote_device_id is not None and device.id > remote_device_id:
+            neighbours_list.append({
+                'local_interface_id': interface_ids[(device.id, neighbour['local_interface'])],
+                'remote_device_id': remote_device_id,
+                'remote_interface': neighbour['remote_interface'],
+                'is_remote_interface_is_number': neighbour['is_remote_interface_is_number']
+            })
     return neighbours_list
 
 
+def update_interfaces(device_interfaces):
+    interfaces = {}
+    for interface in Interface.objects.filter(device__in=[device_pk for device_pk, _ in device_interfaces]) \
+            .order_by('pk'):
+        interfaces.setdefault((interface.device_id, interface.number), interface)
+
+    new_interfaces = []
+    for device_pk, interfaces_details in device_interfaces:
+        for interface_details in interfaces_details:
+            key = (device_pk, interface_details['number'])
+            if key not in interfaces:
+                interfaces[key] = Interface(device_id=device_pk, number=interface_details['number'],
+                                            name=interface_details['name'], speed=int(interface_details['speed']))
+                new_interfaces.append(interfaces[key])
+    Interface.objects.bulk_create(new_interfaces, batch_size=BULK_BATCH_SIZE)
+
+    active_interfaces = {}
+    changed_interfaces = {}
+    for device_pk, interfaces_details in device_interfaces:
+        for interface_details in interfaces_details:
+            interface = interfaces[(device_pk, interface_details['number'])]
+            aggregate_interface = interfaces.get((device_pk, interface_details['aggregate_interface']))
+            interface_state = (True, interface_details['name'], int(interface_details['speed']),
+                               aggregate_interface.id if aggregate_interface else None)
+            if (interface.active, interface.name, interface.speed, interface.aggregate_interface_id) \
+                    != interface_state:
+                interface.active, interface.name, interface.speed, interface.aggregate_interface_id = \
+                    interface_state
+                changed_interfaces[interface.id] = interface
+            active_interfaces[interface.id] = interface
+    Interface.objects.bulk_update(changed_interfaces.values(), ['active', 'name', 'speed', 'aggregate_interface'],
+                                  batch_size=BULK_BATCH_SIZE)
+    interface_ids = {(interface.device_id, interface.number): interface.id
+                     for interface in active_interfaces.values()}
+    return interface_ids, len(changed_interfaces.keys() | {interface.id for interface in new_interfaces})
+
+
+def deactivate(queryset, active_ids):
+    inactive_ids = set(queryset.filter(active=True).values_list('pk', flat=True)) - set(active_ids)
+    return queryset.filter(pk__in=inactive_ids).update(active=False)
+
+
 def update_links(neighbours):
+    remote_devices = Device.objects.in_bulk({neighbour['remote_device_id'] for neighbour in neighbours})
+    interfaces_by_number = {}
+    interfaces_by_name = {}
+    for interface in Interface.objects.filter(device__in=remote_devices.keys()).order_by('pk'):
+        interfaces_by_number.setdefault((interface.device_id, interface.number), []).append(interface)
+        interfaces_by_name.setdefault((interface.device_id, interface.name), []).append(interface)
+    links = {}
+    for link in Link.objects.filter(local_interface__in={neighbour['local_interface_id'] for neighbour in neighbours}) \
+            .order_by('pk'):
+        links.setdefault((link.local_interface_id, link.remote_interface_id), link)
+
+    active_links = {}
+    new_links = []
+    reactivated_links = []
     for neighbour in neighbours:
-        remote_device = Device.objects.get(pk=neighbour['remote_device_id'])
+        remote_device = remote_devices.get(neighbour['remote_device_id'])
+        if remote_device is None:
+            # remote device was deleted during the polling cycle
+            continue
         try:
-            local_interface = Interface.objects.get(pk=neighbour['local_interface_id'])
             if neighbour['is_remote_interface_is_number']:
-                remote_interface = get_interface_by_number(remote_device, neighbour['remote_interface'])
+                remote_interface = get_interface_by_number(interfaces_by_number, remote_device,
+                                                           neighbour['remote_interface'])
             else:
-                remote_interface = get_interface_by_name(remote_device, neighbour['remote_interface'])
-            link, _ = Link.objects.get_or_create(local_interface=local_interface, remote_interface=remote_interface)
-            link.active = True
-            link.save()
+                remote_interface = get_interface_by_name(interfaces_by_name, remote_device,
+                                                         neighbour['remote_interface'])
         except (Interface.DoesNotExist, Interface.MultipleObjectsReturned) as e:
             logger.warning(e)
+            continue
+        key = (neighbour['local_interface_id'], remote_interface.id)
+        if key in active_links:
+            continue
+        link = links.get(key)
+        if link is None:
+            link = Link(local_interface_id=key[0], remote_interface_id=key[1])
+            new_links.append(link)
+        elif not link.active:
+            link.active = True
+            reactivated_links.append(link)
+        active_links[key] = link
+    Link.objects.bulk_create(new_links, batch_size=BULK_BATCH_SIZE)
+    Link.objects.filter(pk__in=[link.pk for link in reactivated_links]).update(active=True)
+    return {link.id for link in active_links.values()}, len(new_links) + len(reactivated_links)
 
 
-def get_interface_by_number(device, interface_number):
+def get_interface_by_number(interfaces_by_number, device, interface_number):
     try:
-        return Interface.objects.get(device=device, number=interface_number)
-    except Interface.DoesNotExist:
+        interfaces = interfaces_by_number.get((device.pk, int(interface_number)), [])
+    except (TypeError, ValueError):
+        interfaces = []
+    if not interfaces:
         raise Interface.DoesNotExist(f"Interface number {interface_number} does not exist "
                                      f"(host: {device.ip_address}, pk: {device.pk})")
-    except Interface.MultipleObjectsReturned:
+    if len(interfaces) > 1:
         raise Interface.MultipleObjectsReturned(f"Multiple interfaces with number {interface_number} "
                                                 f"(host: {device.ip_address}, pk: {device.pk})")
+    return interfaces[0]
 
 
-def get_interface_by_name(device, interface_name):
-    try:
-        return Interface.objects.get(device=device, name=interface_name)
-    except Interface.DoesNotExist:
+def get_interface_by_name(interfaces_by_name, device, interface_name):
+    interfaces = interfaces_by_name.get((device.pk, interface_name), [])
+    if not interfaces:
         raise Interface.DoesNotExist(f"Interface {interface_name} does not exist "
                                      f"(host: {device.ip_address}, pk: {device.pk})")
-    except Interface.MultipleObjectsReturned:
+    if len(interfaces) > 1:
         raise Interface.MultipleObjectsReturned(f"Multiple interfaces {interface_name} "
                                                 f"(host: {device.ip_address}, pk: {device.pk})")
+    return interfaces[0]
@@ -1,15 +1,32 @@
+import datetime
+import time
+
 import mock
+from celery.exceptions import Retry
+from easysnmp import exceptions
+from jnpr import junos
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from pysnmp.proto.rfc1902 import ObjectName
 
+from data.async_snmp import AsyncSnmpExecutor, AsyncSnmpSession, AsyncSnmpTimeoutError
 from data.models import Device, Interface, Link
-from data.tasks import update_chassis_id, update_name, get_active_or_update_interface_via_snmp, \
-    get_active_or_update_interface_via_netconf, get_links_via_snmp, get_links_via_netconf, update_links, check_links
+from data.tasks import update_chassis_id, update_name, get_interface_via_snmp, get_interface_via_netconf, \
+    update_interfaces, get_links_via_snmp, get_links_via_netconf, get_neighbours, update_links, check_links, \
+    poll_devices_task, save_poll_results_task, get_chassis_id_index, apply_poll_results, \
+    deactivate, get_aggregations_via_snmp, NetconfSessionPool, update_poll_schedule, PollBudgetExceeded, \
+    check_poll_budget, get_shards, poll_shard_task, get_unchanged_device_pks, get_poll_result_hash, \
+    get_cached_poll_result, cache_poll_result, get_empty_poll_stats, NetconfSession, SnmpSession, \
+    update_empty_chassis_id
+from utils.testing import IsolatedStateMixin
 
 
-class TestHttpResponseLinksDetail(TestCase):
+class TestHttpResponseLinksDetail(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.permission = Permission.objects.get(name='Can delete link')
         self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_is_active=True)
@@ -47,6 +64,43 @@ class TestHttpResponseLinksDetail(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context_data['connection'], connection)
 
+    def test_poll_schedule(self):
+        self.client.login(username='user1', password='user1')
+        self.device1.next_poll_time = timezone.now() + datetime.timedelta(hours=1)
+        self.device1.poll_interval = 120
+        self.device1.poll_reason = 'stable'
+        self.device1.save()
+
+        response = self.client.get(reverse('data:poll_schedule'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(device['id'], device['poll_reason'], device['due']) for device in response.json()],
+                         [(1, 'stable', False), (2, '', True)])
+
+    @mock.patch("data.views.redis_client")
+    def test_cycle_stats(self, mock_redis_client):
+        self.client.login(username='user1', password='user1')
+        mock_redis_client.get_cycle_stats.return_value = {'polled_devices': 2, 'requests': 10}
+
+        response = self.client.get(reverse('data:cycle_stats'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'polled_devices': 2, 'requests': 10})
+
+    @mock.patch("data.views.redis_client")
+    def test_last_update_time_not_modified(self, mock_redis_client):
+        self.client.login(username='user1', password='user1')
+        mock_redis_client.get_topology_version.return_value = (b'1580000000.5', None)
+        mock_redis_client.get_last_update_time.return_value = b'1580000000.5'
+
+        response = self.client.get(reverse('data:last_update_time'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'1580000000.5')
+
+        response = self.client.get(reverse('data:last_update_time'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        mock_redis_client.get_last_update_time.assert_called_once()
+
     def test_lines_multilink(self):
         self.client.login(username='user1', password='user1')
         self.interface2_device1.aggregate_interface = self.interface1_device1
@@ -124,13 +178,36 @@ class TestUpdateConnection(TestCase):
 
         self.assertTrue(Device.objects.filter(id=1, chassis_id='aa').exists())
 
+    def test_update_chassis_id_not_saved(self):
+        session = mock.MagicMock()
+        session.get_chassis_id.return_value = 'cc'
+
+        update_chassis_id(session, self.device1)
+
+        self.assertEqual(self.device1.chassis_id, 'cc')
+        self.assertTrue(self.device1.connection_is_active)
+        self.assertTrue(Device.objects.filter(id=1, chassis_id='aa').exists())
+
+    @mock.patch("data.tasks.SnmpSession")
+    def test_update_empty_chassis_id(self, mock_snmp_session):
+        Device.objects.create(name='c', ip_address="1.1.1.3", pk=3)
+        Device.objects.create(name='d', ip_address="1.1.1.4", pk=4)
+        mock_snmp_session.side_effect = lambda device: mock.MagicMock(
+            **{'get_chassis_id.return_value': 'cc' if device.pk == 3 else None})
+
+        with mock.patch.object(Device, 'save', autospec=True) as mock_save:
+            update_empty_chassis_id()
+
+        mock_save.assert_called_once_with(mock.ANY, update_fields=['chassis_id', 'connection_is_active'])
+        self.assertEqual(mock_save.call_args[0][0].pk, 3)
+
     def test_update_name(self):
         session = mock.MagicMock()
         session.get_name.return_value = "b"
 
         update_name(session, self.device1)
 
-        self.assertTrue(Device.objects.filter(id=1, name='b').exists())
+        self.assertEqual(self.device1.name, 'b')
 
     def test_update_name_empty(self):
         session = mock.MagicMock()
@@ -138,65 +215,106 @@ class TestUpdateConnection(TestCase):
 
         update_name(session, self.device1)
 
-        self.assertTrue(Device.objects.filter(id=1, name=self.device1.ip_address).exists())
+        self.assertEqual(self.device1.name, self.device1.ip_address)
 
-    def test_update_interface_via_snmp(self):
+    def test_get_interface_via_snmp(self):
         snmp_session = mock.MagicMock()
-        snmp_session.get_interface.return_value = {'name': 'xx', 'number': 1, 'speed': 1}
+        snmp_session.get_interface.return_value = {'name': 'xx', 'number': '1', 'speed': 1}
+        interfaces = {}
 
-        Interface.objects.update(active=False)
-        get_active_or_update_interface_via_snmp(snmp_session, 1, self.device1)
+        self.assertEqual(get_interface_via_snmp(snmp_session, '1', interfaces), 1)
+        self.assertEqual(get_interface_via_snmp(snmp_session, '1', interfaces), 1)
 
-        self.assertTrue(
-            Interface.objects.filter(number=1, name='xx', speed=1, active=True, aggregate_interface=None).exists())
-        self.assertTrue(
-            Interface.objects.filter(number=2, name='y', speed=1, active=False, aggregate_interface=None).exists())
-
-    def test_update_interface_via_netconf(self):
-        self.device1.connection_type = 'netconf'
-        self.device1.save()
+        self.assertEqual(interfaces, {1: {'number': 1, 'name': 'xx', 'speed': 1, 'aggregate_interface': None}})
+        snmp_session.get_interface.assert_called_once_with(1)
 
+    def test_get_interface_via_netconf(self):
         netconf_session = mock.MagicMock()
         netconf_session.get_interface.return_value = {'name': 'xx', 'number': 1, 'speed': 1}
+        interfaces = {}
 
-        Interface.objects.update(active=False)
-        get_active_or_update_interface_via_netconf(netconf_session, 'xx', None, self.device1)
+        self.assertEqual(get_interface_via_netconf(netconf_session, 'xx', None, interfaces), 1)
 
-        self.assertTrue(
-            Interface.objects.filter(number=1, name='xx', speed=1, active=True, aggregate_interface=None).exists())
-        self.assertTrue(
-            Interface.objects.filter(number=2, name='y', speed=1, active=False, aggregate_interface=None).exists())
-
-    def test_update_interfaces_via_netconf_with_aggregation(self):
-        self.device1.connection_type = 'netconf'
-        self.device1.save()
+        self.assertEqual(interfaces, {'xx': {'number': 1, 'name': 'xx', 'speed': 1, 'aggregate_interface': None}})
 
+    def test_get_interface_via_netconf_with_aggregation(self):
         netconf_session = mock.MagicMock()
         netconf_session.get_interface.side_effect = [{'name': 'x', 'number': 1, 'speed': 1},
                                                      {'name': 'y', 'number': 2, 'speed': 1}]
+        interfaces = {}
 
-        Interface.objects.update(active=False)
-        get_active_or_update_interface_via_netconf(netconf_session, 'x', 'y', self.device1)
+        self.assertEqual(get_interface_via_netconf(netconf_session, 'x', 'y', interfaces), 1)
+
+        self.assertEqual(interfaces, {'x': {'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': 2},
+                                      'y': {'number': 2, 'name': 'y', 'speed': 1, 'aggregate_interface': None}})
 
-        self.assertTrue(Interface.objects.filter(number=1, name='x', aggregate_interface=self.interface2_device1,
-                                                 speed=1, active=True).exists())
+    def test_get_aggregations_via_snmp(self):
+        snmp_session = mock.MagicMock()
+        snmp_session.get_aggregations.return_value = [{'aggregate_interface': '5', 'logical_interface': '7'}]
+        snmp_session.get_physical_interface_number.return_value = ['1', '2']
+        snmp_session.get_interface_stack.return_value = {'7': ['1', '2'], '8': ['3']}
+        snmp_session.get_interface.return_value = {'name': 'ae', 'number': 5, 'speed': 2}
+        result = {1: {'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': 5},
+                  5: {'number': 5, 'name': 'ae', 'speed': 2, 'aggregate_interface': None}}
+
+        for interface_mode in ['get', 'table']:
+            with self.subTest(interface_mode=interface_mode), override_settings(SNMP_INTERFACE_MODE=interface_mode):
+                interfaces = {1: {'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}}
+                get_aggregations_via_snmp(snmp_session, interfaces)
+                self.assertEqual(interfaces, result)
+
+        snmp_session.get_physical_interface_number.assert_called_once_with('7')
+        snmp_session.get_interface_stack.assert_called_once_with()
+
+    def test_update_interfaces(self):
+        Interface.objects.update(active=False)
+        device_interfaces = [(self.device1.pk, [{'number': 1, 'name': 'xx', 'speed': 1, 'aggregate_interface': 5},
+                                                {'number': 5, 'name': 'ae', 'speed': 2, 'aggregate_interface': None}]),
+                             (self.device2.pk, [{'number': 2, 'name': 'y', 'speed': 1, 'aggregate_interface': None}])]
+
+        with self.assertNumQueries(3):
+            interface_ids, changed_interfaces = update_interfaces(device_interfaces)
+
+        aggregate_interface = Interface.objects.get(device=self.device1, number=5, name='ae', speed=2, active=True,
+                                                    aggregate_interface=None)
+        self.assertTrue(Interface.objects.filter(number=1, name='xx', speed=1, active=True,
+                                                 aggregate_interface=aggregate_interface).exists())
+        self.assertTrue(Interface.objects.filter(device=self.device2, number=2, active=True).exists())
         self.assertTrue(
-            Interface.objects.filter(number=2, name='y', aggregate_interface=None, speed=1, active=True).exists())
+            Interface.objects.filter(number=2, name='y', speed=1, active=False, aggregate_interface=None).exists())
+        self.assertEqual(interface_ids, {(1, 1): self.interface1_device1.id, (1, 5): aggregate_interface.id,
+                                         (2, 2): self.interface2_device2.id})
+        self.assertEqual(changed_interfaces, 3)
+
+    def test_update_interfaces_unchanged(self):
+        device_interfaces = [(self.device1.pk, [{'number': 1, 'name': 'xx', 'speed': 1, 'aggregate_interface': None}])]
+        update_interfaces(device_interfaces)
+
+        with self.assertNumQueries(1):
+            _, changed_interfaces = update_interfaces(device_interfaces)
+
+        self.assertEqual(changed_interfaces, 0)
+
+    def test_deactivate(self):
+        self.assertEqual(deactivate(Interface.objects.all(), [self.interface1_device1.id]), 6)
+        self.assertEqual(list(Interface.objects.filter(active=True)), [self.interface1_device1])
 
     def test_get_links_via_snmp(self):
         snmp_session = mock.MagicMock()
         snmp_session.get_lldp_neighbours.return_value = [{'remote_chassis_id': "aa", 'local_interface': 1,
+                                                          'remote_interface': 1, 'is_remote_interface_is_number': True},
+                                                         {'remote_chassis_id': "cc", 'local_interface': 2,
                                                           'remote_interface': 1, 'is_remote_interface_is_number': True}]
         snmp_session.get_interface.return_value = {'name': 'xx', 'number': 1, 'speed': 1}
         snmp_session.get_aggregations.return_value = []
 
-        Interface.objects.update(active=False)
-        links = [{'local_interface_id': self.interface1_device2.id,
-                  'remote_device_id': self.device1.id,
-                  'remote_interface': 1,
-                  'is_remote_interface_is_number': True}]
+        poll_result = {'interfaces': [{'number': 1, 'name': 'xx', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': [{'local_interface': 1,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': 1,
+                                       'is_remote_interface_is_number': True}]}
 
-        self.assertEqual(get_links_via_snmp(snmp_session, self.device2), links)
+        self.assertEqual(get_links_via_snmp(snmp_session, {'aa': 1, 'bb': 2}), poll_result)
 
     def test_get_links_via_snmp_multilink(self):
         snmp_session = mock.MagicMock()
@@ -214,22 +332,21 @@ class TestUpdateConnection(TestCase):
                                                        'logical_interface': 102}]
         snmp_session.get_physical_interface_number.side_effect = [[1], [2]]
 
-        Interface.objects.update(active=False)
-        links = [{'local_interface_id': self.interface1_device2.id,
-                  'remote_device_id': self.device1.id,
-                  'remote_interface': 1,
-                  'is_remote_interface_is_number': True},
-                 {'local_interface_id': self.interface2_device2.id,
-                  'remote_device_id': self.device1.id,
-                  'remote_interface': 2,
-                  'is_remote_interface_is_number': True}]
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': 3},
+                                      {'number': 2, 'name': 'y', 'speed': 1, 'aggregate_interface': 3},
+                                      {'number': 3, 'name': 'z', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': [{'local_interface': 1,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': 1,
+                                       'is_remote_interface_is_number': True},
+                                      {'local_interface': 2,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': 2,
+                                       'is_remote_interface_is_number': True}]}
 
-        self.assertEqual(get_links_via_snmp(snmp_session, self.device2), links)
+        self.assertEqual(get_links_via_snmp(snmp_session, {'aa': 1, 'bb': 2}), poll_result)
 
     def test_get_links_via_netconf_new(self):
-        self.device1.connection_type = 'netconf'
-        self.device1.save()
-
         netconf_session = mock.MagicMock()
         netconf_session.get_lldp_neighbours.return_value = [('x', 'aa')]
         netconf_session.get_lldp_neighbour_details.return_value = [{'local_interface': 'x', 'parent_interface': None,
@@ -237,18 +354,15 @@ class TestUpdateConnection(TestCase):
                                                                     'remote_interface_number': 1}]
         netconf_session.get_interface.return_value = {'name': 'x', 'number': 1, 'speed': 1}
 
-        Interface.objects.update(active=False)
-        links = [{'local_interface_id': self.interface1_device2.id,
-                  'remote_device_id': self.device1.id,
-                  'remote_interface': 1,
-                  'is_remote_interface_is_number': True}]
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': [{'local_interface': 1,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': 1,
+                                       'is_remote_interface_is_number': True}]}
 
-        self.assertEqual(get_links_via_netconf(netconf_session, self.device2), links)
+        self.assertEqual(get_links_via_netconf(netconf_session, {'aa': 1, 'bb': 2}), poll_result)
 
     def test_get_links_via_netconf_multilink(self):
-        self.device1.connection_type = 'netconf'
-        self.device1.save()
-
         netconf_session = mock.MagicMock()
         netconf_session.get_lldp_neighbours.return_value = [('x', 'aa'), ('y', 'aa')]
         netconf_session.get_lldp_neighbour_details.side_effect = [[{'local_interface': 'x', 'parent_interface': None,
@@ -260,17 +374,73 @@ class TestUpdateConnection(TestCase):
         netconf_session.get_interface.side_effect = [{'name': 'x', 'number': 1, 'speed': 1},
                                                      {'name': 'y', 'number': 2, 'speed': 1}]
 
-        Interface.objects.update(active=False)
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None},
+                                      {'number': 2, 'name': 'y', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': [{'local_interface': 1,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': 1,
+                                       'is_remote_interface_is_number': True},
+                                      {'local_interface': 2,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': 2,
+                                       'is_remote_interface_is_number': True}]}
+
+        self.assertEqual(get_links_via_netconf(netconf_session, {'aa': 1, 'bb': 2}), poll_result)
+
+    @override_settings(NETCONF_INTERFACE_MODE='table')
+    def test_get_links_via_netconf_table_mode(self):
+        netconf_session = mock.MagicMock()
+        netconf_session.get_lldp_neighbour_table.return_value = [{'local_interface': 'x', 'parent_interface': None,
+                                                                  'remote_chassis_id': 'aa',
+                                                                  'remote_interface_number': '1'},
+                                                                 {'local_interface': 'y', 'parent_interface': None,
+                                                                  'remote_chassis_id': 'aa',
+                                                                  'remote_interface_number': None},
+                                                                 {'local_interface': 'z', 'parent_interface': None,
+                                                                  'remote_chassis_id': 'cc',
+                                                                  'remote_interface_number': '3'}]
+        netconf_session.get_lldp_neighbour_details.return_value = [{'local_interface': 'y', 'parent_interface': None,
+                                                                    'remote_chassis_id': 'aa',
+                                                                    'remote_interface_number': '2'}]
+        netconf_session.get_interface.side_effect = [{'name': 'x', 'number': 1, 'speed': 1},
+                                                     {'name': 'y', 'number': 2, 'speed': 1}]
+
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None},
+                                      {'number': 2, 'name': 'y', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': [{'local_interface': 1,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': '1',
+                                       'is_remote_interface_is_number': True},
+                                      {'local_interface': 2,
+                                       'remote_chassis_id': 'aa',
+                                       'remote_interface': '2',
+                                       'is_remote_interface_is_number': True}]}
+
+        self.assertEqual(get_links_via_netconf(netconf_session, {'aa': 1, 'bb': 2}), poll_result)
+        netconf_session.get_lldp_neighbours.assert_not_called()
+        netconf_session.get_lldp_neighbour_details.assert_called_once_with('y')
+
+    def test_get_neighbours(self):
+        neighbours = [{'local_interface': 1,
+                       'remote_chassis_id': 'aa',
+                       'remote_interface': 1,
+                       'is_remote_interface_is_number': True}]
+        interface_ids = {(1, 1): self.interface1_device1.id, (2, 1): self.interface1_device2.id}
         links = [{'local_interface_id': self.interface1_device2.id,
                   'remote_device_id': self.device1.id,
                   'remote_interface': 1,
-                  'is_remote_interface_is_number': True},
-                 {'local_interface_id': self.interface2_device2.id,
-                  'remote_device_id': self.device1.id,
-                  'remote_interface': 2,
                   'is_remote_interface_is_number': True}]
 
-        self.assertEqual(get_links_via_netconf(netconf_session, self.device2), links)
+        self.assertEqual(get_neighbours(self.device2, neighbours, interface_ids, {'aa': 1, 'bb': 2}), links)
+        self.assertEqual(get_neighbours(self.device1, neighbours, interface_ids, {'aa': 1, 'bb': 2}), [])
+        self.assertEqual(get_neighbours(self.device2, neighbours, interface_ids, {'bb': 2}), [])
+
+    def test_get_chassis_id_index(self):
+        Device.objects.create(name='c', ip_address="1.1.1.3", pk=3, chassis_id='')
+        Device.objects.create(name='d', ip_address="1.1.1.4", pk=4, chassis_id='dd')
+        Device.objects.create(name='e', ip_address="1.1.1.5", pk=5, chassis_id='dd')
+
+        self.assertEqual(get_chassis_id_index(), {'aa': 1, 'bb': 2})
 
     def test_update_links(self):
         neighbours_list = [{'local_interface_id': self.interface1_device2.id,
@@ -282,12 +452,38 @@ class TestUpdateConnection(TestCase):
                             'remote_interface': 2,
                             'is_remote_interface_is_number': True}
                            ]
-        update_links(neighbours_list)
+        link_ids, changed_links = update_links(neighbours_list)
+        self.assertEqual(changed_links, 2)
+        self.assertEqual(link_ids, set(Link.objects.values_list('id', flat=True)))
         self.assertTrue(Link.objects.filter(local_interface=self.interface1_device2,
                                             remote_interface=self.interface1_device1, active=True).exists())
         self.assertTrue(Link.objects.filter(local_interface=self.interface2_device2,
                                             remote_interface=self.interface2_device1, active=True).exists())
 
+    def test_update_links_existing(self):
+        inactive_link = Link.objects.create(local_interface=self.interface1_device2,
+                                            remote_interface=self.interface1_device1, active=False)
+        neighbours_list = [{'local_interface_id': self.interface1_device2.id,
+                            'remote_device_id': self.device1.id,
+                            'remote_interface': '1',
+                            'is_remote_interface_is_number': True},
+                           {'local_interface_id': self.interface2_device2.id,
+                            'remote_device_id': self.device1.id,
+                            'remote_interface': self.interface2_device1.name,
+                            'is_remote_interface_is_number': False},
+                           {'local_interface_id': self.interface2_device2.id,
+                            'remote_device_id': self.device1.id,
+                            'remote_interface': 99,
+                            'is_remote_interface_is_number': True}]
+
+        with self.assertNumQueries(5), mock.patch("data.tasks.logger") as mock_logger:
+            link_ids, changed_links = update_links(neighbours_list)
+
+        self.assertEqual(changed_links, 2)
+        self.assertEqual(link_ids, set(Link.objects.filter(active=True).values_list('id', flat=True)))
+        self.assertIn(inactive_link.id, link_ids)
+        self.assertIn("Interface number 99 does not exist", str(mock_logger.warning.call_args[0][0]))
+
     @mock.patch("data.redis_client.redis_client", mock.MagicMock())
     @mock.patch("data.tasks.SnmpSession")
     def test_check_links_new_snmp(self, mock_snmp_session):
@@ -418,7 +614,7 @@ class TestUpdateConnection(TestCase):
         self.device2.connection_type = 'netconf'
         self.device2.save()
 
-        entered = mock_netconf_session.return_value.__enter__
+        entered = mock_netconf_session.return_value.open
         entered.return_value.get_chassis_id.side_effect = ["aa", "bb"]
         entered.return_value.get_name.side_effect = ["a", "b"]
         entered.return_value.get_interface.return_value = {'name': 'p', 'number': 10, 'speed': 1}
@@ -450,7 +646,7 @@ class TestUpdateConnection(TestCase):
         self.device2.connection_type = 'netconf'
         self.device2.save()
 
-        entered = mock_netconf_session.return_value.__enter__
+        entered = mock_netconf_session.return_value.open
         entered.return_value.get_chassis_id.side_effect = ["aa", "bb"]
         entered.return_value.get_name.side_effect = ["a", "b"]
         entered.return_value.get_interface.side_effect = [{'name': 'r', 'number': 20, 'speed': 1},
@@ -510,7 +706,7 @@ class TestUpdateConnection(TestCase):
         self.device2.connection_type = 'netconf'
         self.device2.save()
 
-        entered = mock_netconf_session.return_value.__enter__
+        entered = mock_netconf_session.return_value.open
         entered.return_value.get_chassis_id.return_value = "bb"
         entered.return_value.get_name.return_value = "b"
         entered.return_value.get_interface.side_effect = [{'name': 'r', 'number': 20, 'speed': 1},
@@ -570,3 +766,618 @@ class TestUpdateConnection(TestCase):
         self.assertTrue(
             Link.objects.filter(local_interface=interface30_device2, remote_interface=interface30_device1,
                                 active=True).exists())
+
+    @override_settings(SNMP_POLLING_WORKERS=2)
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    @mock.patch("data.tasks.SnmpSession")
+    def test_check_links_concurrent_snmp(self, mock_snmp_session):
+        snmp_session1 = mock.MagicMock()
+        snmp_session1.get_chassis_id.return_value = "aa"
+        snmp_session1.get_name.return_value = "a"
+        snmp_session1.get_interface.return_value = {'name': 'p', 'number': 10, 'speed': 1}
+        snmp_session1.get_aggregations.return_value = []
+        snmp_session1.get_lldp_neighbours.return_value = [{'remote_chassis_id': "bb", 'local_interface': 10,
+                                                           'remote_interface': 11,
+                                                           'is_remote_interface_is_number': True}]
+        snmp_session2 = mock.MagicMock()
+        snmp_session2.get_chassis_id.return_value = "bb"
+        snmp_session2.get_name.return_value = "b"
+        snmp_session2.get_interface.return_value = {'name': 'q', 'number': 11, 'speed': 1}
+        snmp_session2.get_aggregations.return_value = []
+        snmp_session2.get_lldp_neighbours.return_value = [{'remote_chassis_id': "aa", 'local_interface': 11,
+                                                           'remote_interface': 10,
+                                                           'is_remote_interface_is_number': True}]
+        snmp_sessions = {self.device1.pk: snmp_session1, self.device2.pk: snmp_session2}
+        mock_snmp_session.side_effect = lambda device: snmp_sessions[device.pk]
+
+        check_links()
+
+        interface10_device1 = Interface.objects.get(number=10, name='p', device=self.device1, active=True)
+        interface11_device2 = Interface.objects.get(number=11, name='q', device=self.device2, active=True)
+        self.assertTrue(
+            Link.objects.filter(local_interface=interface11_device2, remote_interface=interface10_device1,
+                                active=True).exists())
+
+    @mock.patch("data.tasks.SnmpSession")
+    def test_poll_devices_task(self, mock_snmp_session):
+        snmp_session = mock.MagicMock()
+        snmp_session.get_chassis_id.return_value = "aa"
+        snmp_session.get_name.return_value = "a2"
+        snmp_session.get_interface.return_value = {'name': 'p', 'number': 10, 'speed': 1}
+        snmp_session.get_aggregations.return_value = []
+        snmp_session.get_lldp_neighbours.return_value = [{'remote_chassis_id': "bb", 'local_interface': 10,
+                                                          'remote_interface': 11,
+                                                          'is_remote_interface_is_number': True}]
+
+        def create_session(device):
+            if device.pk == self.device2.pk:
+                raise RuntimeError("unexpected error")
+            return snmp_session
+
+        mock_snmp_session.side_effect = create_session
+
+        poll_results = [{'device_id': self.device1.pk,
+                         'device': {'chassis_id': 'aa', 'name': 'a2', 'connection_is_active': True},
+                         'interfaces': [{'number': 10, 'name': 'p', 'speed': 1, 'aggregate_interface': None}],
+                         'neighbours': [{'local_interface': 10,
+                                         'remote_chassis_id': 'bb',
+                                         'remote_interface': 11,
+                                         'is_remote_interface_is_number': True}],
+                         'stats': mock.ANY},
+                        {'device_id': self.device2.pk, 'failed': True}]
+
+        self.assertEqual(poll_devices_task([self.device1.pk, self.device2.pk], {'aa': 1, 'bb': 2}), poll_results)
+
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    def test_save_poll_results_task(self):
+        chunks = [[{'device_id': self.device2.pk,
+                    'device': {'chassis_id': 'bb', 'name': 'b2', 'connection_is_active': True},
+                    'interfaces': [{'number': 2, 'name': 'y', 'speed': 1, 'aggregate_interface': None}],
+                    'neighbours': [{'local_interface': 2,
+                                    'remote_chassis_id': 'aa',
+                                    'remote_interface': 3,
+                                    'is_remote_interface_is_number': True}]}],
+                  []]
+
+        save_poll_results_task(chunks, {'aa': 1, 'bb': 2})
+
+        self.assertTrue(Device.objects.filter(pk=self.device2.pk, name='b2').exists())
+        self.assertTrue(
+            Link.objects.filter(local_interface=self.interface2_device2, remote_interface=self.interface3_device1,
+                                active=True).exists())
+        self.assertFalse(Interface.objects.filter(device=self.device1, active=True).exists())
+
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    @mock.patch("data.tasks.Device.objects.filter")
+    def test_poll_devices_task_failed(self, mock_filter):
+        mock_filter.side_effect = RuntimeError("unexpected error")
+
+        self.assertEqual(poll_devices_task([self.device1.pk, self.device2.pk], {'aa': 1, 'bb': 2}),
+                         [{'device_id': self.device1.pk, 'failed': True},
+                          {'device_id': self.device2.pk, 'failed': True}])
+
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    def test_save_poll_results_task_missing_chunk(self):
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1)
+        chunks = [[{'device_id': self.device1.pk,
+                    'device': {'chassis_id': 'aa', 'name': 'a', 'connection_is_active': True},
+                    'interfaces': [],
+                    'neighbours': []}],
+                  [{'device_id': self.device2.pk, 'failed': True}]]
+
+        save_poll_results_task(chunks, {'aa': 1, 'bb': 2}, 0.0, [self.device1.pk, self.device2.pk, 3])
+
+        self.assertFalse(Interface.objects.filter(device=self.device1, active=True).exists())
+        self.assertTrue(Interface.objects.filter(device=self.device2, active=True).exists())
+        self.assertTrue(Link.objects.filter(local_interface=self.interface1_device2, active=True).exists())
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_apply_poll_results(self, mock_redis_client):
+        deleted_device = Device(name='c', ip_address="1.1.1.3", pk=3)
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': []}
+
+        apply_poll_results([(self.device1, poll_result), (deleted_device, poll_result)], {'aa': 1, 'bb': 2}, 0.0)
+
+        self.assertFalse(Interface.objects.filter(device_id=3).exists())
+        self.assertTrue(Interface.objects.filter(device=self.device1, number=1, active=True).exists())
+        cycle_stats = mock_redis_client.set_cycle_stats.call_args[0][0]
+        self.assertEqual(cycle_stats['polled_devices'], 1)
+        self.assertEqual(cycle_stats['start_time'], 0.0)
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_apply_poll_results_stats(self, mock_redis_client):
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': [],
+                       'stats': dict(get_empty_poll_stats(), poll_time=1.5, requests=4, errors=1, timeouts=1)}
+
+        apply_poll_results([(self.device1, poll_result)], {'aa': 1, 'bb': 2}, 0.0)
+
+        cycle_stats = mock_redis_client.set_cycle_stats.call_args[0][0]
+        self.assertEqual(cycle_stats['devices'], [{'device_id': self.device1.pk, **poll_result['stats']}])
+        self.assertEqual((cycle_stats['requests'], cycle_stats['request_errors'], cycle_stats['request_timeouts']),
+                         (4, 1, 1))
+        self.assertEqual(set(cycle_stats['phases']), {'devices', 'interfaces', 'links'})
+        self.assertGreater(cycle_stats['phases']['interfaces']['queries'], 0)
+
+    @override_settings(SNMP_INTERFACE_MODE='table')
+    @mock.patch("easysnmp.Session.bulkwalk")
+    @mock.patch("easysnmp.Session.__init__", return_value=None)
+    def test_snmp_session_records_requests(self, mock_session_init, mock_bulkwalk):
+        mock_bulkwalk.side_effect = [[mock.Mock(oid='iso.3.6.1.2.1.2.2.1.2.1', value='ge-0/0/1')],
+                                     exceptions.EasySNMPTimeoutError("timed out")]
+        snmp_session = SnmpSession(self.device1)
+
+        self.assertIsNone(snmp_session.get_interface(1))
+        self.assertIsNone(snmp_session.get_interface(2))
+        self.assertEqual((snmp_session.poll_stats['requests'], snmp_session.poll_stats['errors'],
+                          snmp_session.poll_stats['timeouts']), (2, 1, 1))
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_get_cached_poll_result(self, mock_redis_client):
+        poll_result = {'interfaces': [], 'neighbours': []}
+        change_markers = {'sys_uptime': 100, 'lldp_last_change': 10, 'if_table_last_change': 20,
+                          'if_stack_last_change': 0}
+        cache_poll_result(self.device1, change_markers, {'aa': 1, 'bb': 2}, poll_result)
+        mock_redis_client.get_snmp_poll_cache.return_value = mock_redis_client.set_snmp_poll_cache.call_args[0][1]
+
+        self.assertEqual(get_cached_poll_result(self.device1, dict(change_markers, sys_uptime=200),
+                                                {'aa': 1, 'bb': 2}), poll_result)
+        self.assertIsNone(get_cached_poll_result(self.device1, dict(change_markers, sys_uptime=50),
+                                                 {'aa': 1, 'bb': 2}))
+        self.assertIsNone(get_cached_poll_result(self.device1, dict(change_markers, lldp_last_change=150),
+                                                 {'aa': 1, 'bb': 2}))
+        self.assertIsNone(get_cached_poll_result(self.device1, change_markers, {'aa': 1, 'bb': 2, 'cc': 3}))
+        self.assertIsNone(get_cached_poll_result(self.device1, None, {'aa': 1, 'bb': 2}))
+
+    def test_get_unchanged_device_pks(self):
+        poll_result1 = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                        'neighbours': []}
+        poll_result2 = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                        'neighbours': [{'local_interface': 1, 'remote_chassis_id': 'aa', 'remote_interface': 1,
+                                        'is_remote_interface_is_number': True}]}
+        self.device1.poll_result_hash = get_poll_result_hash(poll_result1)
+        self.device2.poll_result_hash = get_poll_result_hash(poll_result2)
+
+        self.assertEqual(get_unchanged_device_pks([(self.device1, poll_result1), (self.device2, poll_result2)],
+                                                  {'aa': 1, 'bb': 2}), {1, 2})
+        self.assertEqual(get_unchanged_device_pks([(self.device1, poll_result2), (self.device2, poll_result2)],
+                                                  {'aa': 1, 'bb': 2}), set())
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_apply_poll_results_unchanged_device(self, mock_redis_client):
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': []}
+        apply_poll_results([(self.device1, poll_result)], {'aa': 1, 'bb': 2}, 0.0)
+
+        with mock.patch("data.tasks.update_interfaces", wraps=update_interfaces) as mock_update_interfaces:
+            apply_poll_results([(self.device1, poll_result)], {'aa': 1, 'bb': 2}, 0.0)
+
+        mock_update_interfaces.assert_called_once_with([])
+
+        self.assertTrue(Interface.objects.filter(device=self.device1, number=1, active=True).exists())
+        cycle_stats = mock_redis_client.set_cycle_stats.call_args[0][0]
+        self.assertEqual((cycle_stats['skipped_devices'], cycle_stats['skip_rate']), (1, 1))
+
+    @override_settings(TASK_PERIOD='15', POLL_MAX_INTERVAL=60)
+    def test_update_poll_schedule(self):
+        poll_result = {'interfaces': [{'number': 1, 'name': 'x', 'speed': 1, 'aggregate_interface': None}],
+                       'neighbours': []}
+        device_poll_results = [(self.device1, poll_result)]
+
+        update_poll_schedule(device_poll_results, 0.0)
+        self.assertEqual((self.device1.poll_reason, self.device1.poll_interval), ('changed', 15))
+        update_poll_schedule(device_poll_results, 0.0)
+        self.assertEqual((self.device1.poll_reason, self.device1.poll_interval), ('stable', 30))
+        update_poll_schedule(device_poll_results, 0.0)
+        update_poll_schedule(device_poll_results, 0.0)
+        self.assertEqual((self.device1.poll_reason, self.device1.poll_interval), ('stable', 60))
+
+        self.device1.connection_is_active = False
+        update_poll_schedule(device_poll_results, 0.0)
+        self.assertEqual((self.device1.poll_reason, self.device1.poll_interval), ('unreachable', 30))
+        update_poll_schedule(device_poll_results, 0.0)
+        self.assertEqual((self.device1.poll_reason, self.device1.consecutive_failures), ('unreachable', 2))
+
+        self.device1.connection_is_active = True
+        update_poll_schedule(device_poll_results, 0.0)
+        self.assertEqual((self.device1.poll_reason, self.device1.poll_interval), ('recovered', 15))
+        self.assertEqual(self.device1.next_poll_time,
+                         datetime.datetime(1970, 1, 1, 0, 15, tzinfo=datetime.timezone.utc))
+
+    @override_settings(POLL_SCHEDULING='adaptive')
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    @mock.patch("data.tasks.SnmpSession")
+    def test_check_links_adaptive_scheduling(self, mock_snmp_session):
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1)
+        self.device2.next_poll_time = timezone.now() + datetime.timedelta(days=1)
+        self.device2.save()
+        mock_snmp_session.return_value.get_chassis_id.return_value = "aa"
+        mock_snmp_session.return_value.get_name.return_value = "a"
+        mock_snmp_session.return_value.get_lldp_neighbours.return_value = []
+
+        check_links()
+
+        mock_snmp_session.assert_called_once_with(self.device1)
+        self.assertTrue(Interface.objects.filter(device=self.device2, active=True).exists())
+        self.assertFalse(Interface.objects.filter(device=self.device1, active=True).exists())
+        self.assertTrue(Link.objects.filter(local_interface=self.interface1_device2, active=True).exists())
+        self.device1.refresh_from_db()
+        self.assertEqual(self.device1.poll_reason, 'changed')
+        self.assertIsNotNone(self.device1.next_poll_time)
+
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.poll_device_via_snmp")
+    def test_check_links_over_budget(self, mock_poll_device_via_snmp, mock_redis_client):
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1)
+
+        def poll_device(device, chassis_id_index):
+            if device.pk == self.device2.pk:
+                raise PollBudgetExceeded("Poll time budget exceeded")
+            return {'interfaces': [], 'neighbours': []}
+
+        mock_poll_device_via_snmp.side_effect = poll_device
+
+        check_links()
+
+        self.assertTrue(Interface.objects.filter(device=self.device2, active=True).exists())
+        self.assertTrue(Link.objects.filter(local_interface=self.interface1_device2, active=True).exists())
+        self.assertEqual(mock_redis_client.set_cycle_stats.call_args[0][0]['over_budget_devices'], [2])
+        self.device2.refresh_from_db()
+        self.assertEqual(self.device2.poll_reason, 'over budget')
+
+        mock_poll_device_via_snmp.reset_mock()
+        check_links()
+
+        mock_poll_device_via_snmp.assert_called_once_with(self.device1, {'aa': 1, 'bb': 2})
+
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.poll_device_via_snmp")
+    def test_check_links_poll_failed(self, mock_poll_device_via_snmp, mock_redis_client):
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1)
+
+        def poll_device(device, chassis_id_index):
+            if device.pk == self.device2.pk:
+                raise RuntimeError("unexpected error")
+            return {'interfaces': [], 'neighbours': []}
+
+        mock_poll_device_via_snmp.side_effect = poll_device
+
+        check_links()
+
+        self.assertTrue(Interface.objects.filter(device=self.device2, active=True).exists())
+        self.assertTrue(Link.objects.filter(local_interface=self.interface1_device2, active=True).exists())
+        self.assertFalse(Interface.objects.filter(device=self.device1, active=True).exists())
+        self.assertEqual(mock_redis_client.set_cycle_stats.call_args[0][0]['failed_devices'], [2])
+
+    def test_check_poll_budget(self):
+        session = mock.MagicMock(device=self.device1, poll_deadline=None)
+        check_poll_budget(session)
+        session.poll_deadline = time.monotonic() - 1
+        with self.assertRaises(PollBudgetExceeded):
+            check_poll_budget(session)
+
+    @override_settings(POLLING_MODE='celery', POLLING_CHUNK_SIZE=1)
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    @mock.patch("data.tasks.uuid.uuid4", mock.MagicMock(return_value=mock.MagicMock(hex='token')))
+    @mock.patch("data.tasks.save_poll_results_task")
+    @mock.patch("data.tasks.chord")
+    def test_check_links_celery_mode(self, mock_chord, mock_save_poll_results_task):
+        check_links()
+
+        header = mock_chord.call_args[0][0]
+        self.assertEqual([signature.args for signature in header],
+                         [([self.device1.pk], {'aa': 1, 'bb': 2}, 'token'),
+                          ([self.device2.pk], {'aa': 1, 'bb': 2}, 'token')])
+        mock_save_poll_results_task.s.assert_called_once_with({'aa': 1, 'bb': 2}, mock.ANY, [1, 2], 'token')
+        mock_chord.return_value.assert_called_once_with(mock_save_poll_results_task.s.return_value)
+
+    @override_settings(POLLING_MODE='sharded')
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    @mock.patch("data.tasks.uuid.uuid4", mock.MagicMock(return_value=mock.MagicMock(hex='token')))
+    @mock.patch("data.tasks.start_sharded_polling_cycle")
+    @mock.patch("data.tasks.cycle_lock_renewal")
+    def test_check_links_sharded_mode_renews_lock(self, mock_cycle_lock_renewal, mock_start_sharded_polling_cycle):
+        check_links()
+
+        mock_cycle_lock_renewal.assert_called_once_with('token')
+        mock_start_sharded_polling_cycle.assert_called_once_with('token')
+
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.poll_devices")
+    def test_check_links_skipped_when_locked(self, mock_poll_devices, mock_redis_client):
+        mock_redis_client.acquire_cycle_lock.return_value = False
+
+        check_links()
+
+        mock_poll_devices.assert_not_called()
+        mock_redis_client.add_skipped_cycle.assert_called_once_with()
+        mock_redis_client.set_cycle_pending.assert_not_called()
+        mock_redis_client.release_cycle_lock.assert_not_called()
+
+    @override_settings(CYCLE_LOCK_MODE='coalesce')
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.check_links.delay")
+    def test_coalesced_cycle(self, mock_check_links_delay, mock_redis_client):
+        mock_redis_client.acquire_cycle_lock.return_value = False
+        check_links()
+        mock_redis_client.set_cycle_pending.assert_called_once_with()
+
+        mock_redis_client.acquire_cycle_lock.return_value = True
+        mock_redis_client.pop_cycle_pending.return_value = True
+        with mock.patch("data.tasks.poll_devices", mock.MagicMock(return_value=[])):
+            check_links()
+
+        mock_redis_client.release_cycle_lock.assert_called_once_with(
+            mock_redis_client.acquire_cycle_lock.call_args[0][0])
+        mock_check_links_delay.assert_called_once_with()
+
+
+class TestShardedPolling(TestCase):
+    def test_get_shards(self):
+        device_pks = list(range(1, 1001))
+        shards = get_shards(device_pks, 4)
+        self.assertEqual(sorted(device_pk for shard in shards for device_pk in shard), device_pks)
+        self.assertEqual(len(shards), 4)
+
+        # with one more shard, devices move only to the new shard
+        shard_of_device = {device_pk: i for i, shard in enumerate(shards) for device_pk in shard}
+        for i, shard in enumerate(get_shards(device_pks, 5)):
+            for device_pk in shard:
+                self.assertIn(i, (shard_of_device[device_pk], 4))
+
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.save_poll_results_task")
+    @mock.patch("data.tasks.poll_devices_task")
+    def test_poll_shard_task_merges_last_shard(self, mock_poll_devices_task, mock_save_poll_results_task,
+                                               mock_redis_client):
+        mock_redis_client.get_sharded_cycle.return_value = {'lock_token': 'token', 'chassis_id_index': {'aa': 1},
+                                                            'cycle_start_time': 0.0, 'device_pks': [1, 2],
+                                                            'shards': [[1], [2]]}
+        mock_redis_client.is_shard_done.return_value = False
+        mock_redis_client.acquire_shard_lease.return_value = True
+        mock_redis_client.get_shard_results.return_value = [['result1'], ['result2']]
+        mock_poll_devices_task.return_value = ['result2']
+
+        mock_redis_client.set_shard_result.return_value = 1
+        poll_shard_task('cycle', 1)
+        mock_save_poll_results_task.assert_not_called()
+
+        mock_redis_client.set_shard_result.return_value = 2
+        poll_shard_task('cycle', 1)
+
+        mock_poll_devices_task.assert_called_with([2], {'aa': 1})
+        mock_redis_client.set_shard_result.assert_called_with('cycle', 1, ['result2'])
+        self.assertEqual(mock_redis_client.release_shard_lease.call_count, 2)
+        mock_save_poll_results_task.assert_called_once_with([['result1'], ['result2']], {'aa': 1}, 0.0, [1, 2],
+                                                            'token')
+
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.poll_devices_task")
+    def test_poll_shard_task_leased_shard(self, mock_poll_devices_task, mock_redis_client):
+        mock_redis_client.get_sharded_cycle.return_value = {'lock_token': 'token', 'shards': [[1]]}
+        mock_redis_client.is_shard_done.return_value = False
+        mock_redis_client.acquire_shard_lease.return_value = False
+        mock_redis_client.is_cycle_lock_held.return_value = True
+
+        with self.assertRaises(Retry):
+            poll_shard_task('cycle', 0)
+
+        mock_poll_devices_task.assert_not_called()
+
+    @mock.patch("data.redis_client.redis_client")
+    @mock.patch("data.tasks.poll_devices_task")
+    def test_poll_shard_task_cycle_lock_expired(self, mock_poll_devices_task, mock_redis_client):
+        mock_redis_client.get_sharded_cycle.return_value = {'lock_token': 'token', 'shards': [[1]]}
+        mock_redis_client.is_shard_done.return_value = False
+        mock_redis_client.acquire_shard_lease.return_value = False
+        mock_redis_client.is_cycle_lock_held.return_value = False
+
+        poll_shard_task('cycle', 0)
+
+        mock_redis_client.is_cycle_lock_held.assert_called_once_with('token')
+        mock_poll_devices_task.assert_not_called()
+
+
+@mock.patch("data.redis_client.redis_client")
+class TestPollResultsCommit(TransactionTestCase):
+    def test_last_update_time_set_after_commit(self, mock_redis_client):
+        with transaction.atomic():
+            apply_poll_results([], {})
+            mock_redis_client.set_last_update_time.assert_not_called()
+
+        mock_redis_client.set_last_update_time.assert_called_once_with()
+
+
+class TestNetconfSessionPool(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_type='netconf')
+
+    @override_settings(NETCONF_SESSION_IDLE_TIMEOUT=60)
+    @mock.patch("data.tasks.NetconfSession")
+    def test_session_reused(self, mock_netconf_session):
+        netconf_session_pool = NetconfSessionPool()
+        mock_netconf_session.return_value.open.return_value.device = self.device
+
+        with netconf_session_pool.session(self.device) as netconf_session1:
+            pass
+        with netconf_session_pool.session(self.device) as netconf_session2:
+            pass
+
+        self.assertEqual(mock_netconf_session.call_count, 1)
+        self.assertIs(netconf_session1, netconf_session2)
+        netconf_session1.close.assert_not_called()
+
+    @override_settings(NETCONF_SESSION_IDLE_TIMEOUT=60)
+    @mock.patch("data.tasks.NetconfSession")
+    def test_dead_session_reopened(self, mock_netconf_session):
+        netconf_session_pool = NetconfSessionPool()
+        dead_session = mock.MagicMock(device=self.device)
+        dead_session.is_alive.return_value = False
+        new_session = mock.MagicMock(device=self.device)
+        mock_netconf_session.return_value.open.side_effect = [dead_session, new_session]
+
+        with netconf_session_pool.session(self.device) as netconf_session1:
+            pass
+        with netconf_session_pool.session(self.device) as netconf_session2:
+            pass
+
+        self.assertIs(netconf_session1, dead_session)
+        self.assertIs(netconf_session2, new_session)
+        dead_session.close.assert_called_once_with()
+
+    @mock.patch("jnpr.junos.Device.timeout", new_callable=mock.PropertyMock)
+    @mock.patch("jnpr.junos.Device.execute")
+    def test_rpc_limited_by_poll_budget(self, mock_execute, mock_timeout):
+        mock_timeout.return_value = 30
+        netconf_session = NetconfSession(self.device)
+        netconf_session.poll_deadline = time.monotonic() + 10
+
+        def execute(rpc_cmd, **kwargs):
+            netconf_session.poll_deadline -= 20
+            raise junos.exception.RpcTimeoutError(netconf_session, 'get-software-information', kwargs['dev_timeout'])
+
+        mock_execute.side_effect = execute
+
+        with self.assertRaises(PollBudgetExceeded):
+            netconf_session.get_name()
+        self.assertLessEqual(mock_execute.call_args[1]['dev_timeout'], 10)
+
+    @mock.patch("jnpr.junos.Device.rpc", new_callable=mock.PropertyMock)
+    @mock.patch("jnpr.junos.Device.connected", new_callable=mock.PropertyMock)
+    def test_is_alive_probe_failed(self, mock_connected, mock_rpc):
+        mock_connected.return_value = True
+        mock_rpc.return_value.get_system_uptime_information.side_effect = RuntimeError("session closed")
+
+        self.assertFalse(NetconfSession(self.device).is_alive())
+
+    @override_settings(NETCONF_SESSION_IDLE_TIMEOUT=60)
+    @mock.patch("data.tasks.NetconfSession")
+    def test_session_closed_on_error(self, mock_netconf_session):
+        netconf_session_pool = NetconfSessionPool()
+
+        with self.assertRaises(RuntimeError):
+            with netconf_session_pool.session(self.device):
+                raise RuntimeError("connection closed")
+
+        mock_netconf_session.return_value.open.return_value.close.assert_called_once_with()
+        self.assertEqual(netconf_session_pool.idle_sessions, {})
+
+    @override_settings(NETCONF_SESSION_IDLE_TIMEOUT=60)
+    @mock.patch("data.tasks.time.monotonic")
+    @mock.patch("data.tasks.NetconfSession")
+    def test_idle_session_evicted(self, mock_netconf_session, mock_monotonic):
+        netconf_session_pool = NetconfSessionPool()
+        mock_monotonic.return_value = 0
+        with netconf_session_pool.session(self.device) as netconf_session:
+            pass
+
+        mock_monotonic.return_value = 61
+        netconf_session_pool.evict_idle_sessions()
+
+        netconf_session.close.assert_called_once_with()
+        self.assertEqual(netconf_session_pool.idle_sessions, {})
+
+
+class FakeAsyncSnmpSession:
+    def __init__(self, device):
+        self.device = device
+
+    async def get_chassis_id(self):
+        return {1: 'aa', 2: 'bb'}[self.device.pk]
+
+    async def get_name(self):
+        return {1: 'a', 2: 'b'}[self.device.pk]
+
+    async def get_interface(self, interface_number):
+        return {'name': 'p', 'number': interface_number, 'speed': 1}
+
+    async def get_aggregations(self):
+        return []
+
+    async def get_lldp_neighbours(self):
+        return [{'remote_chassis_id': {1: 'bb', 2: 'aa'}[self.device.pk], 'local_interface': '10',
+                 'remote_interface': '10', 'is_remote_interface_is_number': True}]
+
+
+class TestAsyncSnmpEngine(TestCase):
+    def setUp(self):
+        self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_is_active=True,
+                                             chassis_id='aa')
+        self.device2 = Device.objects.create(name='b', ip_address="1.1.1.2", pk=2, connection_is_active=True,
+                                             chassis_id='bb')
+
+    @mock.patch("data.async_snmp.UdpTransportTarget", mock.MagicMock())
+    @mock.patch("data.async_snmp.get_snmp_engine", mock.MagicMock())
+    def test_get_lldp_neighbours(self):
+        walks = {
+            '1.0.8802.1.1.2.1.4.1.1.5': [(ObjectName('1.0.8802.1.1.2.1.4.1.1.5.0.10.1'), '\xaa\xbb')],
+            '1.0.8802.1.1.2.1.4.1.1.6': [(ObjectName('1.0.8802.1.1.2.1.4.1.1.6.0.10.1'), '7')],
+            '1.0.8802.1.1.2.1.4.1.1.7': [(ObjectName('1.0.8802.1.1.2.1.4.1.1.7.0.10.1'), '11')],
+        }
+
+        async def bulkwalk(session, oid):
+            return walks[oid]
+
+        neighbours = [{'remote_chassis_id': 'aa:bb', 'local_interface': '10', 'remote_interface': '11',
+                       'is_remote_interface_is_number': True}]
+
+        with mock.patch.object(AsyncSnmpSession, 'bulkwalk', bulkwalk), AsyncSnmpExecutor(max_workers=1) as executor:
+            snmp_session = AsyncSnmpSession(self.device1)
+            self.assertEqual(executor.submit(snmp_session.get_lldp_neighbours).result(), neighbours)
+
+    @override_settings(SNMP_INTERFACE_MODE='table')
+    @mock.patch("data.async_snmp.UdpTransportTarget", mock.MagicMock())
+    @mock.patch("data.async_snmp.get_snmp_engine", mock.MagicMock())
+    def test_get_interface_table_mode(self):
+        walks = {
+            '1.3.6.1.2.1.2.2.1.2': [(ObjectName('1.3.6.1.2.1.2.2.1.2.10'), 'ge-0/0/0'),
+                                    (ObjectName('1.3.6.1.2.1.2.2.1.2.11'), 'ge-0/0/1')],
+            '1.3.6.1.2.1.31.1.1.1.15': [(ObjectName('1.3.6.1.2.1.31.1.1.1.15.10'), '10000')],
+        }
+        bulkwalk = mock.MagicMock()
+
+        async def fake_bulkwalk(session, oid):
+            bulkwalk(oid)
+            return walks[oid]
+
+        with mock.patch.object(AsyncSnmpSession, 'bulkwalk', fake_bulkwalk), \
+                AsyncSnmpExecutor(max_workers=1) as executor:
+            snmp_session = AsyncSnmpSession(self.device1)
+            self.assertEqual(executor.submit(snmp_session.get_interface, 10).result(),
+                             {'name': 'ge-0/0/0', 'number': 10, 'speed': 10})
+            self.assertEqual(executor.submit(snmp_session.get_interface, 11).result(),
+                             {'name': 'ge-0/0/1', 'number': 11, 'speed': 0})
+            self.assertIsNone(executor.submit(snmp_session.get_interface, 12).result())
+
+        self.assertEqual(bulkwalk.call_count, 2)
+
+    @override_settings(SNMP_INTERFACE_MODE='table')
+    @mock.patch("data.async_snmp.UdpTransportTarget", mock.MagicMock())
+    @mock.patch("data.async_snmp.get_snmp_engine", mock.MagicMock())
+    def test_get_interface_table_mode_walk_failed(self):
+        bulkwalk = mock.MagicMock()
+
+        async def fake_bulkwalk(session, oid):
+            bulkwalk(oid)
+            raise AsyncSnmpTimeoutError("No SNMP response received before timeout")
+
+        with mock.patch.object(AsyncSnmpSession, 'bulkwalk', fake_bulkwalk), \
+                AsyncSnmpExecutor(max_workers=1) as executor:
+            snmp_session = AsyncSnmpSession(self.device1)
+            self.assertIsNone(executor.submit(snmp_session.get_interface, 10).result())
+            self.assertIsNone(executor.submit(snmp_session.get_interface, 11).result())
+
+        self.assertEqual(bulkwalk.call_count, 2)
+
+    @override_settings(SNMP_ENGINE='asyncio', SNMP_POLLING_WORKERS=10)
+    @mock.patch("data.redis_client.redis_client", mock.MagicMock())
+    @mock.patch("data.async_snmp.AsyncSnmpSession", FakeAsyncSnmpSession)
+    def test_check_links_asyncio_engine(self):
+        check_links()
+
+        interface10_device1 = Interface.objects.get(number=10, name='p', device=self.device1, active=True)
+        interface10_device2 = Interface.objects.get(number=10, name='p', device=self.device2, active=True)
+        self.assertTrue(
+            Link.objects.filter(local_interface=interface10_device2, remote_interface=interface10_device1,
+                                active=True).exists())
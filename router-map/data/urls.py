@@ -5,6 +5,8 @@ from . import views
 app_name = 'data'
 urlpatterns = [
     path('last_update_time', views.last_update_time, name='last_update_time'),
+    path('poll_schedule.json', views.poll_schedule, name='poll_schedule'),
+    path('cycle_stats.json', views.cycle_stats, name='cycle_stats'),
     path('device/<int:pk>/', views.DeviceDetailView.as_view(), name='device_detail'),
     path('connection/<connection_id>/', views.ConnectionView.as_view(), name='connection_detail'),
     path('connection/<connection_id>/delete', views.delete_inactive_links, name='connection_inactive_delete'),
@@ -1,17 +1,20 @@
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.http import HttpResponse, Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils import timezone
 from django.views.decorators.http import require_POST
 from django.views.generic import DetailView, TemplateView
 
+from data.conditional import version_condition
 from data.forms import DeviceFormSetHelper, DeviceFormSet
 from data.models import Device, Link
 from data.redis_client import redis_client
 
 
 @login_required
+@version_condition('last_update_time', lambda: redis_client.get_topology_version())
 def last_update_time(request):
     time = redis_client.get_last_update_time()
     if time is None:
@@ -20,6 +23,29 @@ def last_update_time(request):
         return HttpResponse(time)
 
 
+@login_required
+def poll_schedule(request):
+    now = timezone.now()
+    devices = [{
+        'id': device.pk,
+        'name': device.name,
+        'ip_address': device.ip_address,
+        'connection_is_active': device.connection_is_active,
+        'next_poll_time': device.next_poll_time,
+        'poll_interval': device.poll_interval,
+        'poll_reason': device.poll_reason,
+        'consecutive_failures': device.consecutive_failures,
+        'due': device.next_poll_time is None or device.next_poll_time <= now
+    }
+        for device in Device.objects.order_by('next_poll_time', 'pk')]
+    return JsonResponse(devices, safe=False)
+
+
+@login_required
+def cycle_stats(request):
+    return JsonResponse(redis_client.get_cycle_stats() or {})
+
+
 class DeviceDetailView(LoginRequiredMixin, DetailView):
     model = Device
     template_name = 'device_detail.html'
@@ -3,16 +3,20 @@ import json
 import os
 import tempfile
 
+import mock
 from django.contrib.auth.models import User, Permission
 from django.test import TestCase
 from django.urls import reverse
 
 from data.models import Device, Interface, Link
 from diagram.models import Diagram, DeviceDiagramRelationship
+from diagram.views import diagram_lines
+from utils.testing import IsolatedStateMixin
 
 
-class TestHttpResponseIndex(TestCase):
+class TestHttpResponseIndex(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.diagram = Diagram.objects.create(name='Map1', pk=1)
 
@@ -32,8 +36,9 @@ class TestHttpResponseIndex(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
-class TestHttpResponseGraph(TestCase):
+class TestHttpResponseGraph(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_is_active=True)
         self.device2 = Device.objects.create(name='b', ip_address="1.1.1.2", pk=2, connection_is_active=True)
@@ -123,8 +128,22 @@ class TestHttpResponseGraph(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(response.content, json)
 
+    def test_lines_number_of_queries(self):
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1,
+                            active=True, pk=10)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(diagram_lines(1)), 1)
+
+        for i in range(3, 13):
+            device = Device.objects.create(name=str(i), ip_address=f"1.1.1.{i}", pk=i)
+            self.diagram.devices.add(device, through_defaults={'device_position_x': i, 'device_position_y': i})
+            interface = Interface.objects.create(number=1, name="x", speed=1, device=device)
+            Link.objects.create(local_interface=interface, remote_interface=self.interface2_device1)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(diagram_lines(1)), 11)
+
 
-class TestHttpResponseInactiveConnections(TestCase):
+class TestHttpResponseInactiveConnections(IsolatedStateMixin, TestCase):
     def test_inactive_connections(self):
         self.user = User.objects.create_user(username="user1", password="user1")
         self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_is_active=True)
@@ -153,8 +172,9 @@ class TestHttpResponseInactiveConnections(TestCase):
         self.assertEqual(response.context_data['inactive_list'], inactive_list)
 
 
-class TestEditDiagramView(TestCase):
+class TestEditDiagramView(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.permission = Permission.objects.get(name='Can change diagram')
 
@@ -180,8 +200,9 @@ class TestEditDiagramView(TestCase):
         self.assertTrue(Diagram.objects.filter(name='x').exists())
 
 
-class TestAddDevicesViaCsv(TestCase):
+class TestAddDevicesViaCsv(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.permission = Permission.objects.get(name='Can change diagram')
         self.diagram = Diagram.objects.create(name="Diagram1", pk=1)
@@ -259,8 +280,9 @@ class TestAddDevicesViaCsv(TestCase):
                                                          device_position_y=1).exists())
 
 
-class TestUpdatePositionsView(TestCase):
+class TestUpdatePositionsView(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.permission = Permission.objects.get(name='Can change diagram')
 
@@ -270,7 +292,8 @@ class TestUpdatePositionsView(TestCase):
                                     content_type="application/json")
         self.assertEqual(response.status_code, 403)
 
-    def test_update_position(self):
+    @mock.patch("data.redis_client.redis_client")
+    def test_update_position(self, mock_redis_client):
         self.client.login(username='user1', password='user1')
         self.user.user_permissions.add(self.permission)
 
@@ -299,3 +322,4 @@ class TestUpdatePositionsView(TestCase):
                                                                  device_position_y=200).exists())
         self.assertTrue(DeviceDiagramRelationship.objects.filter(diagram=diagram, device=d3, device_position_x=300,
                                                                  device_position_y=300).exists())
+        mock_redis_client.bump_visualisation_revision.assert_called_once_with('1')
@@ -6,6 +6,7 @@ app_name = 'diagram'
 urlpatterns = [
     path("<diagram_pk>/", views.index, name='index'),
     path("<diagram_pk>/graph.json", views.graph, name='graph'),
+    path("<diagram_pk>/changes.json", views.changes, name='changes'),
     path('<diagram_pk>/inactive_connections', views.InactiveView.as_view(), name='inactive_connections'),
     path('<diagram_pk>/update_positions', views.update_positions, name='update_positions'),
     path('new', views.update, name='create'),
@@ -1,23 +1,25 @@
 import csv
 import json
 from io import StringIO
-from itertools import groupby
 
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import transaction
 from django.db.utils import DataError, IntegrityError
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView
 
-from data.models import Device, Link
+from data.models import Device
 from diagram.forms import DiagramForm, DiagramFormSet, DiagramFormSetHelper, DiagramAddDevicesCsv
 from diagram.models import Diagram, DeviceDiagramRelationship
-from visualisation.views import get_inactive_connections
+from visualisation.response_cache import cached_json_response, changes_condition, invalidate_visualisation, \
+    visualisation_condition
+from visualisation.topology import get_changes_version, get_connection_key, get_topology_changes, \
+    get_topology_index, split_connection_changes
 
 
 @ensure_csrf_cookie
@@ -28,14 +30,23 @@ def index(request, diagram_pk):
 
 
 @login_required
+@visualisation_condition('diagram_graph', 'diagram_pk')
 def graph(request, diagram_pk):
     get_object_or_404(Diagram, pk=diagram_pk)
-    g = {
+    return cached_json_response(request, diagram_pk, 'diagram_graph', lambda: {
         "devices": diagram_points(diagram_pk),
         "connections": diagram_lines(diagram_pk),
         "settings": settings(diagram_pk)
-    }
-    return JsonResponse(g, safe=False)
+    })
+
+
+@login_required
+@changes_condition('diagram_changes', 'diagram_pk')
+def changes(request, diagram_pk):
+    get_object_or_404(Diagram, pk=diagram_pk)
+    return cached_json_response(request, diagram_pk, 'diagram_changes',
+                                lambda: diagram_changes(diagram_pk, request.GET.get('since')),
+                                get_version=get_changes_version, vary_on=('since',))
 
 
 class InactiveView(LoginRequiredMixin, TemplateView):
@@ -45,7 +56,7 @@ class InactiveView(LoginRequiredMixin, TemplateView):
         diagram_pk = kwargs['diagram_pk']
         get_object_or_404(Diagram, pk=diagram_pk)
         context = super().get_context_data(**kwargs)
-        context['inactive_list'] = get_inactive_connections(get_all_links(diagram_pk))
+        context['inactive_list'] = get_topology_index().get_inactive_connections(get_device_pks(diagram_pk))
         return context
 
 
@@ -58,6 +69,7 @@ def update_positions(request, diagram_pk):
     for position in positions:
         DeviceDiagramRelationship.objects.filter(diagram=diagram_pk, device=position['id']).update(
             device_position_x=position['x'], device_position_y=position['y'])
+    invalidate_visualisation(diagram_pk)
 
     return HttpResponse()
 
@@ -80,6 +92,7 @@ def update(request, diagram_pk=None):
         form = DiagramForm(instance=edited_diagram, data=request.POST)
         if form.is_valid():
             edited_diagram = form.save()
+            invalidate_visualisation(edited_diagram.pk)
             if diagram_pk is not None:
                 return HttpResponseRedirect(reverse('diagram:index', kwargs={'diagram_pk': edited_diagram.pk}))
             elif 'to_add_manually' in request.POST:
@@ -127,6 +140,7 @@ def add_devices_via_csv(request, diagram_pk):
                         diagram.devices.add(device, through_defaults={
                             'device_position_x': float(row['device_position_x']),
                             'device_position_y': float(row['device_position_y'])})
+                invalidate_visualisation(diagram_pk)
                 return HttpResponseRedirect(reverse('diagram:index', kwargs={'diagram_pk': diagram_pk}))
             except (LookupError, DataError, ValueError, IndexError, IntegrityError):
                 form.add_error('devices', 'Bad format of the file')
@@ -140,10 +154,35 @@ def add_devices_via_csv(request, diagram_pk):
     })
 
 
+def diagram_changes(diagram_pk, since):
+    version, topology_changes = get_topology_changes(diagram_pk, since)
+    if topology_changes is None:
+        return {
+            'version': version,
+            'full': True,
+            'devices': diagram_points(diagram_pk),
+            'connections': get_diagram_lines(diagram_pk),
+            'settings': settings(diagram_pk)
+        }
+    connections, device_pks = topology_changes
+    added, changed, removed = split_connection_changes(connections,
+                                                       get_diagram_lines(diagram_pk, connections.keys()),
+                                                       get_device_pks(diagram_pk))
+    return {
+        'version': version,
+        'full': False,
+        'devices': [device for device in diagram_points(diagram_pk) if str(device['id']) in device_pks]
+        if device_pks else [],
+        'added': added,
+        'changed': changed,
+        'removed': removed
+    }
+
+
 def diagram_points(diagram_pk):
     all_devices = []
 
-    for device_diagram in DeviceDiagramRelationship.objects.filter(diagram=diagram_pk):
+    for device_diagram in DeviceDiagramRelationship.objects.filter(diagram=diagram_pk).select_related('device'):
         all_devices.append({
             "id": device_diagram.device.id,
             "name": device_diagram.device.name,
@@ -159,43 +198,27 @@ def diagram_points(diagram_pk):
 
 
 def diagram_lines(diagram_pk):
-    all_connections = []
-    all_links = get_all_links(diagram_pk).values('pk', 'local_interface__device', 'remote_interface__device', 'active',
-                                                 'local_interface', 'local_interface__name', 'local_interface__speed',
-                                                 'local_interface__aggregate_interface',
-                                                 'local_interface__aggregate_interface__name', 'remote_interface__name',
-                                                 'remote_interface__aggregate_interface',
-                                                 'remote_interface__aggregate_interface',
-                                                 'remote_interface__aggregate_interface__name') \
-        .order_by('local_interface__device', 'remote_interface__device', 'local_interface__aggregate_interface',
-                  'local_interface')
-
-    for device_pair, link_list_between_device_pair in groupby(all_links, lambda x: (x.get('local_interface__device'),
-                                                                                    x.get('remote_interface__device'))):
-        local_device = Device.objects.get(pk=device_pair[0])
-        remote_device = Device.objects.get(pk=device_pair[1])
-
-        link_list_between_device_pair = list(link_list_between_device_pair)
-        group_by_aggregate = groupby(link_list_between_device_pair,
-                                     lambda x: x.get('local_interface__aggregate_interface'))
-        for aggregate_interface, links_with_common_aggregate_interface in group_by_aggregate:
-            links_with_common_aggregate_interface = list(links_with_common_aggregate_interface)
-            if aggregate_interface is None:
-                for link in links_with_common_aggregate_interface:
-                    all_connections.append(get_connection_details([link], local_device, remote_device))
-            else:
-                all_connections.append(get_connection_details(links_with_common_aggregate_interface, local_device,
-                                                              remote_device))
+    return [connection for connections in get_diagram_lines(diagram_pk).values() for connection in connections]
+
+
+def get_diagram_lines(diagram_pk, connection_keys=None):
+    all_connections = {}
+    device_pks = get_device_pks(diagram_pk)
+    for device_pair, link_lists in get_topology_index().get_connections(device_pks):
+        key = get_connection_key(device_pair)
+        if connection_keys is None or key in connection_keys:
+            all_connections[key] = [get_connection_details(link_list, device_pair[0], device_pair[1])
+                                    for link_list in link_lists]
     return all_connections
 
 
-def get_connection_details(link_list, local_device, remote_device):
+def get_connection_details(link_list, local_device_pk, remote_device_pk):
     number_of_active_links = sum([link.get('active') for link in link_list])
     speed = link_list[-1].get('local_interface__speed')
 
     return {
-        "source": local_device.id,
-        "target": remote_device.id,
+        "source": local_device_pk,
+        "target": remote_device_pk,
         "id": '_'.join([str(link.get('pk')) for link in link_list]),
         "number_of_links": len(link_list),
         "number_of_active_links": number_of_active_links,
@@ -203,9 +226,8 @@ def get_connection_details(link_list, local_device, remote_device):
     }
 
 
-def get_all_links(diagram_pk):
-    devices = Diagram.objects.get(pk=diagram_pk).devices.all()
-    return Link.objects.filter(local_interface__device__in=devices, remote_interface__device__in=devices)
+def get_device_pks(diagram_pk):
+    return set(DeviceDiagramRelationship.objects.filter(diagram=diagram_pk).values_list('device', flat=True))
 
 
 def settings(diagram_pk):
@@ -235,6 +257,7 @@ def manage_devices(request, diagram_pk):
                 instance.save()
             for obj in formset.deleted_objects:
                 obj.delete()
+            invalidate_visualisation(diagram_pk)
             return HttpResponseRedirect(reverse('diagram:index', kwargs={'diagram_pk': diagram_pk}))
     else:
         formset = DiagramFormSet(queryset=DeviceDiagramRelationship.objects.filter(diagram=diagram))
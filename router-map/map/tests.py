@@ -2,6 +2,7 @@ import csv
 import os
 import tempfile
 
+import mock
 from django.contrib.auth.models import User, Permission
 from django.contrib.gis.geos import Point
 from django.test import TestCase
@@ -9,11 +10,14 @@ from django.urls import reverse
 
 from data.models import Device, Interface, Link
 from map.forms import MapForm
+from map.views import map_lines
 from map.models import Map, DeviceMapRelationship
+from utils.testing import IsolatedStateMixin
 
 
-class TestHttpResponseIndex(TestCase):
+class TestHttpResponseIndex(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.map = Map.objects.create(name='Map1', pk=1)
         self.user = User.objects.create_user(username="user1", password="user1")
 
@@ -33,8 +37,9 @@ class TestHttpResponseIndex(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-class TestHttpResponsePoints(TestCase):
+class TestHttpResponsePoints(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.map = Map.objects.create(name='Map1', pk=1)
         self.user = User.objects.create_user(username="user1", password="user1")
 
@@ -83,8 +88,9 @@ class TestHttpResponsePoints(TestCase):
         self.assertJSONEqual(response.content, json)
 
 
-class TestHttpResponseLinks(TestCase):
+class TestHttpResponseLinks(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
 
         self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_is_active=True)
@@ -228,8 +234,136 @@ class TestHttpResponseLinks(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(response.content, json)
 
+    def test_lines_number_of_queries(self):
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1,
+                            active=True, pk=10)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(map_lines(1)), 1)
+
+        for i in range(3, 13):
+            device = Device.objects.create(name=str(i), ip_address=f"1.1.1.{i}", pk=i)
+            self.map.devices.add(device, through_defaults={'point': Point(i, i)})
+            interface = Interface.objects.create(number=1, name="x", speed=1, device=device)
+            Link.objects.create(local_interface=interface, remote_interface=self.interface2_device1)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(map_lines(1)), 11)
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_lines_cached(self, mock_redis_client):
+        self.client.login(username='user1', password='user1')
+        mock_redis_client.get_topology_version.return_value = (b'1', b'1001.5')
+        mock_redis_client.get_visualisation_version.return_value = (b'1', b'1001.5', b'1')
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1,
+                            active=True, pk=10)
+
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}))
+        self.assertEqual(response.json()[0][0]['number_of_active_links'], 1)
+
+        Link.objects.filter(pk=10).update(active=False)
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}))
+        self.assertEqual(response.json()[0][0]['number_of_active_links'], 1)
+
+        mock_redis_client.get_topology_version.return_value = (b'2', b'1001.5')
+        mock_redis_client.get_visualisation_version.return_value = (b'2', b'1001.5', b'1')
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}))
+        self.assertEqual(response.json()[0][0]['number_of_active_links'], 0)
+
+    def test_lines_not_cached_without_version(self):
+        self.client.login(username='user1', password='user1')
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1,
+                            active=True, pk=10)
+
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}))
+        self.assertEqual(response.json()[0][0]['number_of_active_links'], 1)
+        self.assertFalse(response.has_header('ETag'))
+
+        Link.objects.filter(pk=10).update(active=False)
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}))
+        self.assertEqual(response.json()[0][0]['number_of_active_links'], 0)
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_lines_not_modified(self, mock_redis_client):
+        self.client.login(username='user1', password='user1')
+        mock_redis_client.get_visualisation_version.return_value = (b'1580000000.5', b'1002.5', b'1')
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], 'Sun, 26 Jan 2020 00:53:20 GMT')
+        etag = response['ETag']
+
+        with mock.patch('map.views.get_object_or_404') as mock_get_object_or_404:
+            response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}),
+                                       HTTP_IF_MODIFIED_SINCE='Sun, 26 Jan 2020 00:53:20 GMT')
+            self.assertEqual(response.status_code, 304)
+            mock_get_object_or_404.assert_not_called()
+
+        mock_redis_client.get_visualisation_version.return_value = (b'1580000000.5', b'1002.5', b'1580000001.5')
+        response = self.client.get(reverse('map:lines', kwargs={'map_pk': 1}), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_changes(self, mock_redis_client):
+        self.client.login(username='user1', password='user1')
+        mock_redis_client.get_topology_version.return_value = (b'1', b'1004.5')
+        mock_redis_client.get_visualisation_version.return_value = (b'1', b'1004.5', None)
+        mock_redis_client.get_topology_history_state.return_value = ('a', 3, '1:1004.5')
+        mock_redis_client.get_topology_diffs.return_value = [
+            {'epoch': 'a', 'sequence': 3, 'connections': {'2_1': 'added', '3_1': 'removed'}, 'devices': ['1']}]
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1,
+                            active=True, pk=10)
+        line = {"id": "10",
+                "number_of_links": 1,
+                "number_of_active_links": 1,
+                "speed": 1,
+                "device1_coordinates": [1, 2],
+                "device2_coordinates": [1, 1]}
+
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}))
+        self.assertEqual(response.json()['version'], 'a:3:')
+        self.assertTrue(response.json()['full'])
+        self.assertEqual(response.json()['lines'], {'2_1': [line]})
+        self.assertEqual(len(response.json()['points']), 2)
+
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}), {'since': 'a:2:'})
+        self.assertFalse(response.json()['full'])
+        self.assertEqual(response.json()['added'], {'2_1': [line]})
+        self.assertEqual(response.json()['changed'], {})
+        self.assertEqual(response.json()['removed'], [])
+        self.assertEqual([point['id'] for point in response.json()['points']], [1])
+
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}), {'since': 'a:1:'})
+        self.assertTrue(response.json()['full'])
+        mock_redis_client.set_topology_history.assert_not_called()
+
+    @mock.patch("data.redis_client.redis_client")
+    def test_changes_not_modified(self, mock_redis_client):
+        self.client.login(username='user1', password='user1')
+        mock_redis_client.get_topology_version.return_value = (b'1', b'1006.5')
+        mock_redis_client.get_visualisation_version.return_value = (b'1', b'1006.5', None)
+        mock_redis_client.get_topology_history_state.return_value = ('a', 3, '1:1006.5')
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}), {'since': 'a:3:'})
+        self.assertEqual(response.json()['version'], 'a:3:')
+        etag = response['ETag']
+
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}), {'since': 'a:3:'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}), {'since': 'a:2:'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # history of the current topology version is still being recorded by another process
+        mock_redis_client.get_topology_history_state.return_value = ('a', 3, '1:1005.5')
+        mock_redis_client.acquire_topology_history_lock.return_value = False
+        response = self.client.get(reverse('map:changes', kwargs={'map_pk': 1}), {'since': 'a:3:'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
 
-class TestHttpResponseInactiveConnections(TestCase):
+class TestHttpResponseInactiveConnections(IsolatedStateMixin, TestCase):
     def test_inactive_connections(self):
         self.user = User.objects.create_user(username="user1", password="user1")
         self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1, connection_is_active=True)
@@ -307,8 +441,9 @@ class MapFormTest(TestCase):
                           [u"Ensure this value is greater than or equal to highlighted links range min."])
 
 
-class TestEditMapView(TestCase):
+class TestEditMapView(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.permission = Permission.objects.get(name='Can change map')
 
@@ -334,8 +469,9 @@ class TestEditMapView(TestCase):
         self.assertTrue(Map.objects.filter(name='x').exists())
 
 
-class TestAddDevicesViaCsv(TestCase):
+class TestAddDevicesViaCsv(IsolatedStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.user = User.objects.create_user(username="user1", password="user1")
         self.permission = Permission.objects.get(name='Can change map')
         self.map = Map.objects.create(name='Map1', pk=1)
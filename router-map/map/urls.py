@@ -7,6 +7,7 @@ urlpatterns = [
     path('<map_pk>/', views.index, name='index'),
     path('<map_pk>/points.json', views.points, name='points'),
     path('<map_pk>/lines.json', views.lines, name='lines'),
+    path('<map_pk>/changes.json', views.changes, name='changes'),
     path('<map_pk>/inactive_connections', views.InactiveView.as_view(), name='inactive_connections'),
     path("<map_pk>/view_settings", views.view_settings, name='view_settings'),
     path('new', views.update, name='create'),
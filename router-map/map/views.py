@@ -1,6 +1,5 @@
 import csv
 from io import StringIO
-from itertools import groupby
 
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -13,10 +12,13 @@ from django.urls import reverse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.generic import TemplateView
 
-from data.models import Device, Link
+from data.models import Device
 from map.forms import MapForm, MapFormSetHelper, MapFormSet, MapAddDevicesCsv
 from map.models import Map, DeviceMapRelationship
-from visualisation.views import get_inactive_connections
+from visualisation.response_cache import cached_json_response, changes_condition, invalidate_visualisation, \
+    visualisation_condition
+from visualisation.topology import get_changes_version, get_connection_key, get_topology_changes, \
+    get_topology_index, split_connection_changes
 
 
 @ensure_csrf_cookie
@@ -33,23 +35,34 @@ class InactiveView(LoginRequiredMixin, TemplateView):
         map_pk = kwargs['map_pk']
         get_object_or_404(Map, pk=map_pk)
         context = super().get_context_data(**kwargs)
-        context['inactive_list'] = get_inactive_connections(get_all_links(map_pk))
+        context['inactive_list'] = get_topology_index().get_inactive_connections(get_device_pks(map_pk))
         return context
 
 
 @login_required
+@visualisation_condition('map_points', 'map_pk')
 def points(request, map_pk):
     get_object_or_404(Map, pk=map_pk)
-    return JsonResponse(map_points(map_pk), safe=False)
+    return cached_json_response(request, map_pk, 'map_points', lambda: map_points(map_pk))
 
 
 @login_required
+@visualisation_condition('map_lines', 'map_pk')
 def lines(request, map_pk):
     get_object_or_404(Map, pk=map_pk)
-    return JsonResponse(map_lines(map_pk), safe=False)
+    return cached_json_response(request, map_pk, 'map_lines', lambda: map_lines(map_pk))
 
 
 @login_required
+@changes_condition('map_changes', 'map_pk')
+def changes(request, map_pk):
+    get_object_or_404(Map, pk=map_pk)
+    return cached_json_response(request, map_pk, 'map_changes', lambda: map_changes(map_pk, request.GET.get('since')),
+                                get_version=get_changes_version, vary_on=('since',))
+
+
+@login_required
+@visualisation_condition('map_view_settings', 'map_pk')
 def view_settings(request, map_pk):
     m = get_object_or_404(Map, pk=map_pk)
     settings = {
@@ -80,6 +93,7 @@ def update(request, map_pk=None):
         form = MapForm(instance=edited_map, data=request.POST)
         if form.is_valid():
             edited_map = form.save()
+            invalidate_visualisation(edited_map.pk)
             if map_pk is not None:
                 return HttpResponseRedirect(reverse('map:index', kwargs={'map_pk': edited_map.pk}))
             elif 'to_add_manually' in request.POST:
@@ -125,6 +139,7 @@ def add_devices_via_csv(request, map_pk):
                         device.save()
                         device_map.devices.add(device, through_defaults={
                             'point': Point(float(row['device_position_x']), float(row['device_position_y']))})
+                invalidate_visualisation(map_pk)
                 return HttpResponseRedirect(reverse('map:index', kwargs={'map_pk': map_pk}))
             except (LookupError, DataError, ValueError, IndexError, IntegrityError):
                 form.add_error('devices', 'Bad format of the file')
@@ -138,10 +153,32 @@ def add_devices_via_csv(request, map_pk):
     })
 
 
+def map_changes(map_pk, since):
+    version, topology_changes = get_topology_changes(map_pk, since)
+    if topology_changes is None:
+        return {
+            'version': version,
+            'full': True,
+            'points': map_points(map_pk),
+            'lines': get_map_lines(map_pk)
+        }
+    connections, device_pks = topology_changes
+    added, changed, removed = split_connection_changes(connections, get_map_lines(map_pk, connections.keys()),
+                                                       get_device_pks(map_pk))
+    return {
+        'version': version,
+        'full': False,
+        'points': [point for point in map_points(map_pk) if str(point['id']) in device_pks] if device_pks else [],
+        'added': added,
+        'changed': changed,
+        'removed': removed
+    }
+
+
 def map_points(map_pk):
     all_devices = []
 
-    for device_map in DeviceMapRelationship.objects.filter(map=map_pk):
+    for device_map in DeviceMapRelationship.objects.filter(map=map_pk).select_related('device'):
         all_devices.append({
             "id": device_map.device.id,
             "name": device_map.device.name,
@@ -156,44 +193,23 @@ def map_points(map_pk):
 
 
 def map_lines(map_pk):
-    all_connections = []
-    devices = Map.objects.get(pk=map_pk).devices.all()
-    links = Link.objects.filter(local_interface__device__in=devices,
-                                remote_interface__device__in=devices)
-    all_links = links.values('pk', 'local_interface__device', 'remote_interface__device', 'active', 'local_interface',
-                             'local_interface__name', 'local_interface__speed', 'local_interface__aggregate_interface',
-                             'local_interface__aggregate_interface__name', 'remote_interface__name',
-                             'remote_interface__aggregate_interface', 'remote_interface__aggregate_interface',
-                             'remote_interface__aggregate_interface__name') \
-        .order_by('local_interface__device', 'remote_interface__device', 'local_interface__aggregate_interface',
-                  'local_interface')
-
-    for device_pair, link_list_between_device_pair in groupby(all_links, lambda x: (x.get('local_interface__device'),
-                                                                                    x.get('remote_interface__device'))):
-        connection_list = []
-        local_device = Device.objects.get(pk=device_pair[0])
-        remote_device = Device.objects.get(pk=device_pair[1])
-
-        link_list_between_device_pair = list(link_list_between_device_pair)
-        group_by_aggregate = groupby(link_list_between_device_pair,
-                                     lambda x: x.get('local_interface__aggregate_interface'))
-        for aggregate_interface, links_with_common_aggregate_interface in group_by_aggregate:
-            links_with_common_aggregate_interface = list(links_with_common_aggregate_interface)
-            if aggregate_interface is None:
-                for link in links_with_common_aggregate_interface:
-                    connection_list.append(get_connection_details([link], local_device, remote_device, map_pk))
-            else:
-                connection_list.append(get_connection_details(links_with_common_aggregate_interface, local_device,
-                                                              remote_device, map_pk))
-        all_connections.append(connection_list)
+    return list(get_map_lines(map_pk).values())
+
+
+def get_map_lines(map_pk, connection_keys=None):
+    all_connections = {}
+    points = dict(DeviceMapRelationship.objects.filter(map=map_pk).values_list('device', 'point'))
+    for device_pair, link_lists in get_topology_index().get_connections(points.keys()):
+        key = get_connection_key(device_pair)
+        if connection_keys is None or key in connection_keys:
+            all_connections[key] = [get_connection_details(link_list, points[device_pair[0]], points[device_pair[1]])
+                                    for link_list in link_lists]
     return all_connections
 
 
-def get_connection_details(link_list, local_device, remote_device, map_pk):
+def get_connection_details(link_list, local_device_point, remote_device_point):
     number_of_active_links = sum([link.get('active') for link in link_list])
     speed = link_list[-1].get('local_interface__speed')
-    d1 = DeviceMapRelationship.objects.get(device=local_device.id, map=map_pk)
-    d2 = DeviceMapRelationship.objects.get(device=remote_device.id, map=map_pk)
     return {
         "id": '_'.join([str(link.get('pk')) for link in link_list]),
         "number_of_links": len(link_list),
@@ -201,20 +217,19 @@ def get_connection_details(link_list, local_device, remote_device, map_pk):
         "speed": speed,
         "device1_coordinates":
             [
-                float(d1.point[0]),
-                float(d1.point[1])
+                float(local_device_point[0]),
+                float(local_device_point[1])
             ],
         "device2_coordinates":
             [
-                float(d2.point[0]),
-                float(d2.point[1])
+                float(remote_device_point[0]),
+                float(remote_device_point[1])
             ]
     }
 
 
-def get_all_links(map_pk):
-    devices = Map.objects.get(pk=map_pk).devices.all()
-    return Link.objects.filter(local_interface__device__in=devices, remote_interface__device__in=devices)
+def get_device_pks(map_pk):
+    return set(DeviceMapRelationship.objects.filter(map=map_pk).values_list('device', flat=True))
 
 
 @login_required
@@ -233,6 +248,7 @@ def manage_devices(request, map_pk):
                 instance.save()
             for obj in formset.deleted_objects:
                 obj.delete()
+            invalidate_visualisation(map_pk)
             return HttpResponseRedirect(reverse('map:index', kwargs={'map_pk': map_pk}))
     else:
         formset = MapFormSet(queryset=DeviceMapRelationship.objects.filter(map=device_map))
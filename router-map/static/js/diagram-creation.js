@@ -11,6 +11,11 @@ const diagramId = $('#title').data("diagramId");
 
 let positionsJSON;
 
+let version = null;
+let devices = [];
+let connections = {};
+let settings = {};
+
 const svg = d3.select("#page-content").insert("svg", ".main-row")
     .attr("width", window.innerWidth)
     .attr("height", window.innerHeight - 96);
@@ -53,16 +58,49 @@ refresh();
 
 function refresh() {
     $.ajax({
-        url: "/diagram/" + diagramId + "/graph.json",
+        url: "/diagram/" + diagramId + "/changes.json",
         type: "get",
         dataType: "json",
+        data: version === null ? {} : {since: version},
         cache: false,
+        ifModified: true,
         timeout: CONNECTION_TIMEOUT
     })
-        .done(drawGraph)
+        .done(applyChanges)
         .fail(handleConnectionFail);
 }
 
+function applyChanges(response, textStatus) {
+    if (textStatus === 'notmodified') {
+        return;
+    }
+    if (response.full) {
+        devices = response.devices;
+        connections = response.connections;
+        settings = response.settings;
+    } else {
+        response.removed.forEach(function (key) {
+            delete connections[key];
+        });
+        Object.assign(connections, response.added, response.changed);
+        response.devices.forEach(function (changedDevice) {
+            devices.filter(device => device.id === changedDevice.id).forEach(function (device) {
+                device.name = changedDevice.name;
+                device.connection_is_active = changedDevice.connection_is_active;
+            });
+        });
+    }
+    version = response.version;
+
+    let graphConnections = [];
+    Object.keys(connections).forEach(function (key) {
+        connections[key].forEach(function (connection) {
+            graphConnections.push(Object.assign({}, connection));
+        });
+    });
+    drawGraph({devices: devices, connections: graphConnections, settings: settings});
+}
+
 function drawGraph(graph) {
     function lineWidth(speed) {
         if (graph.settings.highlighted_links_width && speed >= graph.settings.highlighted_links_range_min
@@ -20,33 +20,25 @@ $("body").prepend($('<div id="map">'));
 
 const mapId = $('#title').data("mapId");
 
-const lineVectorSource = new VectorSource({
-    loader: function () {
-        $.ajax({
-            url: '/map/' + mapId + '/lines.json',
-            type: "get",
-            dataType: "json",
-            cache: false,
-            timeout: CONNECTION_TIMEOUT
-        })
-            .done(loadLines)
-            .fail(handleConnectionFail);
-    }
-});
+const lineVectorSource = new VectorSource();
 
-const pointVectorSource = new VectorSource({
-    loader: function () {
-        $.ajax({
-            url: '/map/' + mapId + '/points.json',
-            type: "get",
-            dataType: "json",
-            cache: false,
-            timeout: CONNECTION_TIMEOUT
-        })
-            .done(loadPoints)
-            .fail(handleConnectionFail);
-    }
-});
+const pointVectorSource = new VectorSource();
+
+let version = null;
+
+function refresh() {
+    $.ajax({
+        url: '/map/' + mapId + '/changes.json',
+        type: "get",
+        dataType: "json",
+        data: version === null ? {} : {since: version},
+        cache: false,
+        ifModified: true,
+        timeout: CONNECTION_TIMEOUT
+    })
+        .done(applyChanges)
+        .fail(handleConnectionFail);
+}
 
 const lineLayer = new VectorLayer({
     source: lineVectorSource,
@@ -63,14 +55,33 @@ const pointLayer = new VectorLayer({
     style: mapStyle.getPointStyle
 });
 
-function loadLines(response) {
+function applyChanges(response, textStatus) {
+    if (textStatus === 'notmodified') {
+        return;
+    }
+    if (response.full) {
+        lineVectorSource.clear(true);
+        pointVectorSource.clear(true);
+        addLines(response.lines);
+        addPoints(response.points);
+    } else {
+        removeLines(response.removed.concat(Object.keys(response.changed)));
+        addLines(response.added);
+        addLines(response.changed);
+        updatePoints(response.points);
+    }
+    version = response.version;
+}
+
+function addLines(lines) {
     let features = [];
-    response.forEach(function (x) {
-        x.forEach(function (link, i) {
+    Object.keys(lines).forEach(function (key) {
+        lines[key].forEach(function (link, i) {
             let lineStr = new LineString([fromLonLat(link.device1_coordinates), fromLonLat(link.device2_coordinates)]);
 
             let feature = new Feature({
                 geometry: lineStr,
+                connection_key: key,
                 connection_id: link.id,
                 description: link.number_of_active_links + '/' + link.number_of_links + '\xD7' + link.speed + 'G',
                 status: status(link.number_of_active_links, link.number_of_links),
@@ -83,9 +94,19 @@ function loadLines(response) {
     lineVectorSource.addFeatures(features);
 }
 
-function loadPoints(response) {
+function removeLines(keys) {
+    keys = new Set(keys);
+    lineVectorSource.getFeatures().forEach(function (feature) {
+        if (keys.has(feature.get('connection_key'))) {
+            lineVectorSource.removeFeature(feature);
+        }
+    });
+    highlightLineLayer.getSource().clear();
+}
+
+function addPoints(points) {
     let features = [];
-    response.forEach(function (point) {
+    points.forEach(function (point) {
         let geometry = new Point(fromLonLat(point.coordinates));
 
         let feature = new Feature({
@@ -99,6 +120,19 @@ function loadPoints(response) {
     pointVectorSource.addFeatures(features);
 }
 
+function updatePoints(points) {
+    let changedPoints = {};
+    points.forEach(function (point) {
+        changedPoints[point.id] = point;
+    });
+    pointVectorSource.getFeatures().forEach(function (feature) {
+        const point = changedPoints[feature.get('id')];
+        if (point !== undefined) {
+            feature.setProperties({name: point.name, connection_is_active: point.connection_is_active});
+        }
+    });
+}
+
 function status(number_of_active_links, number_of_links) {
     if (number_of_active_links === number_of_links)
         return 'active';
@@ -176,9 +210,6 @@ pointLayer.getSource().once('change', function (e) {
     }
 });
 
-function refresh() {
-    lineLayer.getSource().refresh();
-    pointLayer.getSource().refresh();
-}
+refresh();
 
 export {refresh, mapId}
@@ -6,13 +6,17 @@ function refreshUpdateTime() {
         url: '/data/last_update_time',
         type: "get",
         cache: false,
+        ifModified: true,
         timeout: CONNECTION_TIMEOUT
     })
         .done(setUpdateTime)
         .fail(handleConnectionFail);
 }
 
-function setUpdateTime(data) {
+function setUpdateTime(data, textStatus) {
+    if (textStatus === 'notmodified') {
+        return;
+    }
     if (!data) {
         $('#data').text('No information about last data update');
     } else {
@@ -0,0 +1,29 @@
+import mock
+from django.core.cache import cache
+
+
+def get_empty_redis_client():
+    redis_client = mock.MagicMock()
+    redis_client.get_last_update_time.return_value = None
+    redis_client.get_cycle_stats.return_value = None
+    redis_client.get_topology_version.return_value = (None, None)
+    redis_client.get_visualisation_version.return_value = (None, None, None)
+    redis_client.get_topology_history_state.return_value = (None, 0, None)
+    redis_client.acquire_topology_history_lock.return_value = True
+    redis_client.get_topology_snapshot.return_value = None
+    redis_client.get_topology_diffs.return_value = []
+    return redis_client
+
+
+class IsolatedStateMixin:
+    # state shared by a process or kept in redis would otherwise leak between tests with different fixtures
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        redis_client = get_empty_redis_client()
+        for target, value in (('visualisation.topology._topology_index', None),
+                              ('data.redis_client.redis_client', redis_client),
+                              ('data.views.redis_client', redis_client)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
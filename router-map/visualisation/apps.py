@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class VisualisationConfig(AppConfig):
     name = 'visualisation'
+
+    def ready(self):
+        from visualisation import signals  # noqa F401
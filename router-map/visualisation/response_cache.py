@@ -0,0 +1,46 @@
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+
+from data import redis_client
+from data.conditional import get_request_variant, get_request_version, get_version_key, version_condition
+from visualisation.topology import get_changes_version
+
+logger = logging.getLogger('maps')
+
+
+def get_visualisation_version(visualisation_pk):
+    return redis_client.redis_client.get_visualisation_version(visualisation_pk)
+
+
+def visualisation_condition(name, pk_kwarg):
+    return version_condition(name, lambda **kwargs: get_visualisation_version(kwargs[pk_kwarg]))
+
+
+def changes_condition(name, pk_kwarg):
+    return version_condition(name, lambda **kwargs: get_changes_version(kwargs[pk_kwarg]), vary_on=('since',))
+
+
+def cached_json_response(request, visualisation_pk, name, get_data, get_version=get_visualisation_version,
+                         vary_on=()):
+    version = get_request_version(request, lambda: get_version(visualisation_pk))
+    if version is None:
+        return JsonResponse(get_data(), safe=False)
+    key = f'response:{get_request_variant(request, name, vary_on)}:{visualisation_pk}:{get_version_key(version)}'
+    content = cache.get(key)
+    if content is None:
+        content = json.dumps(get_data(), cls=DjangoJSONEncoder)
+        cache.set(key, content, settings.RESPONSE_CACHE_TIMEOUT)
+    return HttpResponse(content, content_type='application/json')
+
+
+def invalidate_visualisation(visualisation_pk):
+    try:
+        redis_client.redis_client.bump_visualisation_revision(visualisation_pk)
+    except redis.RedisError as e:
+        logger.warning(f"Visualisation revision can not be changed: {e}")
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from data.models import Device, Link
+from visualisation.topology import invalidate_topology_index
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+def topology_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_topology_index)
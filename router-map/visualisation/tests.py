@@ -1,7 +1,14 @@
+import mock
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.conf import settings
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 
+from data.models import Device, Interface, Link
+from utils.testing import IsolatedStateMixin
 from .models import Visualisation
+from .topology import TopologyIndex, get_history_changes, get_topology_diff, get_topology_index, \
+    update_topology_history
 
 
 class TestMapForm(TestCase):
@@ -21,3 +28,108 @@ class TestMapForm(TestCase):
         visual = Visualisation(name='a', highlighted_links_width=8, highlighted_links_range_min=3,
                                highlighted_links_range_max=2)
         self.assertRaises(ValidationError, visual.full_clean)
+
+
+@mock.patch("data.redis_client.redis_client")
+class TestTopologyIndex(IsolatedStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1)
+        self.device2 = Device.objects.create(name='b', ip_address="1.1.1.2", pk=2)
+        self.device3 = Device.objects.create(name='c', ip_address="1.1.1.3", pk=3)
+        self.interface1_device1 = Interface.objects.create(number=1, name="x", speed=1, device=self.device1)
+        self.interface1_device2 = Interface.objects.create(number=1, name="x", speed=1, device=self.device2)
+        self.interface1_device3 = Interface.objects.create(number=1, name="x", speed=1, device=self.device3)
+        Link.objects.create(local_interface=self.interface1_device2, remote_interface=self.interface1_device1,
+                            active=False, pk=10)
+        Link.objects.create(local_interface=self.interface1_device3, remote_interface=self.interface1_device1,
+                            active=True, pk=11)
+
+    def test_connections_of_visualisation(self, mock_redis_client):
+        topology_index = TopologyIndex()
+
+        self.assertEqual([device_pair for device_pair, _ in topology_index.get_connections({1, 2, 3})],
+                         [(2, 1), (3, 1)])
+        self.assertEqual([device_pair for device_pair, _ in topology_index.get_connections({1, 3})], [(3, 1)])
+        self.assertEqual(topology_index.get_inactive_connections({1, 2}),
+                         [{'device1_pk': 2, 'device2_pk': 1, 'description': 'b - a'}])
+        self.assertEqual(topology_index.get_inactive_connections({1, 3}), [])
+
+    def test_topology_index_cached(self, mock_redis_client):
+        mock_redis_client.get_topology_version.return_value = (b'1', b'test_topology_index_cached')
+        topology_index = get_topology_index()
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_topology_index(), topology_index)
+        mock_redis_client.get_topology_version.return_value = (b'2', b'test_topology_index_cached')
+        self.assertIsNot(get_topology_index(), topology_index)
+
+
+@mock.patch("data.redis_client.redis_client")
+class TestTopologyRevision(TransactionTestCase):
+    def test_link_deletion_changes_topology_revision(self, mock_redis_client):
+        device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1)
+        device2 = Device.objects.create(name='b', ip_address="1.1.1.2", pk=2)
+        interface1_device1 = Interface.objects.create(number=1, name="x", speed=1, device=device1)
+        interface1_device2 = Interface.objects.create(number=1, name="x", speed=1, device=device2)
+        Link.objects.create(local_interface=interface1_device2, remote_interface=interface1_device1, active=False,
+                            pk=10)
+        mock_redis_client.reset_mock()
+
+        with transaction.atomic():
+            Link.objects.filter(pk=10).delete()
+            mock_redis_client.bump_topology_revision.assert_not_called()
+
+        mock_redis_client.bump_topology_revision.assert_called()
+
+
+@mock.patch("data.redis_client.redis_client")
+class TestTopologyHistory(IsolatedStateMixin, TestCase):
+    def test_topology_diff(self, mock_redis_client):
+        old_snapshot = {'connections': {'2_1': [[[10, True, 1]]], '3_1': [[[11, True, 1]]]},
+                        'devices': {'1': ['a', True], '2': ['b', True], '3': ['c', True]}}
+        new_snapshot = {'connections': {'2_1': [[[10, False, 1]]], '4_1': [[[12, True, 1]]]},
+                        'devices': {'1': ['a', True], '2': ['b', False], '3': ['d', True], '4': ['e', True]}}
+
+        self.assertEqual(get_topology_diff(old_snapshot, new_snapshot),
+                         {'connections': {'2_1': 'changed', '4_1': 'added', '3_1': 'removed'},
+                          'devices': ['2', '3', '4']})
+
+    def test_history_changes(self, mock_redis_client):
+        mock_redis_client.get_topology_diffs.return_value = [
+            {'epoch': 'a', 'sequence': 2, 'connections': {'2_1': 'changed'}, 'devices': []},
+            {'epoch': 'a', 'sequence': 3, 'connections': {'3_1': 'added', '2_1': 'removed'}, 'devices': ['3']},
+            {'epoch': 'a', 'sequence': 4, 'connections': {'3_1': 'removed'}, 'devices': ['1']},
+        ]
+
+        self.assertEqual(get_history_changes('a', 1), ({'2_1': True, '3_1': False}, {'1', '3'}))
+        self.assertEqual(get_history_changes('a', 3), ({'3_1': True}, {'1'}))
+        self.assertIsNone(get_history_changes('a', 0))
+
+    def test_history_updated(self, mock_redis_client):
+        device1 = Device.objects.create(name='a', ip_address="1.1.1.1", pk=1)
+        device2 = Device.objects.create(name='b', ip_address="1.1.1.2", pk=2)
+        device3 = Device.objects.create(name='c', ip_address="1.1.1.3", pk=3, connection_is_active=True)
+        interface1_device1 = Interface.objects.create(number=1, name="x", speed=1, device=device1)
+        interface1_device2 = Interface.objects.create(number=1, name="x", speed=1, device=device2)
+        interface1_device3 = Interface.objects.create(number=1, name="x", speed=1, device=device3)
+        Link.objects.create(local_interface=interface1_device2, remote_interface=interface1_device1, active=False,
+                            pk=10)
+        Link.objects.create(local_interface=interface1_device3, remote_interface=interface1_device1, active=True,
+                            pk=11)
+        mock_redis_client.get_topology_version.return_value = (b'1', b'1005.5')
+        mock_redis_client.get_topology_history_state.return_value = ('a', 1, '0:1005.5')
+        mock_redis_client.acquire_topology_history_lock.return_value = True
+        mock_redis_client.get_topology_snapshot.return_value = {'connections': {'2_1': [[[10, False, 1]]]},
+                                                                'devices': {'1': ['a', False], '2': ['b', False],
+                                                                            '3': ['c', False]}}
+
+        self.assertEqual(update_topology_history(), ('a', 2))
+        mock_redis_client.set_topology_history.assert_called_once_with(
+            'a', 2, '1:1005.5', mock.ANY, {'connections': {'3_1': 'added'}, 'devices': ['3']},
+            settings.TOPOLOGY_HISTORY_SIZE)
+        mock_redis_client.release_topology_history_lock.assert_called_once()
+
+        mock_redis_client.get_topology_history_state.return_value = ('a', 2, '1:1005.5')
+        self.assertEqual(update_topology_history(), ('a', 2))
+        mock_redis_client.acquire_topology_history_lock.assert_called_once()
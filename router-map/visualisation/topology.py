@@ -0,0 +1,200 @@
+import logging
+import threading
+import uuid
+from itertools import groupby
+
+import redis
+from django.conf import settings
+
+from data import redis_client
+from data.conditional import get_version_key
+from data.models import Device, Link
+
+logger = logging.getLogger('maps')
+
+TOPOLOGY_HISTORY_LOCK_TIMEOUT = 60
+
+_topology_index_lock = threading.Lock()
+_topology_index = None
+
+
+class TopologyIndex:
+    def __init__(self, version=None):
+        self.version = version
+        self.connections = []
+        all_links_values = Link.objects.values('pk', 'local_interface__device', 'remote_interface__device', 'active',
+                                               'local_interface__speed', 'local_interface__aggregate_interface',
+                                               'local_interface__device__name', 'remote_interface__device__name') \
+            .order_by('local_interface__device', 'remote_interface__device', 'local_interface__aggregate_interface',
+                      'local_interface')
+
+        for device_pair, link_list_between_device_pair in groupby(all_links_values, lambda x: (
+                x.get('local_interface__device'), x.get('remote_interface__device'))):
+            link_list_between_device_pair = list(link_list_between_device_pair)
+            link_lists = []
+            group_by_aggregate = groupby(link_list_between_device_pair,
+                                         lambda x: x.get('local_interface__aggregate_interface'))
+            for aggregate_interface, links_with_common_aggregate_interface in group_by_aggregate:
+                if aggregate_interface is None:
+                    link_lists.extend([link] for link in links_with_common_aggregate_interface)
+                else:
+                    link_lists.append(list(links_with_common_aggregate_interface))
+            inactive_connection = None
+            active_links_number = sum([link.get('active') for link in link_list_between_device_pair])
+            if active_links_number < len(link_list_between_device_pair):
+                inactive_connection = {
+                    "device1_pk": device_pair[0],
+                    "device2_pk": device_pair[1],
+                    "description": f"{link_list_between_device_pair[-1].get('local_interface__device__name')} - "
+                                   f"{link_list_between_device_pair[-1].get('remote_interface__device__name')}"
+                }
+            self.connections.append((device_pair, link_lists, inactive_connection))
+
+    def get_connections(self, device_pks):
+        return [(device_pair, link_lists) for device_pair, link_lists, _ in self.connections
+                if device_pair[0] in device_pks and device_pair[1] in device_pks]
+
+    def get_inactive_connections(self, device_pks):
+        return [inactive_connection for device_pair, _, inactive_connection in self.connections
+                if inactive_connection is not None and device_pair[0] in device_pks and device_pair[1] in device_pks]
+
+
+def get_topology_index():
+    global _topology_index
+    try:
+        version = redis_client.redis_client.get_topology_version()
+    except redis.RedisError as e:
+        logger.warning(f"Topology version is not available, topology is not cached: {e}")
+        return TopologyIndex()
+    if not any(version):
+        # topology changes can not be detected before redis has a version, so the index is not shared
+        return TopologyIndex()
+    with _topology_index_lock:
+        if _topology_index is None or _topology_index.version != version:
+            _topology_index = TopologyIndex(version)
+        return _topology_index
+
+
+def invalidate_topology_index():
+    try:
+        redis_client.redis_client.bump_topology_revision()
+    except redis.RedisError as e:
+        logger.warning(f"Topology revision can not be changed: {e}")
+
+
+def get_connection_key(device_pair):
+    return f'{device_pair[0]}_{device_pair[1]}'
+
+
+def get_topology_snapshot(topology_index):
+    return {
+        'connections': {
+            get_connection_key(device_pair): [[[link.get('pk'), link.get('active'), link.get('local_interface__speed')]
+                                               for link in link_list] for link_list in link_lists]
+            for device_pair, link_lists, _ in topology_index.connections
+        },
+        # every device field shown by maps and diagrams is compared, so its change is sent to them
+        'devices': {str(device_pk): [name, connection_is_active] for device_pk, name, connection_is_active
+                    in Device.objects.values_list('pk', 'name', 'connection_is_active')}
+    }
+
+
+def get_topology_diff(old_snapshot, new_snapshot):
+    connections = {}
+    for key, link_lists in new_snapshot['connections'].items():
+        if key not in old_snapshot['connections']:
+            connections[key] = 'added'
+        elif old_snapshot['connections'][key] != link_lists:
+            connections[key] = 'changed'
+    for key in old_snapshot['connections'].keys() - new_snapshot['connections'].keys():
+        connections[key] = 'removed'
+    devices = [device_pk for device_pk, device in new_snapshot['devices'].items()
+               if old_snapshot['devices'].get(device_pk) != device]
+    return {'connections': connections, 'devices': devices}
+
+
+def update_topology_history():
+    version = get_version_key(redis_client.redis_client.get_topology_version())
+    epoch, sequence, history_version = redis_client.redis_client.get_topology_history_state()
+    if epoch is not None and history_version == version:
+        return epoch, sequence
+    token = uuid.uuid4().hex
+    # another process is recording the same change, its history is used as soon as it is saved
+    if not redis_client.redis_client.acquire_topology_history_lock(token, TOPOLOGY_HISTORY_LOCK_TIMEOUT):
+        return epoch, sequence
+    try:
+        epoch, sequence, history_version = redis_client.redis_client.get_topology_history_state()
+        if epoch is not None and history_version == version:
+            return epoch, sequence
+        topology_index = get_topology_index()
+        if topology_index.version is None:
+            return epoch, sequence
+        version = get_version_key(topology_index.version)
+        snapshot = get_topology_snapshot(topology_index)
+        old_snapshot = redis_client.redis_client.get_topology_snapshot() if epoch is not None else None
+        diff = None
+        if old_snapshot is None:
+            epoch, sequence = uuid.uuid4().hex, 0
+        else:
+            diff = get_topology_diff(old_snapshot, snapshot)
+            if diff['connections'] or diff['devices']:
+                sequence += 1
+            else:
+                diff = None
+        redis_client.redis_client.set_topology_history(epoch, sequence, version, snapshot, diff,
+                                                       settings.TOPOLOGY_HISTORY_SIZE)
+        return epoch, sequence
+    finally:
+        redis_client.redis_client.release_topology_history_lock(token)
+
+
+def get_history_changes(epoch, since_sequence):
+    diffs = [diff for diff in redis_client.redis_client.get_topology_diffs(epoch) if diff['sequence'] > since_sequence]
+    # the history does not reach the requested version any more
+    if not diffs or diffs[0]['sequence'] != since_sequence + 1:
+        return None
+    connections = {}
+    devices = set()
+    for diff in diffs:
+        for key, change in diff['connections'].items():
+            # the first change of a connection tells whether the client already has it
+            connections.setdefault(key, change != 'added')
+        devices.update(diff['devices'])
+    return connections, devices
+
+
+def get_changes_version(visualisation_pk):
+    version = redis_client.redis_client.get_visualisation_version(visualisation_pk)
+    update_topology_history()
+    _, _, history_version = redis_client.redis_client.get_topology_history_state()
+    # history recorded by another process at the same time is not cached before it is saved
+    return version if history_version == get_version_key(version[:2]) else None
+
+
+def get_topology_changes(visualisation_pk, since):
+    try:
+        epoch, sequence = update_topology_history()
+        revision = redis_client.redis_client.get_visualisation_version(visualisation_pk)[2]
+    except redis.RedisError as e:
+        logger.warning(f"Topology history is not available, whole topology is sent: {e}")
+        return None, None
+    revision = revision.decode() if revision is not None else ''
+    version = f'{epoch or ""}:{sequence}:{revision}'
+    try:
+        since_epoch, since_sequence, since_revision = since.split(':')
+        since_sequence = int(since_sequence)
+    except (AttributeError, ValueError):
+        return version, None
+    if since_epoch != (epoch or '') or since_revision != revision or since_sequence > sequence:
+        return version, None
+    if since_sequence == sequence:
+        return version, ({}, set())
+    return version, get_history_changes(epoch, since_sequence)
+
+
+def split_connection_changes(connections, current_connections, device_pks):
+    added = {key: value for key, value in current_connections.items() if not connections[key]}
+    changed = {key: value for key, value in current_connections.items() if connections[key]}
+    removed = [key for key, existed in connections.items() if existed and key not in current_connections
+               and all(int(device_pk) in device_pks for device_pk in key.split('_'))]
+    return added, changed, removed